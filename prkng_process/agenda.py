@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+
+DAYS = 7
+# number of quarter hours in a day
+QUARTERS = 96
+DAY_MASK = (1 << QUARTERS) - 1
+WEEK_MASK = (1 << (DAYS * QUARTERS)) - 1
+# days of a leap year, so that every date has its own day
+YEAR_DAYS = 366
+YEAR_MASK = (1 << YEAR_DAYS) - 1
+
+
+class Agenda(object):
+    """
+    Weekly agenda as a 7 x 96 quarter-hour bitset, bit ``(day - 1) * 96 + quarter``
+    being set when the rule applies during that quarter hour (days from 1, Monday, to 7).
+
+    Union, intersection and difference are single integer operations on the whole week.
+    It converts to and from the JSON agendas of the rules (``{day: [[start, end], ...]}``)
+    keeping the quarter hours they cover, not their lists: ``to_json`` merges overlapping,
+    contiguous and repeated periods and lists every day, so only ``from_json(to_json())``
+    is exact. ``from_json`` takes periods on quarter hours ending after they start, the
+    agendas of the rules, some running over midnight, go through ``availability.rule_agenda``.
+    """
+    __slots__ = ('bits',)
+
+    def __init__(self, bits=0):
+        self.bits = bits & WEEK_MASK
+
+    @staticmethod
+    def quarter(hour):
+        """
+        Returns the index of the quarter hour starting at ``hour``
+        """
+        value = float(hour) * 4
+        if value != int(value) or not 0 <= value <= QUARTERS:
+            raise ValueError("{} is not a quarter hour of the day".format(hour))
+        return int(value)
+
+    @classmethod
+    def from_periods(cls, periods):
+        """
+        Build an agenda from (day, start, end) periods,
+        days after 7 being those of the next week (day 8 is Monday)
+        """
+        bits = 0
+        for day, start, end in periods:
+            first, last = cls.quarter(start), cls.quarter(end)
+            if last < first:
+                raise ValueError("Period [{}, {}] ends before it starts".format(start, end))
+            bits |= ((1 << (last - first)) - 1) << ((int(day) - 1) % DAYS * QUARTERS + first)
+        return cls(bits)
+
+    @classmethod
+    def from_json(cls, agenda):
+        """
+        Build an agenda from its JSON representation, days being ints or strings
+        """
+        return cls.from_periods(
+            (day, start, end) for day, hours in agenda.items() for start, end in hours)
+
+    def day(self, day):
+        """
+        Returns the bits of ``day`` (from 1 to 7)
+        """
+        return (self.bits >> ((day - 1) * QUARTERS)) & DAY_MASK
+
+    def periods(self, day):
+        """
+        Returns the [start, end] hours of the periods of ``day``, in order
+        """
+        res, bits = [], self.day(day)
+        while bits:
+            start = (bits & -bits).bit_length() - 1
+            shifted = bits >> start
+            # number of consecutive bits set from start
+            length = (shifted ^ (shifted + 1)).bit_length() - 1
+            res.append([start / 4.0, (start + length) / 4.0])
+            bits &= ~(((1 << length) - 1) << start)
+        return res
+
+    def to_json(self):
+        """
+        Returns the JSON representation of the agenda, with every day,
+        overlapping and contiguous periods being merged
+        """
+        return {day: self.periods(day) for day in range(1, DAYS + 1)}
+
+    def bitstring(self):
+        """
+        Returns the agenda as a string of 672 '0' and '1', Monday's first quarter hour first,
+        the text representation of a PostgreSQL ``bit(672)``
+        """
+        return format(self.bits, '0{}b'.format(DAYS * QUARTERS))[::-1]
+
+    @classmethod
+    def from_bitstring(cls, value):
+        return cls(int(value[::-1], 2))
+
+    def hours(self):
+        """
+        Returns the number of hours of the week covered by the agenda
+        """
+        return bin(self.bits).count('1') / 4.0
+
+    def overlaps(self, other):
+        return bool(self.bits & other.bits)
+
+    def covers(self, other):
+        return other.bits & ~self.bits == 0
+
+    @classmethod
+    def union_all(cls, agendas):
+        bits = 0
+        for agenda in agendas:
+            bits |= agenda.bits
+        return cls(bits)
+
+    def __or__(self, other):
+        return Agenda(self.bits | other.bits)
+
+    def __and__(self, other):
+        return Agenda(self.bits & other.bits)
+
+    def __sub__(self, other):
+        return Agenda(self.bits & ~other.bits)
+
+    def __invert__(self):
+        return Agenda(~self.bits)
+
+    def __eq__(self, other):
+        return isinstance(other, Agenda) and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __nonzero__(self):
+        return self.bits != 0
+
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        return "<Agenda {}>".format(self.to_json())
+
+
+# day of year of the first day of each month of a leap year
+MONTH_STARTS = [(datetime.date(2000, x, 1) - datetime.date(2000, 1, 1)).days for x in range(1, 13)]
+
+
+def day_of_year(month, day):
+    """
+    Returns the index of a date in a leap year, from 0 (January 1st) to 365 (December 31st)
+    """
+    return MONTH_STARTS[month - 1] + day - 1
+
+
+class DayMask(object):
+    """
+    Days of the year a rule applies during, as a 366 bits bitset, bit ``day_of_year(month, day)``
+    being set when the rule applies that day.
+
+    Built from the ``periods`` of the rules (``[[start, end], ...]`` as ``MM-DD``, both
+    included, a period ending before it starts running over the new year), telling
+    whether a rule applies on a date costs a single bit test however many periods it has.
+    A rule without periods applies every day.
+    """
+    __slots__ = ('bits',)
+
+    def __init__(self, bits=YEAR_MASK):
+        self.bits = bits & YEAR_MASK
+
+    @staticmethod
+    def parse(value):
+        """
+        Returns the day of year of a ``MM-DD`` (or ``M-DD``) string
+        """
+        month, day = value.strip().split('-')
+        return day_of_year(int(month), int(day))
+
+    @classmethod
+    def from_periods(cls, periods):
+        periods = [x for x in periods or [] if x]
+        if not periods:
+            return cls()
+        bits = 0
+        for start, end in periods:
+            first, last = cls.parse(start), cls.parse(end)
+            if last < first:
+                bits |= YEAR_MASK ^ ((1 << first) - 1)
+                first = 0
+            bits |= ((1 << (last - first + 1)) - 1) << first
+        return cls(bits)
+
+    @classmethod
+    def from_string(cls, periods):
+        """
+        Build a mask from periods as written in the rules files (``MM-DD,MM-DD;MM-DD,MM-DD``)
+        """
+        return cls.from_periods([x.split(',') for x in periods.split(';')] if periods else [])
+
+    def applies(self, date):
+        return bool(self.bits >> day_of_year(date.month, date.day) & 1)
+
+    def bitstring(self):
+        """
+        Returns the mask as a string of 366 '0' and '1', January 1st first,
+        the text representation of a PostgreSQL ``bit(366)``
+        """
+        return format(self.bits, '0{}b'.format(YEAR_DAYS))[::-1]
+
+    @classmethod
+    def from_bitstring(cls, value):
+        return cls(int(value[::-1], 2))
+
+    def __eq__(self, other):
+        return isinstance(other, DayMask) and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __repr__(self):
+        return "<DayMask {}>".format(self.bitstring())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Weekly availability index of the slots.
+
+Each interned slot rule (see ``common.normalise_slot_rules``) is compiled into
+a bitmap of the quarter hours of the week it applies during, one per kind of
+restriction, stored as a ``bit(672)`` in ``rule_availability`` next to the
+``bit(366)`` mask of the days of the year of its periods. The bitmaps of
+the rules of each slot are then merged by kind into ``slot_availability``,
+which the ``available_slots`` SQL function reads without evaluating any JSON.
+"""
+from __future__ import unicode_literals
+
+import math
+
+from .agenda import Agenda, DayMask, QUARTERS
+from .copyio import array_literal
+
+
+# kinds of the rules without any restriction type: no parking, or time limited parking
+# (which is allowed, ``available_slots`` returning the limit)
+FORBIDDEN = 'forbidden'
+TIME_MAX = 'time_max'
+
+rule_availability_columns = ('rule_id', 'kind', 'time_max_parking', 'days', 'buckets')
+
+
+def rule_kinds(rule):
+    """
+    Returns the kinds of restriction of a slot rule: its restriction types, or
+    ``time_max`` for a time limited parking and ``forbidden`` otherwise
+    """
+    if rule.get('restrict_types'):
+        return sorted(set(rule['restrict_types']))
+    if rule.get('time_max_parking'):
+        return [TIME_MAX]
+    return [FORBIDDEN]
+
+
+def rule_agenda(agenda):
+    """
+    Returns the ``Agenda`` of the quarter hours a JSON agenda applies during.
+
+    Hours are rounded outwards to quarter hours, and periods ending before
+    they start run over midnight.
+    """
+    periods = []
+    for day, hours in agenda.items():
+        for start, end in hours:
+            start = math.floor(start * 4) / 4
+            end = math.ceil(end * 4) / 4
+            if end < start:
+                periods.append((int(day), start, 24))
+                periods.append((int(day) + 1, 0, end))
+            else:
+                periods.append((int(day), start, end))
+    return Agenda.from_periods(periods)
+
+
+def compile_rule(rule_id, rule):
+    """
+    Returns the rows of ``rule_availability`` of a slot rule,
+    none if its agenda is empty
+    """
+    agenda = rule_agenda(rule.get('agenda') or {})
+    if not agenda:
+        return []
+    buckets = agenda.bitstring()
+    days = DayMask.from_periods(rule.get('periods')).bitstring()
+    return [[rule_id, kind, rule.get('time_max_parking') or None, days, buckets]
+            for kind in rule_kinds(rule)]
+
+
+def bucket(when):
+    """
+    Returns the index of the quarter hour of the week of the datetime ``when``
+    (see ``plfunctions.availability_bucket``)
+    """
+    return (when.isoweekday() - 1) * QUARTERS + when.hour * 4 + when.minute // 15
+
+
+def available_slots(db, when, bbox, accepted=('paid',)):
+    """
+    Returns the (id, time_max_parking) of the slots where parking is allowed
+    at ``when``, the time limit being None for unlimited parking
+
+    :param when: naive local datetime
+    :param bbox: (xmin, ymin, xmax, ymax) in EPSG:3857
+    :param accepted: restriction types the driver can park during (e.g. paid or permit)
+    """
+    return db.query("""
+        SELECT id, time_max_parking
+        FROM available_slots('{}'::timestamp, ST_MakeEnvelope({}, {}, {}, {}, 3857), {}::varchar[])
+        ORDER BY id
+    """.format(when.isoformat(), bbox[0], bbox[1], bbox[2], bbox[3],
+               "'{}'".format(array_literal(accepted))))
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the Python code run for each row of the pipeline.
+
+Each hot path is run on generated inputs of growing sizes, recording its throughput
+(relative to a reference loop, so that results compare across machines, best of
+several rounds) and the number of objects it allocates. Results are checked against ``baseline.json``:
+
+    $ python -m prkng_process.bench           # compare with the baseline
+    $ python -m prkng_process.bench --update  # store a new baseline
+
+The check also runs with the tests when ``PRKNG_BENCH`` is set, and
+``PRKNG_BENCH_TOLERANCE`` overrides the tolerated loss of throughput (0.5 by default).
+"""
+from __future__ import print_function, unicode_literals
+
+import gc
+import io
+import json
+import os
+import timeit
+
+from . import inputs
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+SIZES = [100, 1000, 10000]
+
+# relative loss of throughput tolerated
+TOLERANCE = float(os.environ.get('PRKNG_BENCH_TOLERANCE', 0.5))
+
+# relative increase of allocations tolerated, they do not depend on the load of the machine
+OBJECTS_TOLERANCE = 0.1
+
+# timings of each benchmark (and of the reference loop), the best one being kept
+ROUNDS = 5
+
+
+def hot_paths():
+    """
+    Returns the benchmarked functions, by name, as functions of the input size
+    returning the callable to time and the number of items it processes
+    """
+    from .. import pipeline, utils
+    from ..filters import group_rules, split_time_range
+
+    def call_each(func, items, star=True):
+        if star:
+            return lambda: [func(*x) for x in items]
+        return lambda: [func(x) for x in items]
+
+    return {
+        'filters.group_rules': lambda size: (
+            (lambda rows: lambda: group_rules(rows))(inputs.rules(size)), size),
+        'filters.split_time_range': lambda size: (
+            call_each(split_time_range, inputs.time_ranges(size)), size),
+        'pipeline._lot_agenda': lambda size: (
+            call_each(pipeline._lot_agenda, inputs.lots(size), star=False), size),
+        'pipeline._dynrule': lambda size: (
+            call_each(pipeline._dynrule, inputs.dynamic_rules(size)), size),
+        'utils.tstr_to_float': lambda size: (
+            call_each(utils.tstr_to_float, inputs.time_strings(size), star=False), size),
+    }
+
+
+def timing(func, repeat=5, duration=0.1):
+    """
+    Returns the best time of a call of ``func``, each measure running it
+    as many times as needed to last ``duration`` seconds
+    """
+    number = 1
+    while True:
+        start = timeit.default_timer()
+        for _ in range(number):
+            func()
+        elapsed = timeit.default_timer() - start
+        if elapsed >= duration:
+            break
+        number *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = timeit.default_timer()
+        for _ in range(number):
+            func()
+        best = min(best, timeit.default_timer() - start)
+    return best / number
+
+
+def reference():
+    res = {}
+    for idx in range(1000):
+        res[idx % 97] = [idx, str(idx)]
+
+
+def calibrate():
+    """
+    Returns the speed of the machine, in calls per second of a reference loop
+    """
+    return 1.0 / timing(reference)
+
+
+def allocations(func):
+    """
+    Returns the number of objects allocated by ``func`` and still alive
+    once it returns (its result and what it references)
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        res = func()
+        after = len(gc.get_objects())
+    finally:
+        gc.enable()
+    del res
+    return after - before
+
+
+def measure(func, items, rounds=ROUNDS):
+    """
+    Returns the throughput of ``func`` (items per second), relative to the speed
+    of the machine, and its allocations.
+
+    The speed of the machine and the throughput are both measured ``rounds`` times,
+    one after the other, and the best of each is kept: other processes can only
+    slow them down, and a slow down during one round does not count.
+    """
+    speed = throughput = 0.0
+    for _ in range(rounds):
+        speed = max(speed, calibrate())
+        throughput = max(throughput, items / timing(func))
+    return throughput, throughput / speed, allocations(func)
+
+
+def run(sizes=SIZES, names=None):
+    """
+    Run the benchmarks, returns a dict of name to size to results
+    (``relative`` being the throughput divided by the reference loop speed)
+    """
+    results = {}
+    for name, setup in sorted(hot_paths().items()):
+        if names and name not in names:
+            continue
+        for size in sizes:
+            func, items = setup(size)
+            throughput, relative, objects = measure(func, items)
+            results.setdefault(name, {})[str(size)] = {
+                'throughput': throughput,
+                'relative': relative,
+                'objects': objects,
+            }
+    return results
+
+
+def compare(baseline, results, tolerance=TOLERANCE, objects_tolerance=OBJECTS_TOLERANCE):
+    """
+    Returns the regressions of ``results`` compared to the ``baseline``
+    """
+    issues = []
+    for name, sizes in sorted(results.items()):
+        for size, res in sorted(sizes.items(), key=lambda x: int(x[0])):
+            base = baseline.get(name, {}).get(size)
+            if base is None:
+                continue
+            if res['relative'] < base['relative'] * (1 - tolerance):
+                issues.append("{} ({} items): throughput down {:.0%}".format(
+                    name, size, 1 - res['relative'] / base['relative']))
+            if res['objects'] > base['objects'] * (1 + objects_tolerance) + 10:
+                issues.append("{} ({} items): allocations went from {} to {}".format(
+                    name, size, base['objects'], res['objects']))
+    return issues
+
+
+def load_baseline(path=BASELINE):
+    with io.open(path, encoding='utf-8') as infile:
+        return json.load(infile)
+
+
+def save_baseline(results, path=BASELINE):
+    with io.open(path, 'w', encoding='utf-8') as outfile:
+        outfile.write(unicode(json.dumps(results, indent=2, sort_keys=True, separators=(',', ': '))) + '\n')
+
+
+def main(args):
+    results = run()
+    for name, sizes in sorted(results.items()):
+        for size, res in sorted(sizes.items(), key=lambda x: int(x[0])):
+            print("{:<28} {:>6} items {:>12.0f}/s {:>8} objects".format(
+                name, size, res['throughput'], res['objects']))
+    if '--update' in args:
+        save_baseline(results)
+        print("Baseline written to {}".format(BASELINE))
+        return 0
+    issues = compare(load_baseline(), results)
+    for issue in issues:
+        print(issue)
+    return 1 if issues else 0
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from . import main
+
+
+sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Realistic inputs of the Python hot paths, generated from the data files at any size
+"""
+from __future__ import unicode_literals
+
+import csv
+import os
+import random
+
+from ..database import Row
+
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+
+RULES_FILES = ['rules_montreal.csv', 'rules_quebec.csv', 'rules_newyork.csv',
+               'rules_seattle.csv', 'rules_boston.csv']
+
+RULES_COLUMNS = ['code', 'description', 'periods', 'time_max_parking', 'time_start',
+                 'time_end', 'time_duration', 'lun', 'mar', 'mer', 'jeu', 'ven', 'sam', 'dim',
+                 'daily', 'special_days', 'restrict_types', 'permit_no']
+
+LOTS_FILES = ['lots_montreal.csv', 'lots_quebec.csv', 'lots_seattle.csv', 'lots_boston.csv']
+
+LOTS_FLOATS = set(['hourly_normal', 'daily_normal', 'max_normal', 'hourly_special',
+                   'daily_special', 'max_special', 'daily_free', 'capacity'])
+
+
+def read_csv(filename):
+    with open(os.path.join(DATA, filename), 'rb') as infile:
+        return [{key: value.decode('utf-8') for key, value in row.items() if key}
+                for row in csv.DictReader(infile)]
+
+
+def number(value, cast=float):
+    return cast(value) if value not in (None, '') else None
+
+
+def repeat(rows, size, key=None):
+    """
+    Returns ``size`` rows cycling through ``rows``, ``key`` being suffixed
+    on each cycle so that the copies are distinct
+    """
+    res = []
+    for idx in range(size):
+        row = dict(rows[idx % len(rows)])
+        if key and idx >= len(rows):
+            row[key] = '{}-{}'.format(row[key], idx // len(rows))
+        res.append(row)
+    return res
+
+
+def rules(size):
+    """
+    Rules as read from the translation files (see ``pipeline.read_rules``), ordered by code
+    """
+    rows = []
+    for filename in RULES_FILES:
+        for row in read_csv(filename):
+            row.setdefault('restrict_types', row.pop('restrict_typ', ''))
+            rows.append(row)
+    index = {name: pos for pos, name in enumerate(RULES_COLUMNS)}
+    res = []
+    for row in sorted(repeat(rows, size, key='code'), key=lambda x: x['code']):
+        res.append(Row((
+            row['code'], row['description'], row.get('periods') or None,
+            number(row['time_max_parking']), number(row['time_start']),
+            number(row['time_end']), number(row['time_duration'])
+        ) + tuple(number(row[x], int) for x in RULES_COLUMNS[7:14]) + (
+            number(row['daily']), row.get('special_days') or None,
+            row.get('restrict_types') or None, row.get('permit_no') or None
+        ), index))
+    return res
+
+
+def time_ranges(size, seed=0):
+    """
+    (start, duration) of rules, some of them spanning several days
+    """
+    rand = random.Random(seed)
+    return [(float(rand.randint(0, 23)), float(rand.choice([1, 2, 4, 8, 12, 24, 36, 72])))
+            for _ in range(size)]
+
+
+def lots(size):
+    """
+    Parking lots as read from the ``*_parking_lots`` tables
+    """
+    rows = []
+    for filename in LOTS_FILES:
+        for row in read_csv(filename):
+            rows.append({key: (number(value) if key in LOTS_FLOATS else value or None)
+                         for key, value in row.items()})
+    index = {name: pos for pos, name in enumerate(sorted(rows[0]))}
+    return [Row(tuple(row[x] for x in sorted(rows[0])), index)
+            for row in repeat(rows, size)]
+
+
+def dynamic_rules(size, seed=0):
+    """
+    Rows of the Seattle dynamic rules query (see ``pipeline.dynamic_rules_seattle``),
+    with the period to generate: (row, period, start, end, count)
+    """
+    rand = random.Random(seed)
+    res = []
+    for idx in range(size):
+        start = rand.choice([420, 480, 540])
+        row = ((idx + 1, [str(rand.randint(1, 99999)) for _ in range(rand.randint(1, 5))]) +
+               (start, 1080) + (None,) * 16 +
+               tuple(rand.choice([1.0, 1.5, 2.5, 4.0]) for _ in range(9)) +
+               (rand.choice([None, 120, 240]), rand.random() < 0.2, rand.choice([None, '5', '12']),
+                None))
+        period, count = rand.choice([("MON-FRI", 1), ("SAT", 4), ("SUN", 7)])
+        res.append((row, period, start, 1080, count))
+    return res
+
+
+def time_strings(size, seed=0):
+    """
+    12-hour time strings like the ones of the Seattle peak hours
+    """
+    rand = random.Random(seed)
+    res = []
+    for _ in range(size):
+        hour, minute = rand.randint(1, 12), rand.choice([0, 15, 30, 45])
+        suffix = rand.choice(['AM', 'PM'])
+        res.append('{}:{:02d}{}'.format(hour, minute, suffix) if minute else
+                   '{}{}'.format(hour, suffix))
+    return res
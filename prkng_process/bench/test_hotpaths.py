@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from . import compare, load_baseline, measure, run
+
+
+def test_compare():
+    baseline = {'filters.group_rules': {'1000': {'relative': 1.0, 'objects': 1000}}}
+    assert compare(baseline, {'filters.group_rules': {
+        '1000': {'relative': 0.8, 'objects': 1050}}}, tolerance=0.3) == []
+    assert compare(baseline, {'filters.group_rules': {
+        '1000': {'relative': 0.4, 'objects': 2000}}}, tolerance=0.3) == [
+        'filters.group_rules (1000 items): throughput down 60%',
+        'filters.group_rules (1000 items): allocations went from 1000 to 2000']
+    assert compare(baseline, {'filters.group_rules': {
+        '1000': {'relative': 1.0, 'objects': 1200}}}) == [
+        'filters.group_rules (1000 items): allocations went from 1000 to 1200']
+    assert compare(baseline, {'utils.tstr_to_float': {
+        '1000': {'relative': 0.1, 'objects': 1}}}) == []
+
+
+def test_measure():
+    throughput, relative, objects = measure(lambda: [x for x in range(100)], 100, rounds=2)
+    assert throughput > 0 and relative > 0
+    assert objects >= 1
+
+
+@pytest.mark.skipif(not os.environ.get('PRKNG_BENCH'), reason="set PRKNG_BENCH to benchmark")
+def test_hot_paths():
+    assert compare(load_baseline(), run()) == []
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark: the slot stages are timed on synthetic cities of growing sizes
+to find the stages and statements whose time grows faster than the number of signposts.
+"""
+from __future__ import unicode_literals
+
+import io
+import json
+import math
+
+from .logger import Logger
+from .profiling import QueryProfiler
+from .synthetic import SyntheticCity, montreal_rules, setup
+
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+# growth exponent from which a stage is reported as super-linear
+SUPERLINEAR = 1.2
+
+
+def run_size(db, signposts, modules, seed=0):
+    """
+    Load a synthetic city of ``signposts`` signposts and time its processing
+
+    :param db: ``PostgresWrapper`` on a throwaway database
+    :param modules: SQL modules naming the timed statements
+    :returns: dict with the number of signposts and the time of each stage and statement
+    """
+    from . import pipeline
+
+    rules = montreal_rules()
+    total = SyntheticCity(signposts, rules, seed=seed).load(db)
+
+    setup(db)
+
+    profiler = QueryProfiler(modules)
+    db.profiler = profiler
+    try:
+        for stage, func, args in [
+                ('rules', pipeline.load_rules, (['montreal'],)),
+                ('process', pipeline.process_city, ('montreal',)),
+                ('shorten', pipeline.shorten_slots, ('montreal',)),
+                ('aggregate', pipeline.aggregate_slots, ('montreal',))]:
+            with profiler.stage(stage):
+                func(db, *args)
+    finally:
+        db.profiler = None
+
+    summary = profiler.summary()
+    return {
+        'signposts': total,
+        'stages': {x['stage']: x['time'] for x in summary['stages']},
+        'statements': {x['statement']: x['time'] for x in summary['statements']},
+    }
+
+
+def scaling(results, key):
+    """
+    Returns, for each name in ``results[...][key]``, its times per size and the exponent
+    of its growth between each pair of consecutive sizes (1 being linear)
+    """
+    results = sorted(results, key=lambda x: x['signposts'])
+    res = {}
+    for name in sorted(set(x for result in results for x in result[key])):
+        times = [result[key].get(name) for result in results]
+        exponents = []
+        for prev, cur, (t1, t2) in zip(results, results[1:], zip(times, times[1:])):
+            if t1 and t2 and cur['signposts'] > prev['signposts']:
+                exponents.append(math.log(t2 / t1) /
+                                 math.log(float(cur['signposts']) / prev['signposts']))
+            else:
+                exponents.append(None)
+        res[name] = {
+            'times': times,
+            'exponents': exponents,
+            'superlinear': any(x is not None and x >= SUPERLINEAR for x in exponents),
+        }
+    return res
+
+
+def run(db, modules, sizes=SIZES, seed=0, path=None):
+    """
+    Time the stages on synthetic cities of each size and report how they scale
+
+    :param path: optional path of the JSON report
+    """
+    results = []
+    for size in sizes:
+        Logger.info("Benchmark: synthetic city of {} signposts".format(size))
+        results.append(run_size(db, size, modules, seed=seed))
+
+    report = {
+        'signposts': [x['signposts'] for x in results],
+        'stages': scaling(results, 'stages'),
+        'statements': scaling(results, 'statements'),
+    }
+    for key in ('stages', 'statements'):
+        for name, stat in sorted(report[key].items(), key=lambda x: -(x[1]['times'][-1] or 0)):
+            Logger.info("Benchmark: {:<45} {} exponents {}{}".format(
+                name,
+                " ".join("{:8.2f}s".format(x) if x is not None else "       -" for x in stat['times']),
+                " ".join("{:.2f}".format(x) if x is not None else "-" for x in stat['exponents']),
+                " SUPER-LINEAR" if stat['superlinear'] else ""))
+    if path:
+        with io.open(path, 'w', encoding='utf-8') as outfile:
+            outfile.write(unicode(json.dumps(report, indent=2)))
+        Logger.info("Benchmark report written to {}".format(path))
+    return report
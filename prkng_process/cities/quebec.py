@@ -89,61 +89,65 @@ INSERT INTO quebec_bornes_raw (no_borne, nom_topog, isleft, geom, road_id, road_
     FROM bornes_proj s
 """
 
+# meters to cluster by road side (see ``clustering.cluster_meters``)
+get_paid_signposts = """
+SELECT id, road_id, isleft, road_pos, ST_X(geom), ST_Y(geom)
+FROM quebec_bornes_raw
+"""
+
+create_bornes_clusters = """
+DROP TABLE IF EXISTS quebec_bornes_clusters;
+CREATE TABLE quebec_bornes_clusters (id integer PRIMARY KEY, cluster integer, seq integer)
+"""
+
+# the line of a cluster joins its meters from the last merged one to the first,
+# as the former loop prepended each meter to it
 aggregate_paid_signposts = """
-DO
-$$
-DECLARE
-  borne record;
-  id_match integer;
-BEGIN
-  DROP TABLE IF EXISTS quebec_bornes_clustered;
-  CREATE TABLE quebec_bornes_clustered (id serial primary key, ids integer[], bornes integer[], geom geometry, way_name varchar, isleft integer, road_id integer);
-  DROP TABLE IF EXISTS quebec_paid_slots_raw;
-  CREATE TABLE quebec_paid_slots_raw (id serial primary key, road_id integer, bornes integer[], geom geometry, isleft integer);
-  CREATE INDEX ON quebec_paid_slots_raw USING GIST(geom);
-
-  FOR borne IN SELECT * FROM quebec_bornes_raw ORDER BY road_id, road_pos LOOP
-    SELECT id FROM quebec_bornes_clustered
-      WHERE borne.road_id = quebec_bornes_clustered.road_id
-      AND borne.isleft = quebec_bornes_clustered.isleft
-      AND ST_DWithin(borne.geom, quebec_bornes_clustered.geom, 10)
-      LIMIT 1 INTO id_match;
-
-    IF id_match IS NULL THEN
-      INSERT INTO quebec_bornes_clustered (ids, bornes, geom, way_name, isleft, road_id) VALUES
-        (ARRAY[borne.id], ARRAY[borne.no_borne], borne.geom, borne.nom_topog, borne.isleft, borne.road_id);
-    ELSE
-      UPDATE quebec_bornes_clustered SET geom = ST_MakeLine(borne.geom, geom),
-        ids = uniq(sort(array_prepend(borne.id, ids))), bornes = uniq(sort(array_prepend(borne.no_borne, bornes)))
-      WHERE quebec_bornes_clustered.id = id_match;
-    END IF;
-  END LOOP;
-
-  WITH tmp_slots as (
-    SELECT
-      road_id,
-      bornes,
-      isleft,
-      ST_Line_Locate_Point(r.geom, ST_StartPoint(qbc.geom)) AS start,
-      ST_Line_Locate_Point(r.geom, ST_EndPoint(qbc.geom)) AS end
-    FROM quebec_bornes_clustered qbc
-    JOIN roads r ON r.id = qbc.road_id
-  )
-  INSERT INTO quebec_paid_slots_raw (road_id, geom, bornes, isleft)
-    SELECT
-      r.id,
-      CASE
-          WHEN isleft = 1 then
-              ST_OffsetCurve(ST_Line_Substring(r.geom, LEAST(s.start, s.end), GREATEST(s.start, s.end)), {offset}, 'quad_segs=4 join=round')
-          ELSE
-              ST_OffsetCurve(ST_Line_Substring(r.geom, LEAST(s.start, s.end), GREATEST(s.start, s.end)), -{offset}, 'quad_segs=4 join=round')
-      END AS geom,
-      s.bornes,
-      s.isleft
-    FROM tmp_slots s
-    JOIN roads r ON r.id = s.road_id;
-END;
-$$ language plpgsql;
+DROP TABLE IF EXISTS quebec_bornes_clustered;
+CREATE TABLE quebec_bornes_clustered (id serial primary key, ids integer[], bornes integer[], geom geometry, way_name varchar, isleft integer, road_id integer);
+DROP TABLE IF EXISTS quebec_paid_slots_raw;
+CREATE TABLE quebec_paid_slots_raw (id serial primary key, road_id integer, bornes integer[], geom geometry, isleft integer);
+CREATE INDEX ON quebec_paid_slots_raw USING GIST(geom);
+
+INSERT INTO quebec_bornes_clustered (ids, bornes, geom, way_name, isleft, road_id)
+  SELECT
+    uniq(sort(array_agg(b.id))),
+    uniq(sort(array_agg(b.no_borne))),
+    CASE
+        WHEN count(*) = 1 THEN (array_agg(b.geom))[1]
+        ELSE ST_MakeLine(b.geom ORDER BY c.seq DESC)
+    END,
+    (array_agg(b.nom_topog ORDER BY c.seq))[1],
+    b.isleft,
+    b.road_id
+  FROM quebec_bornes_raw b
+  JOIN quebec_bornes_clusters c ON c.id = b.id
+  GROUP BY b.road_id, b.isleft, c.cluster
+  ORDER BY b.road_id, min(b.road_pos);
+
+WITH tmp_slots as (
+  SELECT
+    road_id,
+    bornes,
+    isleft,
+    ST_Line_Locate_Point(r.geom, ST_StartPoint(qbc.geom)) AS start,
+    ST_Line_Locate_Point(r.geom, ST_EndPoint(qbc.geom)) AS end
+  FROM quebec_bornes_clustered qbc
+  JOIN roads r ON r.id = qbc.road_id
+)
+INSERT INTO quebec_paid_slots_raw (road_id, geom, bornes, isleft)
+  SELECT
+    r.id,
+    CASE
+        WHEN isleft = 1 then
+            ST_OffsetCurve(ST_Line_Substring(r.geom, LEAST(s.start, s.end), GREATEST(s.start, s.end)), {offset}, 'quad_segs=4 join=round')
+        ELSE
+            ST_OffsetCurve(ST_Line_Substring(r.geom, LEAST(s.start, s.end), GREATEST(s.start, s.end)), -{offset}, 'quad_segs=4 join=round')
+    END AS geom,
+    s.bornes,
+    s.isleft
+  FROM tmp_slots s
+  JOIN roads r ON r.id = s.road_id;
 """
 
 # insert quebec signs
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import math
+from collections import defaultdict
+
+
+def chain_like_slots(slots, pairs, within):
+    """
+    Group adjacent slots and order each group so that its pieces can be joined
+    in one line, the way the former ``aggregate_like_slots`` loop did:
+
+    - slots are taken by road and position, and each slot is merged into the
+      first group made so far holding a slot adjacent to it, or starts a new group.
+      A slot adjacent to two groups only joins one, so they stay apart
+      (the loop took any of them, the oldest one is taken here);
+    - a slot starting where the line of its group ends is appended to it,
+      otherwise it is prepended;
+    - the signposts of a group are kept in the order its slots were merged,
+      whatever their place in the line.
+
+    :param slots: iterable of (id, rid, position, start_x, start_y, end_x, end_y)
+    :param pairs: iterable of (id, id) of slots with the same road and rules
+        less than ``within`` apart
+    :param within: distance under which two slots are considered adjacent
+    :returns: list of (id, cluster, rank, seq), cluster being the id of the first
+        slot of the group, rank the place of the slot in the line and seq
+        the order it was merged in, both starting at 1
+    """
+    neighbours = defaultdict(set)
+    for x, y in pairs:
+        neighbours[x].add(y)
+        neighbours[y].add(x)
+
+    # group of each slot merged so far, groups by order of creation
+    groups = {}
+    lines = []
+    for slot in sorted(slots, key=lambda x: (x[1], x[2], x[0])):
+        matches = [groups[x] for x in neighbours[slot[0]] if x in groups]
+        if not matches:
+            groups[slot[0]] = len(lines)
+            lines.append(([slot], [slot]))
+            continue
+        idx = min(matches)
+        line, merged = lines[idx]
+        end = line[-1]
+        if math.hypot(slot[3] - end[5], slot[4] - end[6]) <= within:
+            line.append(slot)
+        else:
+            line.insert(0, slot)
+        merged.append(slot)
+        groups[slot[0]] = idx
+
+    res = []
+    for line, merged in lines:
+        cluster = merged[0][0]
+        seqs = {slot[0]: seq for seq, slot in enumerate(merged, start=1)}
+        res.extend((slot[0], cluster, rank, seqs[slot[0]])
+                   for rank, slot in enumerate(line, start=1))
+    return res
+
+
+def segment_distance(point, start, end):
+    """
+    Returns the distance from ``point`` to the segment going from ``start`` to ``end``
+    """
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    length = dx * dx + dy * dy
+    ratio = 0.0
+    if length:
+        ratio = ((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / float(length)
+        ratio = max(0.0, min(1.0, ratio))
+    return math.hypot(point[0] - start[0] - ratio * dx, point[1] - start[1] - ratio * dy)
+
+
+def line_distance(point, points, within=None):
+    """
+    Returns the distance from ``point`` to the line joining ``points`` (or to
+    its single point), stopping as soon as a segment is less than ``within`` away
+    """
+    if len(points) == 1:
+        return math.hypot(point[0] - points[0][0], point[1] - points[0][1])
+    best = None
+    # latest segments first, the closest ones to meters taken by position
+    for pos in range(len(points) - 1, 0, -1):
+        dist = segment_distance(point, points[pos - 1], points[pos])
+        if best is None or dist < best:
+            best = dist
+        if within is not None and best <= within:
+            break
+    return best
+
+
+def cluster_meters(meters, within):
+    """
+    Group the parking meters of each road side the way the former
+    ``aggregate_paid_signposts`` loop did:
+
+    - meters are taken by road and position, and each meter joins the first cluster
+      made so far on its road side whose line is less than ``within`` away,
+      or starts a new cluster. A meter close to several clusters only joins one
+      (the loop took any of them, the oldest one is taken here);
+    - the line of a cluster joins all its meters, so that the distance is not only
+      measured to the last meter: a meter further than ``within`` from it still joins
+      the cluster if its line passes by.
+
+    :param meters: iterable of (id, road_id, isleft, road_pos, x, y)
+    :param within: distance under which a meter joins a cluster
+    :returns: list of (id, cluster, seq), cluster being the id of the first meter
+        of the cluster and seq the order the meter was merged in, starting at 1
+    """
+    # clusters of each road side, by order of creation:
+    # [id of the first meter, points, bounding box]
+    sides = defaultdict(list)
+    res = []
+    for meter in sorted(meters, key=lambda x: (x[1], x[3], x[0])):
+        x, y = point = (meter[4], meter[5])
+        clusters = sides[meter[1], meter[2]]
+        for cluster in clusters:
+            box = cluster[2]
+            # lines whose box is too far are not measured
+            if (x < box[0] - within or x > box[2] + within or
+                    y < box[1] - within or y > box[3] + within):
+                continue
+            if line_distance(point, cluster[1], within) <= within:
+                cluster[1].append(point)
+                cluster[2] = [min(box[0], x), min(box[1], y), max(box[2], x), max(box[3], y)]
+                res.append((meter[0], cluster[0], len(cluster[1])))
+                break
+        else:
+            clusters.append([meter[0], [point], [x, y, x, y]])
+            res.append((meter[0], meter[0], 1))
+    return res
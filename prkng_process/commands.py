@@ -8,6 +8,7 @@ import click
 import datetime
 import os
 import subprocess
+import sys
 
 
 @click.group()
@@ -19,9 +20,15 @@ def main():
 def export():
     """
     Export processed data tables to file
+
+    The rules of the slots are interned in slot_rules, the ``slots_rules`` view giving
+    them back in their former JSON form is exported as its definition: it is rebuilt
+    on import from slot_rules and the city partitions, exported along with their
+    parent table ``slots``.
     """
-    tables = ["montreal_slots", "quebec_slots", "newyork_slots", "seattle_slots", "boston_slots",
-        "cities", "city_assets", "parking_lots", "rules", "permits"]
+    tables = ["slots", "montreal_slots", "quebec_slots", "newyork_slots", "seattle_slots",
+        "boston_slots", "slot_rules", "slots_rules", "slot_availability", "cities", "city_assets",
+        "parking_lots", "rules", "permits"]
 
     Logger.info('Exporting processed tables...')
     export_dir = os.path.join(os.path.dirname(os.environ["PRKNG_SETTINGS"]), 'export')
@@ -42,24 +49,27 @@ def update(city):
     """
     Update data sources
     """
-    from .downloaders import DataSource
+    from .downloaders import DataSource, close_connections
     from .downloaders.cities import CitySources
     from .downloaders.zones import OsmLoader, ZoneLoader
-    osm = OsmLoader()
-    zl = ZoneLoader()
-    zl.update()
-    for source in CitySources():
-        obj = source()
-        if city != 'all' and obj.city != city:
-            continue
-        obj.download()
-        obj.load()
-        obj.load_rules()
-        # download osm data related to data extent
-        osm.download(obj.name, obj.get_extent())
-
-    # load every osm files in one shot
-    osm.load(city)
+    try:
+        osm = OsmLoader()
+        zl = ZoneLoader()
+        zl.update()
+        for source in CitySources():
+            obj = source()
+            if city != 'all' and obj.city != city:
+                continue
+            obj.download()
+            obj.load()
+            obj.load_rules()
+            # download osm data related to data extent
+            osm.download(obj.name, obj.get_extent())
+
+        # load every osm files in one shot
+        osm.load(city)
+    finally:
+        close_connections()
 
 
 @click.command(name="update-areas")
@@ -67,9 +77,13 @@ def update_areas():
     """
     Create a new version of service area statics and upload to S3
     """
+    from .downloaders import close_connections
     from .downloaders.zones import ServiceAreasLoader
-    sal = ServiceAreasLoader()
-    sal.process_areas()
+    try:
+        sal = ServiceAreasLoader()
+        sal.process_areas()
+    finally:
+        close_connections()
 
 
 @click.command()
@@ -78,18 +92,109 @@ def update_areas():
     help='Reprocess OSM roads/map data')
 @click.option('--debug', default=False,
     help='Create debug slot tables and keep temp tables')
-def process(city, osm, debug):
+@click.option('--jobs', default=1,
+    help='Number of independent stages to run at the same time')
+@click.option('--resume', default=False,
+    help='Skip the stages completed by a previous run whose input tables did not change')
+@click.option('--force', default=False,
+    help='Process cities even if their inputs did not change since their last run')
+@click.option('--profile', default=False,
+    help='Write a report of the time spent in each stage and SQL statement')
+@click.option('--explain', default=False,
+    help='Include buffer usage and temporary files from EXPLAIN ANALYZE in the profiling report')
+@click.option('--aggregate-loop', default=False,
+    help='Aggregate like slots with the former row by row loop (for comparison)')
+@click.option('--slow-query', default=10.0,
+    help='When profiling, log the queries taking more than this number of seconds')
+def process(city, osm, debug, jobs, resume, force, profile, explain, aggregate_loop, slow_query):
     """
     Process data and create the target tables
     """
     from . import pipeline
+    if profile:
+        profile_dir = os.path.join(os.path.dirname(os.environ["PRKNG_SETTINGS"]), 'profile')
+        if not os.path.exists(profile_dir):
+            os.mkdir(profile_dir)
+        profile = os.path.join(profile_dir, 'prkng-profile-{}'.format(
+            datetime.datetime.now().strftime('%Y%m%d-%H%M')))
+    else:
+        profile = None
     if city:
-        pipeline.run(city.split(","), osm, debug)
+        pipeline.run(city.split(","), osm, debug, jobs=jobs, resume=resume, force=force,
+            profile=profile, explain=explain, aggregate_loop=aggregate_loop,
+            slow_query=slow_query)
     else:
-        pipeline.run(osm=osm, debug=debug)
+        pipeline.run(osm=osm, debug=debug, jobs=jobs, resume=resume, force=force,
+            profile=profile, explain=explain, aggregate_loop=aggregate_loop,
+            slow_query=slow_query)
+
+
+def test_database():
+    """
+    Returns a connection to the test database (``PG_TEST_*`` settings)
+    """
+    from .database import PostgresWrapper, connect_string
+    return PostgresWrapper(connect_string({
+        key.replace('PG_TEST_', 'PG_'): value for key, value in CONFIG.items()
+        if key.startswith('PG_TEST_')}))
+
+
+@click.command(name="check-plans")
+@click.option('--city', help='A specific city (or comma-separated list of cities) to check')
+@click.option('--update', default=False,
+    help='Store the current plans as the new baseline')
+@click.option('--baseline', default=os.path.join(os.path.dirname(__file__), 'test', 'plans.json'),
+    help='Path of the baseline plans')
+@click.option('--large-rows', default=1000,
+    help='Number of rows from which a sequential scan on a table is reported')
+@click.option('--cost-ratio', default=2.0,
+    help='Estimated cost increase reported as a regression')
+@click.option('--load-fixtures', default=False,
+    help='Load the synthetic city the baseline is made on in the test database first')
+def check_plans(city, update, baseline, large_rows, cost_ratio, load_fixtures):
+    """
+    Compare the plans of the pipeline statements on the test database with the baseline
+    """
+    from . import pipeline, plans, synthetic
+    if not update and not os.path.exists(baseline):
+        raise click.ClickException(
+            "No baseline plans at {}, create them on the fixture data with "
+            "`prkng-process check-plans --load-fixtures True --update True`".format(baseline))
+    db = test_database()
+    if load_fixtures:
+        synthetic.load_fixture(db)
+    cities = city.split(",") if city else pipeline.CITIES
+    issues = plans.check_plans(db, pipeline.plan_modules(cities), pipeline.PLAN_PARAMS, baseline,
+        update=update, large_rows=large_rows, cost_ratio=cost_ratio)
+    db.close()
+    if issues:
+        sys.exit(1)
+
+
+@click.command(name="benchmark")
+@click.option('--sizes', default='1000,10000,100000,1000000',
+    help='Comma-separated numbers of signposts of the synthetic cities')
+@click.option('--seed', default=0,
+    help='Seed of the synthetic cities generator')
+def run_benchmark(sizes, seed):
+    """
+    Time the slot stages on synthetic cities of growing sizes (on the test database)
+    """
+    from . import benchmark, pipeline
+    bench_dir = os.path.join(os.path.dirname(os.environ["PRKNG_SETTINGS"]), 'benchmark')
+    if not os.path.exists(bench_dir):
+        os.mkdir(bench_dir)
+    path = os.path.join(bench_dir, 'prkng-benchmark-{}.json'.format(
+        datetime.datetime.now().strftime('%Y%m%d-%H%M')))
+    db = test_database()
+    benchmark.run(db, pipeline.SQL_MODULES, [int(x) for x in sizes.split(",")], seed=seed,
+        path=path)
+    db.close()
 
 
 main.add_command(export)
 main.add_command(update)
 main.add_command(update_areas)
 main.add_command(process)
+main.add_command(check_plans)
+main.add_command(run_benchmark)
@@ -10,9 +10,23 @@ rules_columns = (
     'agenda',
     'special_days',
     'restrict_types',
-    'permit_no'
+    'permit_no',
+    'days'
 )
 
+# columns of the rules generated programmatically (see ``pipeline.register_rules``)
+generated_rules_columns = (
+    'code',
+    'description',
+    'agenda',
+    'time_max_parking',
+    'restrict_types',
+    'permit_no',
+)
+
+# types of the ``rules`` columns above, for binary COPY
+generated_rules_types = ('varchar', 'varchar', 'jsonb', 'float8', 'varchar[]', 'varchar')
+
 create_rules = """
 DROP TABLE IF EXISTS rules;
 CREATE TABLE rules (
@@ -25,30 +39,112 @@ CREATE TABLE rules (
     , special_days varchar DEFAULT ''
     , restrict_types varchar[]
     , permit_no varchar
+    -- days of the year of the periods (see ``agenda.DayMask``), all year by default
+    , days bit(366) DEFAULT repeat('1', 366)::bit(366)
 )
 """
 
-get_rules_from_source = """
+# columns of the rules translation files (``data/rules_*.csv``), in order
+rules_translation_columns = (
+    'code',
+    'description',
+    'periods',
+    'time_max_parking',
+    'time_start',
+    'time_end',
+    'time_duration',
+    'lun',
+    'mar',
+    'mer',
+    'jeu',
+    'ven',
+    'sam',
+    'dim',
+    'daily',
+    'special_days',
+    'restrict_types',
+    'permit_no'
+)
+
+create_rules_translation = """
+DROP TABLE IF EXISTS {city}_rules_translation;
+CREATE TABLE {city}_rules_translation (
+    id serial
+    , code varchar
+    , description varchar
+    , periods varchar DEFAULT '{{}}'
+    , time_max_parking float DEFAULT 0.0
+    , time_start float
+    , time_end float
+    , time_duration float
+    , lun smallint
+    , mar smallint
+    , mer smallint
+    , jeu smallint
+    , ven smallint
+    , sam smallint
+    , dim smallint
+    , daily float
+    , special_days varchar DEFAULT ''
+    , restrict_types varchar DEFAULT ''
+    , permit_no varchar DEFAULT ''
+)
+"""
+
+# rules compiled from each translation file, kept between runs along with
+# the checksum they were compiled from (see ``pipeline.rules_checksum``)
+create_rules_cache = """
+CREATE TABLE IF NOT EXISTS rules_cache (
+    id serial PRIMARY KEY
+    , city varchar
+    , checksum varchar
+    , code varchar
+    , description varchar
+    , periods varchar[][] DEFAULT ARRAY[ARRAY[]]::varchar[]
+    , time_max_parking float DEFAULT 0.0
+    , agenda jsonb
+    , special_days varchar DEFAULT ''
+    , restrict_types varchar[]
+    , permit_no varchar
+    , days bit(366)
+);
+-- column added to existing caches (ADD COLUMN IF NOT EXISTS needs 9.6)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute
+            WHERE attrelid = 'rules_cache'::regclass AND attname = 'days' AND NOT attisdropped) THEN
+        ALTER TABLE rules_cache ADD COLUMN days bit(366);
+    END IF;
+END
+$$
+"""
+
+has_cached_rules = """
+SELECT EXISTS (
+    SELECT 1 FROM rules_cache WHERE city = '{city}' AND checksum = '{checksum}'
+)
+"""
+
+clear_rules_cache = """
+DELETE FROM rules_cache WHERE city = '{city}' AND checksum <> '{checksum}'
+"""
+
+insert_cached_rules = """
+INSERT INTO rules (code, description, periods, time_max_parking, agenda, special_days,
+    restrict_types, permit_no, days)
 SELECT
     code
     , description
     , periods
     , time_max_parking
-    , time_start
-    , time_end
-    , time_duration
-    , lun
-    , mar
-    , mer
-    , jeu
-    , ven
-    , sam
-    , dim
-    , daily
+    , agenda
     , special_days
     , restrict_types
     , permit_no
-FROM {source}
+    , days
+FROM rules_cache
+WHERE city = '{city}' AND checksum = '{checksum}'
+ORDER BY id
 """
 
 create_slots_temp = """
@@ -65,6 +161,8 @@ CREATE TABLE {city}_slots_temp
 )
 """
 
+# rules are only kept in slots until they are interned in slot_rules
+# (see normalise_slot_rules), slots_rules gives them back in their JSON form
 create_slots = """
 CREATE TABLE IF NOT EXISTS slots
 (
@@ -77,22 +175,60 @@ CREATE TABLE IF NOT EXISTS slots
   geom geometry(LineString,3857),
   geojson jsonb,
   button_location jsonb,
-  button_locations jsonb
-)
+  button_locations jsonb,
+  rule_ids integer[],
+  rule_extras jsonb
+);
+-- columns added to existing databases (ADD COLUMN IF NOT EXISTS needs 9.6)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute
+            WHERE attrelid = 'slots'::regclass AND attname = 'rule_ids' AND NOT attisdropped) THEN
+        ALTER TABLE slots ADD COLUMN rule_ids integer[];
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute
+            WHERE attrelid = 'slots'::regclass AND attname = 'rule_extras' AND NOT attisdropped) THEN
+        ALTER TABLE slots ADD COLUMN rule_extras jsonb;
+    END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS slot_rules
+(
+  id serial PRIMARY KEY,
+  rule jsonb NOT NULL
+);
+-- rules are unique by hash, a btree on the rules themselves fails on rules over 2.7 kB
+ALTER TABLE slot_rules DROP CONSTRAINT IF EXISTS slot_rules_rule_key;
+CREATE UNIQUE INDEX IF NOT EXISTS slot_rules_rule_md5 ON slot_rules (md5(rule::text));
+
+CREATE OR REPLACE VIEW slots_rules AS
+SELECT
+    s.id,
+    s.city,
+    s.rid,
+    s.signposts,
+    coalesce((
+        SELECT jsonb_agg(r.rule || (s.rule_extras -> (i.ord::integer - 1)) ORDER BY i.ord)
+        FROM unnest(s.rule_ids) WITH ORDINALITY i(id, ord)
+        JOIN slot_rules r ON r.id = i.id
+    ), '[]'::jsonb) AS rules,
+    s.way_name,
+    s.geom,
+    s.geojson,
+    s.button_location,
+    s.button_locations
+FROM slots s
 """
 
+# slots of each city are written directly to their partition,
+# the parent table is only used for reading
 create_slots_partition = """
 DROP RULE IF EXISTS slots_insert_{city} ON slots;
 DROP TABLE IF EXISTS {city}_slots;
 CREATE TABLE {city}_slots (
     CHECK ( city = '{city}' )
 ) INHERITS (slots);
-
-CREATE RULE slots_insert_{city} AS
-    ON INSERT TO slots
-        WHERE ( city = '{city}' )
-    DO INSTEAD
-        INSERT INTO {city}_slots VALUES (NEW.*);
 """
 
 create_parking_lots_raw = """
@@ -171,6 +307,52 @@ CREATE TABLE parking_lots
 )
 """
 
+# lots are loaded in bulk in a staging table,
+# client data is then computed for all of them at once
+create_parking_lots_staging = """
+DROP TABLE IF EXISTS parking_lots_raw;
+CREATE TABLE parking_lots_raw
+(
+  id serial PRIMARY KEY,
+  city varchar,
+  name varchar,
+  operator varchar,
+  address varchar,
+  description varchar,
+  agenda jsonb,
+  capacity integer,
+  attrs jsonb,
+  geom geometry(Point,3857),
+  active boolean,
+  street_view_head float,
+  street_view_id varchar,
+  partner_name varchar,
+  partner_id varchar
+)
+"""
+
+insert_parking_lots = """
+INSERT INTO parking_lots (city, name, operator, address, description, agenda, capacity, attrs,
+    geom, active, street_view, partner_name, partner_id, geojson)
+SELECT
+    city,
+    name,
+    operator,
+    address,
+    description,
+    agenda,
+    capacity,
+    attrs,
+    geom,
+    active,
+    json_build_object('head', street_view_head, 'id', street_view_id)::jsonb,
+    partner_name,
+    partner_id,
+    ST_AsGeoJSON(ST_Transform(geom, 4326))::jsonb
+FROM parking_lots_raw
+ORDER BY id
+"""
+
 aggregate_like_slots = """
 DO
 $$
@@ -179,52 +361,143 @@ DECLARE
   id_match integer;
 BEGIN
   FOR slot IN SELECT * FROM {city}_slots_temp ORDER BY rid, position LOOP
-    SELECT id FROM slots s
+    SELECT id FROM {city}_slots s
       WHERE slot.rid = s.rid
         AND slot.rules = s.rules
         AND ST_DWithin(slot.geom, s.geom, {within})
       LIMIT 1 INTO id_match;
 
     IF id_match IS NULL THEN
-      INSERT INTO slots (city, rid, signposts, rules, geom, way_name) VALUES
+      INSERT INTO {city}_slots (city, rid, signposts, rules, geom, way_name) VALUES
         ('{city}', slot.rid, ARRAY[slot.signposts], slot.rules, slot.geom, slot.way_name);
     ELSE
-      UPDATE slots SET geom =
+      UPDATE {city}_slots SET geom =
         (CASE WHEN ST_DWithin(ST_StartPoint(slot.geom), ST_EndPoint(geom), {within})
             THEN ST_MakeLine(geom, slot.geom)
             ELSE ST_MakeLine(slot.geom, geom)
         END),
         signposts = (signposts || ARRAY[slot.signposts])
-      WHERE city = '{city}' AND slots.id = id_match;
+      WHERE {city}_slots.id = id_match;
     END IF;
   END LOOP;
 END;
 $$ language plpgsql;
 """
 
-cut_slots_crossing_slots = """
-UPDATE {city}_slots_temp s set geom = (
-with tmp as (
-select
-    array_sort(
-        array_agg(
-            ST_Line_Locate_Point(s.geom, st_intersection(s.geom, o.geom))
-        )
-    ) as locations
-from {city}_slots_temp o
-where st_crosses(s.geom, o.geom) and s.id != o.id
-and st_geometrytype(st_intersection(s.geom, o.geom)) = 'ST_Point'
+# set-based alternative to aggregate_like_slots:
+# like slots are chained in python (see ``clustering.chain_like_slots``)
+# and merged in one statement, the geometry in line order (rank)
+# and the signposts in merge order (seq), as the loop did
+get_like_slots_pairs = """
+SELECT a.id, b.id
+FROM {city}_slots_temp a
+JOIN {city}_slots_temp b ON a.rid = b.rid
+    AND a.id < b.id
+    AND a.rules = b.rules
+    AND ST_DWithin(a.geom, b.geom, {within})
+"""
+
+get_slots_endpoints = """
+SELECT
+    id,
+    rid,
+    position,
+    ST_X(ST_StartPoint(geom)),
+    ST_Y(ST_StartPoint(geom)),
+    ST_X(ST_EndPoint(geom)),
+    ST_Y(ST_EndPoint(geom))
+FROM {city}_slots_temp
+"""
+
+create_slots_clusters = """
+DROP TABLE IF EXISTS {city}_slots_clusters;
+CREATE TABLE {city}_slots_clusters (
+    id integer PRIMARY KEY,
+    cluster integer,
+    rank integer,
+    seq integer
 )
-select
-    st_linesubstring(s.geom, locs.start, locs.stop)::geometry('linestring', 3857)
-from tmp, get_max_range(tmp.locations) as locs
+"""
+
+# merged slots are inserted along with the data sent to clients:
+# each geometry is projected to 4326 once and buttons are interpolated from it
+insert_clustered_slots = """
+WITH merged AS (
+    SELECT
+        min(s.rid) AS rid,
+        min(s.position) AS position,
+        array_agg(s.signposts ORDER BY c.seq) AS signposts,
+        (array_agg(s.rules))[1] AS rules,
+        ST_MakeLine(s.geom ORDER BY c.rank) AS geom,
+        (array_agg(s.way_name ORDER BY s.position, s.id))[1] AS way_name
+    FROM {city}_slots_temp s
+    JOIN {city}_slots_clusters c ON c.id = s.id
+    GROUP BY c.cluster
+), projected AS (
+    SELECT m.*, ST_Transform(m.geom, 4326) AS geom_4326
+    FROM merged m
+), buttons AS (
+    SELECT
+        p.*,
+        ST_Line_Interpolate_Point(p.geom_4326, 0.5) AS middle,
+        ST_Line_Interpolate_Point(p.geom_4326, 0.333) AS first_third,
+        ST_Line_Interpolate_Point(p.geom_4326, 0.666) AS second_third
+    FROM projected p
 )
-where exists (
-    select 1 from {city}_slots_temp a
-    where st_crosses(s.geom, a.geom)
-          and s.id != a.id
-          and st_geometrytype(st_intersection(s.geom, a.geom)) = 'ST_Point'
+INSERT INTO {city}_slots (city, rid, signposts, rules, geom, way_name,
+    geojson, button_location, button_locations)
+SELECT
+    '{city}',
+    rid,
+    signposts,
+    rules,
+    geom,
+    way_name,
+    ST_AsGeoJSON(geom_4326)::jsonb,
+    json_build_object('long', ST_X(middle), 'lat', ST_Y(middle))::jsonb,
+    (case when st_length(geom) >= 300 then array_to_json(array[
+        json_build_object('long', ST_X(first_third), 'lat', ST_Y(first_third)),
+        json_build_object('long', ST_X(second_third), 'lat', ST_Y(second_third))])::jsonb
+    else array_to_json(array[
+        json_build_object('long', ST_X(middle), 'lat', ST_Y(middle))])::jsonb end)
+FROM buttons
+ORDER BY rid, position
+"""
+
+# crossing points between slots, located on both slots of each crossing pair
+create_slots_crossings = """
+DROP TABLE IF EXISTS {city}_slots_crossings;
+CREATE TABLE {city}_slots_crossings AS
+WITH crossings AS (
+    SELECT
+        a.id AS a_id,
+        a.geom AS a_geom,
+        b.id AS b_id,
+        b.geom AS b_geom,
+        st_intersection(a.geom, b.geom) AS geom
+    FROM {city}_slots_temp a
+    JOIN {city}_slots_temp b ON a.id < b.id AND st_crosses(a.geom, b.geom)
 )
+SELECT a_id AS id, ST_Line_Locate_Point(a_geom, geom) AS location, geom
+FROM crossings
+WHERE st_geometrytype(geom) = 'ST_Point'
+UNION ALL
+SELECT b_id AS id, ST_Line_Locate_Point(b_geom, geom) AS location, geom
+FROM crossings
+WHERE st_geometrytype(geom) = 'ST_Point';
+CREATE INDEX ON {city}_slots_crossings (id);
+"""
+
+# keep the longest part of each slot between its crossing points
+cut_slots_crossing_slots = """
+UPDATE {city}_slots_temp s
+SET geom = st_linesubstring(s.geom, locs.start, locs.stop)::geometry('linestring', 3857)
+FROM (
+    SELECT id, array_sort(array_agg(location)) AS locations
+    FROM {city}_slots_crossings
+    GROUP BY id
+) c, get_max_range(c.locations) AS locs
+WHERE s.id = c.id
 """
 
 cut_slots_crossing_roads = """
@@ -263,7 +536,7 @@ INSERT INTO {city}_slots_temp (rid, position, signposts, rules, way_name, geom)
 """
 
 create_client_data = """
-UPDATE slots SET
+UPDATE {city}_slots SET
     geojson = ST_AsGeoJSON(ST_Transform(geom, 4326))::jsonb,
     button_location = json_build_object('long', ST_X(ST_Transform(ST_Line_Interpolate_Point(geom, 0.5), 4326)),
         'lat', ST_Y(ST_Transform(ST_Line_Interpolate_Point(geom, 0.5), 4326)))::jsonb,
@@ -275,10 +548,85 @@ UPDATE slots SET
         else array_to_json(array[
             json_build_object('long', ST_X(ST_Transform(ST_Line_Interpolate_Point(geom, 0.5), 4326)),
             'lat', ST_Y(ST_Transform(ST_Line_Interpolate_Point(geom, 0.5), 4326)))])::jsonb end)
-    WHERE city = '{city}'
 """
 
 
+# rule objects are interned without the attributes specific to each slot,
+# kept in the slot along with the ids of its rules. ids are never reused,
+# so that the partitions of cities not processed again stay valid
+normalise_slot_rules = """
+INSERT INTO slot_rules (rule)
+SELECT DISTINCT rule - 'address' - 'permit_no' - 'paid_hourly_rate'
+FROM {city}_slots, jsonb_array_elements(rules) AS rule
+ORDER BY 1
+ON CONFLICT (md5(rule::text)) DO NOTHING;
+
+UPDATE {city}_slots s
+SET rule_ids = n.rule_ids, rule_extras = n.rule_extras, rules = NULL
+FROM (
+    SELECT
+        s.id,
+        array_agg(r.id ORDER BY e.ord) AS rule_ids,
+        jsonb_agg((
+            SELECT coalesce(jsonb_object_agg(key, value), '{{}}'::jsonb)
+            FROM jsonb_each(e.rule)
+            WHERE key IN ('address', 'permit_no', 'paid_hourly_rate')
+        ) ORDER BY e.ord) AS rule_extras
+    FROM {city}_slots s, jsonb_array_elements(s.rules) WITH ORDINALITY e(rule, ord)
+    JOIN slot_rules r
+        ON md5(r.rule::text) = md5((e.rule - 'address' - 'permit_no' - 'paid_hourly_rate')::text)
+    GROUP BY s.id
+) n
+WHERE n.id = s.id;
+
+-- slots without rules
+UPDATE {city}_slots
+SET rule_ids = '{{}}', rule_extras = '[]'::jsonb, rules = NULL
+WHERE rules IS NOT NULL
+"""
+
+# weekly availability index (see ``availability``): bitmaps of the quarter hours of the week
+# each interned rule applies during by kind of restriction, merged by slot, along with
+# the days of the year they apply
+create_availability = """
+DROP TABLE IF EXISTS rule_availability;
+CREATE TABLE rule_availability (
+    rule_id integer,
+    kind varchar,
+    time_max_parking float,
+    days bit(366),
+    buckets bit(672)
+);
+
+DROP TABLE IF EXISTS slot_availability;
+CREATE TABLE slot_availability (
+    slot_id integer,
+    city varchar,
+    kind varchar,
+    time_max_parking float,
+    days bit(366),
+    buckets bit(672)
+)
+"""
+
+get_slot_rules = """
+SELECT id, rule FROM slot_rules
+"""
+
+insert_slot_availability = """
+INSERT INTO slot_availability (slot_id, city, kind, time_max_parking, days, buckets)
+SELECT
+    s.id
+    , s.city
+    , r.kind
+    , r.time_max_parking
+    , r.days
+    , bit_or(r.buckets)
+FROM slots s, unnest(s.rule_ids) AS i(id)
+JOIN rule_availability r ON r.rule_id = i.id
+GROUP BY s.id, s.city, r.kind, r.time_max_parking, r.days
+"""
+
 create_permit_lists = """
 DROP TABLE IF EXISTS permits;
 CREATE TABLE permits (
@@ -296,8 +644,79 @@ insert_permit_lists = """
         rules->>'permit_no',
         NOT (rules->>'permit_no' = ANY(ARRAY['bus','motorcycle','commercial','press','carshare','carpool']))
     FROM (
-        SELECT jsonb_array_elements(rules) AS rules FROM slots WHERE city = '{city}'
+        SELECT jsonb_array_elements(rule_extras) AS rules FROM {city}_slots
     ) foo
     WHERE rules->>'permit_no' != ''
     ORDER BY 1;
 """
+
+
+# pg_stat_statements counters of the current database, read before and after a profiled run
+has_stat_statements = """
+SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'
+"""
+
+get_stat_statements = """
+SELECT *
+FROM pg_stat_statements
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+"""
+
+# run-state of the pipeline stages, used to resume an interrupted run
+create_pipeline_state = """
+CREATE TABLE IF NOT EXISTS pipeline_state (
+    stage varchar PRIMARY KEY,
+    inputs jsonb,
+    finished timestamp DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS pipeline_table_versions (
+    name varchar PRIMARY KEY,
+    version integer NOT NULL DEFAULT 0
+);
+"""
+
+# oid and pipeline version of tables, a dropped and recreated table gets a new oid
+get_table_state = """
+SELECT
+    t.name,
+    c.oid::bigint,
+    coalesce(v.version, 0)
+FROM unnest(ARRAY[{tables}]::varchar[]) AS t(name)
+LEFT JOIN pg_class c ON c.relname = t.name
+    AND c.relkind = 'r'
+    AND c.relnamespace = (SELECT oid FROM pg_namespace WHERE nspname = 'public')
+LEFT JOIN pipeline_table_versions v ON v.name = t.name
+"""
+
+bump_table_versions = """
+INSERT INTO pipeline_table_versions (name, version)
+    SELECT unnest(ARRAY[{tables}]::varchar[]), 1
+ON CONFLICT (name) DO UPDATE SET version = pipeline_table_versions.version + 1
+"""
+
+save_stage_state = """
+DELETE FROM pipeline_state WHERE stage = '{stage}';
+INSERT INTO pipeline_state (stage, inputs) VALUES ('{stage}', '{inputs}'::jsonb)
+"""
+
+# fingerprints of the inputs of each city, as of its last successful processing
+create_input_fingerprints = """
+CREATE TABLE IF NOT EXISTS input_fingerprints (
+    city varchar PRIMARY KEY,
+    fingerprint jsonb,
+    updated timestamp DEFAULT now()
+);
+"""
+
+save_input_fingerprint = """
+DELETE FROM input_fingerprints WHERE city = '{city}';
+INSERT INTO input_fingerprints (city, fingerprint) VALUES ('{city}', '{fingerprint}'::jsonb)
+"""
+
+# row count and order-independent checksum of a table
+get_table_fingerprint = """
+SELECT
+    count(*),
+    coalesce(md5(string_agg(h, '' ORDER BY h)), '')
+FROM (SELECT md5(t::text) AS h FROM {table} t) AS rows
+"""
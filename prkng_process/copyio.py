@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+File-like adapters turning an iterable of rows into a COPY stream,
+read lazily by ``cursor.copy_expert`` so that rows are never all in memory.
+"""
+from __future__ import unicode_literals
+
+import json
+import struct
+
+
+# oids of the array element types supported in binary format
+ELEMENT_OIDS = {
+    'int2': 21,
+    'int4': 23,
+    'int8': 20,
+    'float4': 700,
+    'float8': 701,
+    'bool': 16,
+    'text': 25,
+    'varchar': 1043,
+}
+
+
+def pack(fmt, *values):
+    return struct.pack(str(fmt), *values)
+
+
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + pack('>ii', 0, 0)
+BINARY_TRAILER = pack('>h', -1)
+
+
+def array_literal(values):
+    """
+    Returns the text representation of a one-dimensional array,
+    to send arrays in COPY text format (where lists are dumped as JSON)
+    """
+    return '{' + ','.join(
+        'NULL' if x is None else
+        '"{}"'.format(unicode(x).replace('\\', '\\\\').replace('"', '\\"'))
+        for x in values) + '}'
+
+
+class CopyReader(object):
+    """
+    Base file-like object over rows, buffering at most one read worth of data
+    """
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = self.header()
+        self.done = False
+
+    def header(self):
+        return b''
+
+    def trailer(self):
+        return b''
+
+    def encode_row(self, row):
+        raise NotImplementedError
+
+    def read(self, size=-1):
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            try:
+                self.buffer += self.encode_row(next(self.rows))
+            except StopIteration:
+                self.buffer += self.trailer()
+                self.done = True
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+class TextCopyReader(CopyReader):
+    """
+    Rows in COPY text format. None is NULL, dicts and lists are dumped
+    as JSON, any other value is converted to text and escaped.
+    Other false values (0, '', False) are sent as is, callers wanting them
+    as NULL convert them first (see ``pipeline.cache_rules``).
+    """
+    @staticmethod
+    def encode_value(value):
+        if value is None:
+            return b'\\N'
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif isinstance(value, bool):
+            value = 't' if value else 'f'
+        elif not isinstance(value, basestring):
+            value = unicode(value)
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return (value.replace(b'\\', b'\\\\').replace(b'\t', b'\\t')
+                .replace(b'\n', b'\\n').replace(b'\r', b'\\r'))
+
+    def encode_row(self, row):
+        return b'\t'.join(self.encode_value(x) for x in row) + b'\n'
+
+
+class BinaryCopyReader(CopyReader):
+    """
+    Rows in COPY binary format, each column being encoded according to its type:
+
+    - ``int2``, ``int4``, ``int8``, ``float4``, ``float8``, ``bool``
+    - ``text``, ``varchar``, ``json``, ``jsonb`` (dicts and lists are dumped as JSON)
+    - ``geometry``: WKB or EWKB bytes (e.g. ``ST_AsEWKB`` output)
+    - arrays of the scalar types above, as nested lists (e.g. ``int4[]``)
+    """
+    def __init__(self, rows, types):
+        """
+        :param types: type of each column
+        """
+        self.encoders = [self.encoder(x) for x in types]
+        super(BinaryCopyReader, self).__init__(rows)
+
+    def header(self):
+        return BINARY_HEADER
+
+    def trailer(self):
+        return BINARY_TRAILER
+
+    @classmethod
+    def encoder(cls, type_name):
+        """
+        Returns a function encoding a value of ``type_name`` (without its length)
+        """
+        if type_name.endswith('[]'):
+            element = type_name.rstrip('[]')
+            return lambda value: cls.encode_array(value, element)
+        if type_name in ('int2', 'int4', 'int8', 'float4', 'float8'):
+            fmt = {'int2': '>h', 'int4': '>i', 'int8': '>q',
+                   'float4': '>f', 'float8': '>d'}[type_name]
+            # numbers are converted like the text format does (e.g. 2.0 to an integer column)
+            cast = float if type_name.startswith('float') else int
+            return lambda value: pack(fmt, cast(value))
+        if type_name == 'bool':
+            return lambda value: b'\x01' if value else b'\x00'
+        if type_name in ('text', 'varchar', 'json'):
+            return cls.encode_text
+        if type_name == 'jsonb':
+            return lambda value: b'\x01' + cls.encode_text(value)
+        if type_name == 'geometry':
+            return lambda value: bytes(value)
+        raise ValueError("Type '{}' is not supported by binary COPY".format(type_name))
+
+    @staticmethod
+    def encode_text(value):
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return bytes(value)
+
+    @classmethod
+    def encode_array(cls, value, element):
+        dims, level = [], value
+        while isinstance(level, (list, tuple)) and level:
+            dims.append(len(level))
+            level = level[0]
+
+        items = value
+        for _ in dims[1:]:
+            items = [x for sub in items for x in sub]
+        if not items:
+            return pack('>iii', 0, 0, ELEMENT_OIDS[element])
+
+        encode = cls.encoder(element)
+        data = [pack('>iii', len(dims), int(None in items), ELEMENT_OIDS[element])]
+        data.extend(pack('>ii', x, 1) for x in dims)
+        for item in items:
+            if item is None:
+                data.append(pack('>i', -1))
+            else:
+                encoded = encode(item)
+                data.append(pack('>i', len(encoded)) + encoded)
+        return b''.join(data)
+
+    def encode_row(self, row):
+        data = [pack('>h', len(row))]
+        for value, encode in zip(row, self.encoders):
+            if value is None:
+                data.append(pack('>i', -1))
+            else:
+                encoded = encode(value)
+                data.append(pack('>i', len(encoded)) + encoded)
+        return b''.join(data)
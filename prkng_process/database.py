@@ -1,13 +1,72 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+from collections import OrderedDict
 from contextlib import contextmanager
 
+import itertools
+import threading
+import time
 import psycopg2
 from psycopg2.extras import NamedTupleCursor
 
+from .copyio import BinaryCopyReader, TextCopyReader
 from .logger import Logger
 
 
+class Row(object):
+    """
+    Lightweight result row, giving access to values by position or by column name.
+    All rows of a query share the same column index.
+    """
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        """
+        :param values: tuple of values
+        :param index: dict of column name to position
+        """
+        self._values = values
+        self._index = index
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _asdict(self):
+        return OrderedDict(
+            (name, self._values[pos]) for name, pos in sorted(self._index.items(), key=lambda x: x[1]))
+
+    def __repr__(self):
+        return "Row({})".format(", ".join("{}={!r}".format(*x) for x in self._asdict().items()))
+
+
+def connect_string(config):
+    """
+    Returns the psycopg2 connection string from the settings
+    """
+    return ("host='{PG_HOST}' port={PG_PORT} dbname={PG_DATABASE} "
+            "user={PG_USERNAME} password={PG_PASSWORD} ".format(**config))
+
+
 class PostgresWrapper(object):
     """
     Postgres connection abstraction over psycopg2
@@ -16,7 +75,33 @@ class PostgresWrapper(object):
         """
         :param connect_string: "host=localhost dbname=prkng user=user password=***"
         """
-        self.db = psycopg2.connect(connect_string)
+        self.connect_string = connect_string
+        self._connection = None
+        self._cursors = itertools.count()
+        # optional ``QueryProfiler`` recording every query
+        self.profiler = None
+
+    @property
+    def db(self):
+        """
+        psycopg2 connection, opened on first use
+        """
+        if self._connection is None or self._connection.closed:
+            self._connection = psycopg2.connect(self.connect_string)
+        return self._connection
+
+    def reset(self):
+        """
+        Rollback any pending transaction so that the connection can be reused
+        """
+        self.profiler = None
+        if self._connection is not None and not self._connection.closed:
+            self._connection.rollback()
+
+    def close(self):
+        if self._connection is not None and not self._connection.closed:
+            self._connection.close()
+        self._connection = None
 
     @contextmanager
     def _query(self, namedtuple=None):
@@ -44,6 +129,9 @@ class PostgresWrapper(object):
         Execute query
         """
         res = []
+        if self.profiler:
+            return self._profiled_query(stmt, namedtuple)
+
         with self._query(namedtuple=namedtuple) as cur:
             res = cur.execute(stmt)
 
@@ -55,6 +143,57 @@ class PostgresWrapper(object):
                     pass
         return res
 
+    def _profiled_query(self, stmt, namedtuple=None):
+        """
+        Execute query and record it with the profiler
+        """
+        res, plan = [], None
+        start = time.time()
+        with self._query(namedtuple=namedtuple) as cur:
+            if self.profiler.explainable(stmt):
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + stmt)
+                plan = cur.fetchone()[0]
+            else:
+                res = cur.execute(stmt)
+
+                if cur.rowcount != -1:
+                    try:
+                        res = cur.fetchall()
+                    except psycopg2.ProgrammingError:
+                        # in case of update or insert
+                        pass
+        self.profiler.record(stmt, time.time() - start, cur.rowcount, plan)
+        return res
+
+    def iter_query(self, stmt, itersize=2000):
+        """
+        Execute query and iterate over the resulting ``Row``s using a server-side cursor,
+        fetching ``itersize`` rows at a time, so that the result is never entirely in memory.
+
+        The cursor is declared WITH HOLD, so it survives commits made by
+        other queries on this connection while iterating.
+        """
+        cur = self.db.cursor(name="iter_query_{}".format(next(self._cursors)), withhold=True)
+        cur.itersize = itersize
+        try:
+            cur.execute(stmt)
+            index = None
+            for values in cur:
+                if index is None:
+                    index = {col[0]: pos for pos, col in enumerate(cur.description)}
+                yield Row(values, index)
+            cur.close()
+            self.db.commit()
+        except psycopg2.Error as err:
+            Logger.error(err.message.strip())
+            Logger.error("Query : {}".format(cur.query))
+            Logger.warning("Rollbacking")
+            self.db.rollback()
+            raise err
+        finally:
+            if not cur.closed:
+                cur.close()
+
     def queries(self, stmts):
         """
         Execute several statements in the same transaction.
@@ -65,7 +204,10 @@ class PostgresWrapper(object):
         res = []
         with self._query() as cur:
             for stmt in stmts:
+                start = time.time()
                 cur.execute(stmt)
+                if self.profiler:
+                    self.profiler.record(stmt, time.time() - start, cur.rowcount)
             if cur.rowcount != -1:
                 try:
                     res = cur.fetchall()
@@ -92,9 +234,11 @@ class PostgresWrapper(object):
 
     def create_index(self, table, column, index_type='btree'):
         """
-        Create indexes on ``column`` using ``index_type``
+        Create indexes on ``column`` using ``index_type``,
+        unless the same index already exists
         """
-        self.query("CREATE INDEX on {table} USING {index_type}({column})"
+        index_name = "{table}_{column}_{index_type}_idx".format(**locals())[:63]
+        self.query("CREATE INDEX IF NOT EXISTS {index_name} on {table} USING {index_type}({column})"
                    .format(**locals()))
 
     def vacuum_analyze(self, schema, table):
@@ -116,18 +260,126 @@ class PostgresWrapper(object):
         # switch to default isolation level
         self.db.set_session(autocommit=False)
 
-    def copy_from(self, schema, table, columns, values):
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager committing the copies made with ``commit=False``
+        once all of them succeeded, rollbacking otherwise
+        """
+        try:
+            yield self
+            self.db.commit()
+        except Exception:
+            Logger.warning("Rollbacking")
+            self.db.rollback()
+            raise
+
+    def copy_from(self, schema, table, columns, values, types=None, commit=True):
         """
         Uses the efficient PostgreSQL COPY command to move data
-        from file-like object to tables
+        from file-like object to tables.
+
+        ``values`` can be any iterable of rows (e.g. a generator), rows are
+        encoded and sent as COPY reads them.
+
+        :param types: type of each column (see ``BinaryCopyReader``)
+            to send rows in binary format, text format is used otherwise
+        :param commit: commit right after the copy, set to False
+            to group several copies in a ``transaction``
         """
-        from cStringIO import StringIO
+        if types:
+            reader = BinaryCopyReader(values, types)
+        else:
+            reader = TextCopyReader(values)
+        stmt = "COPY {}.{} ({}) FROM STDIN{}".format(
+            schema, table, ", ".join(columns), " WITH (FORMAT binary)" if types else "")
+        start = time.time()
         cur = self.db.cursor()
-        cur.copy_from(
-            StringIO(
-                '\n'.join('\t'.join(str(col) if col else '\\N' for col in line) for line in values)
-            ),
-            '{}.{}'.format(schema, table),
-            columns=columns,
-        )
-        self.db.commit()
+        cur.copy_expert(stmt, reader)
+        if self.profiler:
+            self.profiler.record(stmt, time.time() - start, cur.rowcount)
+        if commit:
+            self.db.commit()
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of ``PostgresWrapper``, connecting lazily.
+
+    Connections are either borrowed with ``get`` and given back with ``put``
+    (e.g. by each worker running pipeline stages), or bound to the calling
+    thread with ``thread_connection``. At most ``maxconn`` connections are
+    made, ``get`` waiting for one to be given back once they are all in use.
+    """
+    def __init__(self, connect_string, maxconn=None):
+        """
+        :param maxconn: maximum number of connections, unlimited if None
+        """
+        self.connect_string = connect_string
+        self.maxconn = maxconn
+        self.idle = []
+        # every connection made, borrowed or idle
+        self.opened = []
+        self.lock = threading.Condition()
+        self.local = threading.local()
+
+    def get(self):
+        """
+        Returns an idle connection, or a new one if there is none
+        """
+        with self.lock:
+            while not self.idle and self.maxconn and len(self.opened) >= self.maxconn:
+                self.lock.wait()
+            if self.idle:
+                return self.idle.pop()
+            db = PostgresWrapper(self.connect_string)
+            self.opened.append(db)
+            return db
+
+    def put(self, db):
+        """
+        Give back a connection obtained with ``get``
+        """
+        db.reset()
+        with self.lock:
+            self.idle.append(db)
+            self.lock.notify()
+
+    def thread_connection(self):
+        """
+        Returns the connection of the calling thread, taken from the pool on first call
+        """
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self.get()
+        return db
+
+    def closeall(self):
+        """
+        Close every connection made, including the borrowed and thread bound ones,
+        which reconnect if they are used again
+        """
+        with self.lock:
+            for db in self.opened:
+                db.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(connect_string, maxconn=None):
+    """
+    Returns the pool shared by all users of ``connect_string``
+
+    :param maxconn: if given, maximum number of connections of the pool from now on
+    """
+    with _pools_lock:
+        if connect_string not in _pools:
+            _pools[connect_string] = ConnectionPool(connect_string)
+        pool = _pools[connect_string]
+    if maxconn is not None:
+        with pool.lock:
+            pool.maxconn = maxconn
+            pool.lock.notify_all()
+    return pool
@@ -1,17 +1,27 @@
 import os
 
 from .. import CONFIG
-from ..database import PostgresWrapper
+from ..database import connect_string, get_pool
 
 
 class DataSource(object):
     """
     Base class for datasource
     """
-    def __init__(self):
-        self.db = PostgresWrapper(
-            "host='{PG_HOST}' port={PG_PORT} dbname={PG_DATABASE} "
-            "user={PG_USERNAME} password={PG_PASSWORD} ".format(**CONFIG))
+    @property
+    def db(self):
+        """
+        Connection shared by the data sources of the current thread,
+        opened on first use
+        """
+        return get_pool(connect_string(CONFIG)).thread_connection()
+
+
+def close_connections():
+    """
+    Close the connections of the data sources of every thread
+    """
+    get_pool(connect_string(CONFIG)).closeall()
 
 
 def script(src):
@@ -1,47 +1,61 @@
 # -*- coding: utf-8 -*-
-from collections import namedtuple, defaultdict
-from itertools import groupby
+from collections import namedtuple, defaultdict, OrderedDict
+
+from .agenda import DayMask
 
 
 def group_rules(rules):
     """
     group rules having the same code and contructs an array of
-    parking time for each day
+    parking time for each day, and the mask of the days of the year
+    of their periods (see ``agenda.DayMask``).
+
+    Rules are grouped in a single pass on (code, periods, time_max_parking),
+    so that they do not need to be sorted; groups are returned in the order
+    of their first rule.
     """
     singles = namedtuple('singles', (
         'code', 'description', 'periods', 'time_max_parking', 'agenda',
-        'special_days', 'restrict_types', 'permit_no'
+        'special_days', 'restrict_types', 'permit_no', 'days'
     ))
 
-    results = []
+    # key -> (last rule of the group, agenda of the group)
+    groups = OrderedDict()
+    # periods -> days of the year, as a bit string
+    days_of_periods = {}
     days = ('lun', 'mar', 'mer', 'jeu', 'ven', 'sam', 'dim')
 
-    for code, group in groupby(rules, lambda x: (x.code, x.periods, x.time_max_parking)):
+    for part in rules:
+        key = (part.code, part.periods, part.time_max_parking)
+        day_dict = groups[key][1] if key in groups else defaultdict(list)
+        groups[key] = (part, day_dict)
 
-        day_dict = defaultdict(list)
+        for numday, day in enumerate(days, start=1):
+            isok = getattr(part, day) or part.daily
+            if not isok:
+                continue
+            # others cases
+            if part.time_end:
+                day_dict[numday].append([part.time_start, part.time_end])
 
-        for part in group:
-            for numday, day in enumerate(days, start=1):
-                isok = getattr(part, day) or part.daily
-                if not isok:
-                    continue
-                # others cases
-                if part.time_end:
-                    day_dict[numday].append([part.time_start, part.time_end])
+            elif part.time_duration:
+                fdl, ndays, ldf = split_time_range(part.time_start, part.time_duration)
+                # first day
+                day_dict[numday].append([part.time_start, part.time_start + fdl])
 
-                elif part.time_duration:
-                    fdl, ndays, ldf = split_time_range(part.time_start, part.time_duration)
-                    # first day
-                    day_dict[numday].append([part.time_start, part.time_start + fdl])
+                for inter_day in range(1, ndays + 1):
+                    day_dict[numday + inter_day].append([0, 24])
+                # last day
+                if ldf != 0:
+                    day_dict[numday].append([0, ldf])
 
-                    for inter_day in range(1, ndays + 1):
-                        day_dict[numday + inter_day].append([0, 24])
-                    # last day
-                    if ldf != 0:
-                        day_dict[numday].append([0, ldf])
+            else:
+                day_dict[numday].append([0, 24])
 
-                else:
-                    day_dict[numday].append([0, 24])
+    results = []
+    for part, day_dict in groups.values():
+        if part.periods not in days_of_periods:
+            days_of_periods[part.periods] = DayMask.from_string(part.periods).bitstring()
 
         # add an empty list for empty days
         for numday, day in enumerate(days, start=1):
@@ -56,7 +70,8 @@ def group_rules(rules):
             dict(day_dict),
             part.special_days,
             ("{"+part.restrict_types+"}") if part.restrict_types else "{}",
-            part.permit_no
+            part.permit_no,
+            days_of_periods[part.periods]
         ))
 
     return results
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+
+from . import common
+
+
+def file_fingerprint(path):
+    """
+    Returns the sha1 of the file at ``path``, None if it does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    sha = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def table_exists(db, table):
+    return db.query("SELECT to_regclass('public.{}') IS NOT NULL".format(table))[0][0]
+
+
+def table_fingerprint(db, table):
+    """
+    Returns the row count and a checksum of the rows of ``table``,
+    None if the table does not exist
+    """
+    if not table_exists(db, table):
+        return None
+    count, checksum = db.query(common.get_table_fingerprint.format(table=table))[0]
+    return "{}:{}".format(count, checksum)
+
+
+def input_fingerprint(db, files=(), tables=(), memo=None):
+    """
+    Returns the fingerprint of a set of input files and tables
+
+    :param files: paths of the files
+    :param tables: names of the tables
+    :param memo: optional dict of the fingerprints of the tables already read,
+        completed with the new ones, so that tables shared by several
+        fingerprints (like the roads) are only read once
+    """
+    if memo is None:
+        memo = {}
+    for x in tables:
+        if x not in memo:
+            memo[x] = table_fingerprint(db, x)
+    return {
+        'files': {os.path.basename(x): file_fingerprint(x) for x in files},
+        'tables': {x: memo[x] for x in tables}
+    }
+
+
+class InputFingerprints(object):
+    """
+    Stores the fingerprint of the inputs of each city when it has been
+    successfully processed, so that unchanged cities can be skipped
+    """
+    def setup(self, db):
+        db.query(common.create_input_fingerprints)
+
+    def get(self, db, city):
+        """
+        Returns the fingerprint stored for ``city``, None if there is none
+        """
+        res = db.query("SELECT fingerprint FROM input_fingerprints WHERE city = '{}'".format(city))
+        return res[0][0] if res else None
+
+    def save(self, db, city, value):
+        db.query(common.save_input_fingerprint.format(
+            city=city, fingerprint=json.dumps(value).replace("'", "''")))
+
+    def unchanged(self, db, city, value):
+        """
+        Returns True if ``value`` is the fingerprint stored for ``city``
+        and none of its inputs is missing
+        """
+        if any(x is None for x in value['files'].values() + value['tables'].values()):
+            return False
+        return self.get(db, city) == value
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict
+
+from .logger import Logger
+
+
+class IndexManager(object):
+    """
+    Collects the indexes tables need and builds them once the tables are loaded.
+
+    Indexes already existing are skipped, and indexes of different tables
+    are built at the same time on separate connections.
+    """
+    def __init__(self, connect, jobs=1, release=None):
+        """
+        :param connect: callable returning a ``PostgresWrapper``
+        :param jobs: maximum number of tables indexed at the same time
+        :param release: optional callable receiving the connections once done
+        """
+        self.connect = connect
+        self.release = release
+        self.jobs = max(1, int(jobs))
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def declare(self, table, column, index_type='btree'):
+        """
+        Declare an index on ``column`` of ``table``, built on the next call to ``build``
+        """
+        with self.lock:
+            indexes = self.pending.setdefault(table, [])
+            if (column, index_type) not in indexes:
+                indexes.append((column, index_type))
+
+    def _build_table(self, db, table, indexes):
+        for column, index_type in indexes:
+            db.create_index(table, column, index_type=index_type)
+        Logger.debug("Indexes built for {}".format(table))
+
+    def _release(self, db):
+        if db is not None and self.release:
+            self.release(db)
+
+    def build(self, tables=None):
+        """
+        Build the declared indexes
+
+        :param tables: only build the indexes of these tables (all by default)
+        """
+        with self.lock:
+            todo = [(x, self.pending.pop(x)) for x in list(self.pending)
+                    if tables is None or x in tables]
+        if not todo:
+            return
+
+        if self.jobs == 1 or len(todo) == 1:
+            db = self.connect()
+            try:
+                for table, indexes in todo:
+                    self._build_table(db, table, indexes)
+            finally:
+                self._release(db)
+            return
+
+        errors = []
+
+        def worker():
+            db = None
+            while True:
+                with self.lock:
+                    if not todo or errors:
+                        self._release(db)
+                        return
+                    table, indexes = todo.pop(0)
+                try:
+                    if db is None:
+                        db = self.connect()
+                    self._build_table(db, table, indexes)
+                except Exception as err:
+                    with self.lock:
+                        errors.append(err)
+
+        workers = [threading.Thread(target=worker) for _ in range(min(self.jobs, len(todo)))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if errors:
+            raise errors[0]
@@ -1,31 +1,136 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import binascii
 import csv
-import json
 import os
 
-from . import CONFIG, common, osm, plfunctions
+from . import CONFIG, availability, common, osm, plfunctions
 from .cities import montreal as mrl
 from .cities import quebec as qbc
 from .cities import newyork as nyc
 from .cities import seattle as sea
 from .cities import boston as bos
-from .database import PostgresWrapper
+from .clustering import chain_like_slots, cluster_meters
+from .copyio import array_literal
+from .database import Row, connect_string, get_pool
 from .filters import group_rules
+from .fingerprint import InputFingerprints, file_fingerprint, input_fingerprint, table_exists
+from .indexes import IndexManager
 from .logger import Logger
+from .profiling import QueryProfiler
+from .scheduler import RunState, Scheduler
 from .utils import pretty_time, tstr_to_float
 
 
 # distance from road to slot
 LINE_OFFSET = 6
 CITIES = ["montreal", "quebec", "newyork", "seattle", "boston"]
-db = PostgresWrapper(
-    "host='{PG_HOST}' port={PG_PORT} dbname={PG_DATABASE} "
-    "user={PG_USERNAME} password={PG_PASSWORD} ".format(**CONFIG))
 
+# source tables read by each city processing stage (on top of rules and roads)
+CITY_SOURCES = {
+    "montreal": ["montreal_poteaux", "montreal_descr_panneau", "montreal_geobase",
+        "montreal_geobase_double", "montreal_data_verdun", "montreal_bornes", "permit_zones"],
+    "quebec": ["quebec_panneau", "quebec_bornes"],
+    "newyork": ["newyork_signs_raw", "newyork_geobase", "newyork_snd", "newyork_roads_locations",
+        "metered_rate_zones"],
+    "seattle": ["seattle_signs_raw", "seattle_curblines", "seattle_parklines", "seattle_geobase",
+        "seattle_sign_codes"],
+    "boston": ["boston_geobase", "boston_metro_geobase", "meters_boston", "boston_address",
+        "cambridge_address", "cambridge_sweep_zones", "boston_sweep_sched"]
+}
+
+# tables created or modified by each city processing stage
+CITY_TABLES = {
+    "montreal": ["montreal_poteaux", "montreal_roads_geobase", "montreal_sign", "montreal_signpost",
+        "montreal_signpost_onroad", "montreal_slots_likely", "montreal_nextpoints",
+        "montreal_slots_temp"],
+    "quebec": ["quebec_sign", "quebec_signpost", "quebec_signpost_temp", "quebec_signpost_onroad",
+        "quebec_slots_likely", "quebec_nextpoints", "quebec_slots_temp", "quebec_bornes_raw",
+        "quebec_bornes_clusters", "quebec_bornes_clustered", "quebec_paid_slots_raw"],
+    "newyork": ["newyork_sign", "newyork_signpost", "newyork_roads_geobase",
+        "newyork_signpost_onroad", "newyork_slots_likely", "newyork_nextpoints",
+        "newyork_slots_temp"],
+    "seattle": ["seattle_roads_geobase", "seattle_sign", "seattle_signpost",
+        "seattle_signpost_onroad", "seattle_slots_likely", "seattle_nextpoints",
+        "seattle_slots_temp"],
+    "boston": ["boston_roads_geobase", "boston_sign", "boston_signpost", "boston_signpost_onroad",
+        "boston_slots_likely", "boston_nextpoints", "boston_slots_temp"]
+}
+
+# files of the data directory and code used by each city processing stage
+CITY_FILES = {
+    "montreal": ["rules_montreal.csv", "montreal_load_rules.sql", "data_verdun.csv",
+        "montreal_load_panneau_descr.sql"],
+    "quebec": ["rules_quebec.csv", "quebec_load_rules.sql"],
+    "newyork": ["rules_newyork.csv", "newyork_load_rules.sql"],
+    "seattle": ["rules_seattle.csv", "seattle_load_rules.sql"],
+    "boston": ["rules_boston.csv", "boston_load_rules.sql", "data_boston.csv",
+        "boston_load_data.sql"]
+}
+
+# modules holding the SQL statements, by the name they are reported under
+SQL_MODULES = {
+    "common": common, "osm": osm, "plfunctions": plfunctions,
+    "mrl": mrl, "qbc": qbc, "nyc": nyc, "sea": sea, "bos": bos
+}
+
+# city whose statements are in each city module
+SQL_MODULE_CITIES = {
+    "mrl": "montreal", "qbc": "quebec", "nyc": "newyork", "sea": "seattle", "bos": "boston"
+}
+
+# values of the fields of the SQL constants when checking their plans
+PLAN_PARAMS = {
+    "offset": LINE_OFFSET, "isleft": 1, "within": 0.1, "boro": "M", "tbl": "boston_geobase",
+    "table": "roads", "tables": "'roads'", "checksum": "0", "fingerprint": "{}",
+    "stage": "rules", "inputs": "{}"
+}
+
+# indexes of each city slots partition, built once the slots are inserted
+SLOTS_INDEXES = [("id", "btree"), ("geom", "gist"), ("rule_ids", "gin")]
+
+# raw parking lot files for each city
+LOTS_FILES = [
+    ("montreal", "lots_montreal.csv"),
+    ("quebec", "lots_quebec.csv"),
+    ("seattle", "lots_seattle.csv"),
+    ("boston", "lots_boston.csv")
+]
+
+
+def plan_modules(cities=CITIES):
+    """
+    Returns the SQL modules whose plans are checked, along with the cities
+    their statements are formatted for (see ``plans.check_plans``)
+    """
+    return {
+        alias: (module, [SQL_MODULE_CITIES[alias]] if alias in SQL_MODULE_CITIES else cities)
+        for alias, module in SQL_MODULES.items()
+        if alias != "plfunctions" and SQL_MODULE_CITIES.get(alias, cities[0]) in cities
+    }
 
-def process_quebec(debug=False):
+
+def connect(profiler=None):
+    """
+    Borrow a connection to the database from the pool,
+    to give back with ``release``
+
+    :param profiler: optional ``QueryProfiler`` recording the queries
+    """
+    db = get_pool(connect_string(CONFIG)).get()
+    db.profiler = profiler
+    return db
+
+
+def release(db):
+    """
+    Give back a connection obtained with ``connect``
+    """
+    get_pool(connect_string(CONFIG)).put(db)
+
+
+def process_quebec(db, debug=False):
     """
     Process Quebec data
     """
@@ -38,10 +143,6 @@ def process_quebec(debug=False):
     def warning(msg):
         return Logger.warning("Québec: {}".format(msg))
 
-    info('Loading and translating rules')
-    insert_rules('quebec_rules_translation')
-    db.vacuum_analyze('public', 'rules')
-
     info("Creating sign table")
     db.query(qbc.create_sign)
 
@@ -102,6 +203,9 @@ def process_quebec(debug=False):
     info("Creating and overlaying paid slots")
     db.query(qbc.create_bornes_raw)
     db.query(qbc.create_paid_signpost)
+    db.query(qbc.create_bornes_clusters)
+    db.copy_from('public', 'quebec_bornes_clusters', ['id', 'cluster', 'seq'],
+        cluster_meters(db.query(qbc.get_paid_signposts), 10))
     db.query(qbc.aggregate_paid_signposts.format(offset=LINE_OFFSET))
     db.query(qbc.overlay_paid_rules)
     db.query(qbc.create_paid_slots_standalone)
@@ -114,7 +218,7 @@ def process_quebec(debug=False):
         db.vacuum_analyze('public', 'quebec_slots_debug')
 
 
-def process_montreal(debug=False):
+def process_montreal(db, debug=False):
     """
     process montreal data and generate parking slots
     """
@@ -127,10 +231,6 @@ def process_montreal(debug=False):
     def warning(msg):
         return Logger.warning("Montréal: {}".format(msg))
 
-    debug('Loading and translating rules')
-    insert_rules('montreal_rules_translation')
-    db.vacuum_analyze('public', 'rules')
-
     info("Matching osm roads with geobase")
     db.query(mrl.match_roads_geobase)
     db.create_index('montreal_roads_geobase', 'id')
@@ -195,10 +295,10 @@ def process_montreal(debug=False):
     db.create_index('montreal_nextpoints', 'direction')
     db.vacuum_analyze('public', 'montreal_nextpoints')
 
+    db.query(mrl.insert_slots_temp.format(offset=LINE_OFFSET))
     db.create_index('montreal_slots_temp', 'id')
     db.create_index('montreal_slots_temp', 'geom', index_type='gist')
     db.create_index('montreal_slots_temp', 'rules', index_type='gin')
-    db.query(mrl.insert_slots_temp.format(offset=LINE_OFFSET))
 
     info("Creating and overlaying paid slots")
     db.query(mrl.overlay_paid_rules)
@@ -212,7 +312,7 @@ def process_montreal(debug=False):
         db.vacuum_analyze('public', 'montreal_slots_debug')
 
 
-def process_newyork(debug=False):
+def process_newyork(db, debug=False):
     """
     Process New York data
     """
@@ -225,10 +325,6 @@ def process_newyork(debug=False):
     def warning(msg):
         return Logger.warning("New York: {}".format(msg))
 
-    info('Loading and translating rules')
-    insert_rules('newyork_rules_translation')
-    db.vacuum_analyze('public', 'rules')
-
     info("Loading signs")
     db.query(nyc.create_sign)
     db.query(nyc.insert_sign)
@@ -311,21 +407,21 @@ def process_newyork(debug=False):
     for x in ['K', 'M', 'Q', 'B', 'S']:
         info("Creating slots between signposts (borough {})".format(x))
         db.query(nyc.insert_slots_temp.format(boro=x, offset=LINE_OFFSET))
-        db.create_index('newyork_slots_temp', 'id')
-        db.create_index('newyork_slots_temp', 'geom', index_type='gist')
-        db.create_index('newyork_slots_temp', 'rules', index_type='gin')
-        db.vacuum_analyze('public', 'newyork_slots_temp')
+    db.create_index('newyork_slots_temp', 'id')
+    db.create_index('newyork_slots_temp', 'geom', index_type='gist')
+    db.create_index('newyork_slots_temp', 'rules', index_type='gin')
+    db.vacuum_analyze('public', 'newyork_slots_temp')
 
     if debug:
         info("Creating debug slots")
         for x in ['K', 'M', 'Q', 'B', 'S']:
             db.query(nyc.create_slots_for_debug.format(boro=x, offset=LINE_OFFSET))
-            db.create_index('newyork_slots_debug', 'pkid')
-            db.create_index('newyork_slots_debug', 'geom', index_type='gist')
-            db.vacuum_analyze('public', 'newyork_slots_debug')
+        db.create_index('newyork_slots_debug', 'pkid')
+        db.create_index('newyork_slots_debug', 'geom', index_type='gist')
+        db.vacuum_analyze('public', 'newyork_slots_debug')
 
 
-def process_seattle(debug=False):
+def process_seattle(db, debug=False):
     """
     Process Seattle data
     """
@@ -338,11 +434,6 @@ def process_seattle(debug=False):
     def warning(msg):
         return Logger.warning("Seattle: {}".format(msg))
 
-    info('Loading and translating rules')
-    insert_rules('seattle_rules_translation')
-    insert_dynamic_rules_seattle()
-    db.vacuum_analyze('public', 'rules')
-
     info("Matching OSM roads with geobase")
     db.query(sea.match_roads_geobase)
     db.create_index('seattle_roads_geobase', 'id')
@@ -420,7 +511,7 @@ def process_seattle(debug=False):
         db.vacuum_analyze('public', 'seattle_slots_debug')
 
 
-def process_boston(debug=False):
+def process_boston(db, debug=False):
     """
     process boston data and generate parking slots
     """
@@ -433,10 +524,6 @@ def process_boston(debug=False):
     def warning(msg):
         return Logger.warning("Boston: {}".format(msg))
 
-    debug('Loading and translating rules')
-    insert_rules('boston_rules_translation')
-    db.vacuum_analyze('public', 'rules')
-
     info("Matching OSM roads with geobase")
     db.query(bos.create_roads_geobase)
     db.query(bos.match_roads_geobase.format(tbl="boston_geobase"))
@@ -502,10 +589,10 @@ def process_boston(debug=False):
     db.create_index('boston_nextpoints', 'direction')
     db.vacuum_analyze('public', 'boston_nextpoints')
 
+    db.query(bos.insert_slots_temp.format(offset=LINE_OFFSET))
     db.create_index('boston_slots_temp', 'id')
     db.create_index('boston_slots_temp', 'geom', index_type='gist')
     db.create_index('boston_slots_temp', 'rules', index_type='gin')
-    db.query(bos.insert_slots_temp.format(offset=LINE_OFFSET))
 
     info("Creating and overlaying paid slots")
     db.query(bos.overlay_paid_rules)
@@ -519,7 +606,7 @@ def process_boston(debug=False):
         db.vacuum_analyze('public', 'boston_slots_debug')
 
 
-def cleanup_table():
+def cleanup_table(db):
     """
     Remove temporary tables
     """
@@ -531,12 +618,13 @@ def cleanup_table():
 
     # drop per-city temp tables
     for x in ["slots_likely", "slots_temp", "nextpoints", "paid_temp", "signpost_temp",
-            "paid_slots_raw", "bornes_raw", "bornes_clustered"]:
+            "paid_slots_raw", "bornes_raw", "bornes_clusters", "bornes_clustered", "slots_clusters",
+            "slots_crossings"]:
         for y in CITIES:
             db.query("DROP TABLE IF EXISTS {}_{}".format(y, x))
 
 
-def process_osm():
+def process_osm(db):
     """
     Process OSM data
     """
@@ -573,108 +661,360 @@ def process_osm():
     db.vacuum_analyze('public', 'roads')
 
 
-def run(cities=CITIES, osm=False, debug=False):
+def process_parking_lots(db):
     """
-    Run the entire pipeline
+    Process parking lot / garage data
     """
-    Logger.debug("Loading extensions and custom functions")
-    db.query("create extension if not exists fuzzystrmatch")
-    db.query("create extension if not exists intarray")
-    db.query(plfunctions.st_isleft_func)
-    db.query(plfunctions.array_sort)
-    db.query(plfunctions.get_max_range)
-
-    if osm:
-        process_osm()
-
-    # create common tables
-    db.query(common.create_rules)
-    db.create_index('rules', 'code')
-    db.query(common.create_slots)
-
-    for x in cities:
-        db.query(common.create_slots_temp.format(city=x))
-        db.query(common.create_slots_partition.format(city=x))
-
     Logger.info("Processing parking lot / garage data")
     db.query(common.create_parking_lots)
-    db.query(common.create_parking_lots_raw.format(city="montreal"))
-    insert_raw_lots("montreal", "lots_montreal.csv")
-    insert_parking_lots("montreal")
-    db.query(common.create_parking_lots_raw.format(city="quebec"))
-    insert_raw_lots("quebec", "lots_quebec.csv")
-    insert_parking_lots("quebec")
-    db.query(common.create_parking_lots_raw.format(city="seattle"))
-    insert_raw_lots("seattle", "lots_seattle.csv")
-    insert_parking_lots("seattle")
-    db.query(common.create_parking_lots_raw.format(city="boston"))
-    insert_raw_lots("boston", "lots_boston.csv")
-    insert_parking_lots("boston")
+    db.query(common.create_parking_lots_staging)
+    for city, filename in LOTS_FILES:
+        db.query(common.create_parking_lots_raw.format(city=city))
+        insert_raw_lots(db, city, filename)
+        insert_parking_lots(db, city)
+    db.query(common.insert_parking_lots)
     db.create_index('parking_lots', 'id')
     db.create_index('parking_lots', 'city')
     db.create_index('parking_lots', 'geom', index_type='gist')
     db.create_index('parking_lots', 'agenda', index_type='gin')
 
     db.query("DROP TABLE IF EXISTS parking_lots_streetview;")
-    insert_lots_streetview("lots_newyork_streetview.csv")
-
-    if 'montreal' in cities:
-        process_montreal(debug)
-    if 'quebec' in cities:
-        process_quebec(debug)
-    if 'newyork' in cities:
-        process_newyork(debug)
-    if 'seattle' in cities:
-        process_seattle(debug)
-    if 'boston' in cities:
-        process_boston(debug)
-
-    Logger.info("Shorten slots that intersect with roads or other slots")
-    for x in cities:
-        db.query(common.cut_slots_crossing_roads.format(city=x, offset=LINE_OFFSET))
-        db.query(common.cut_slots_crossing_slots.format(city=x))
+    insert_lots_streetview(db, "lots_newyork_streetview.csv")
+
+
+def load_rules(db, cities, debug=False):
+    """
+    Create the rules table and load the translated parking rules of each city
+    straight from its translation file.
 
-    Logger.info("Aggregating like slots")
+    Rules are compiled once per version of the translation file: the grouped
+    rules are kept in ``rules_cache`` and copied from there by later runs.
+
+    :param debug: also load the ``*_rules_translation`` tables used by the debug slots
+    """
+    db.query(common.create_rules)
+    db.create_index('rules', 'code')
+    db.query(common.create_rules_cache)
     for x in cities:
-        db.create_index(x+'_slots', 'id')
-        db.create_index(x+'_slots', 'geom', index_type='gist')
-        db.create_index(x+'_slots', 'rules', index_type='gin')
-        db.query(common.aggregate_like_slots.format(city=x, within=3 if x == "seattle" else 0.1))
-        db.query(common.create_client_data.format(city=x))
-        db.vacuum_analyze('public', x+'_slots')
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'rules_{}.csv'.format(x))
+        checksum = rules_checksum(filename)
+        # rows are only parsed when needed
+        rules = read_rules(filename)
+        if debug:
+            rules = list(rules)
+            db.query(common.create_rules_translation.format(city=x))
+            db.copy_from('public', '{}_rules_translation'.format(x),
+                common.rules_translation_columns, rules)
+            db.vacuum_analyze('public', '{}_rules_translation'.format(x))
+        if db.query(common.has_cached_rules.format(city=x, checksum=checksum))[0][0]:
+            Logger.info("Loading compiled rules ({})".format(x))
+        else:
+            Logger.info("Loading and translating rules ({})".format(x))
+            cache_rules(db, x, checksum, rules)
+        db.query(common.insert_cached_rules.format(city=x, checksum=checksum))
+        if x == 'seattle':
+            insert_dynamic_rules_seattle(db)
+    db.vacuum_analyze('public', 'rules')
+    db.query(plfunctions.day_of_year_bit)
+    db.query(plfunctions.rules_on)
+
+
+def process_city(db, city, debug=False):
+    """
+    Create the temporary slots of a city from its signs
+    """
+    processes = {
+        'montreal': process_montreal,
+        'quebec': process_quebec,
+        'newyork': process_newyork,
+        'seattle': process_seattle,
+        'boston': process_boston
+    }
+    db.query(common.create_slots_temp.format(city=city))
+    processes[city](db, debug)
+
+
+def shorten_slots(db, city):
+    """
+    Shorten slots that intersect with roads or other slots
+    """
+    Logger.info("Shorten slots that intersect with roads or other slots ({})".format(city))
+    db.query(common.cut_slots_crossing_roads.format(city=city, offset=LINE_OFFSET))
+    db.query(common.create_slots_crossings.format(city=city))
+    db.query(common.cut_slots_crossing_slots.format(city=city))
+
 
+def cluster_like_slots(db, city, within):
+    """
+    Merge adjacent slots of a same road having the same rules
+    """
+    pairs = db.iter_query(common.get_like_slots_pairs.format(city=city, within=within))
+    slots = db.query(common.get_slots_endpoints.format(city=city))
+    db.query(common.create_slots_clusters.format(city=city))
+    db.copy_from('public', city + '_slots_clusters', ['id', 'cluster', 'rank', 'seq'],
+        chain_like_slots(slots, pairs, within))
+    db.query(common.insert_clustered_slots.format(city=city))
+
+
+def aggregate_slots(db, city, loop=False):
+    """
+    Aggregate like slots and create the data sent to clients
+
+    :param loop: aggregate with the former row by row PL/pgSQL loop
+    """
+    Logger.info("Aggregating like slots ({})".format(city))
+    within = 3 if city == "seattle" else 0.1
+    db.query(common.create_slots_partition.format(city=city))
+    if loop:
+        # the loop looks up the slots inserted so far
+        for column, index_type in SLOTS_INDEXES:
+            db.create_index(city + '_slots', column, index_type=index_type)
+        db.query(common.aggregate_like_slots.format(city=city, within=within))
+        db.query(common.create_client_data.format(city=city))
+    else:
+        # client data is written along with the slots
+        cluster_like_slots(db, city, within)
+    # slot_rules is only appended to, so it can be shared by cities aggregated concurrently
+    db.query(common.normalise_slot_rules.format(city=city))
+    db.vacuum_analyze('public', city+'_slots')
+
+
+def create_permits(db, cities):
+    """
+    Create permit lists
+    """
     Logger.info("Creating permit lists")
     db.query(common.create_permit_lists)
     for x in cities:
         db.query(common.insert_permit_lists.format(city=x))
 
-    if not debug:
-        cleanup_table()
+
+def build_availability(db):
+    """
+    Compile the rules of the slots of all cities into the weekly availability index
+    """
+    Logger.info("Building the availability index")
+    db.query(common.create_availability)
+    db.copy_from('public', 'rule_availability', availability.rule_availability_columns, (
+        row
+        for rule_id, rule in db.query(common.get_slot_rules)
+        for row in availability.compile_rule(rule_id, rule)
+    ))
+    db.query(common.insert_slot_availability)
+    db.create_index('slot_availability', 'slot_id')
+    db.vacuum_analyze('public', 'slot_availability')
+
+    # query function, reading the index
+    db.query(plfunctions.availability_bucket)
+    db.query(plfunctions.day_of_year_bit)
+    db.query(plfunctions.available_slots)
+
+
+def city_fingerprint(db, city, osm=False, memo=None):
+    """
+    Returns the fingerprint of everything the slots of ``city`` are made from
+
+    :param osm: True if the roads are about to be rebuilt from OSM data
+    :param memo: dict of the table fingerprints already taken, shared by the cities
+        so that the roads (or OSM lines) are only read once
+    """
+    here = os.path.dirname(__file__)
+    files = [os.path.join(here, 'data', x) for x in CITY_FILES[city]] + [
+        os.path.join(here, 'cities', city + '.py'),
+        os.path.join(here, 'common.py'),
+        os.path.join(here, 'filters.py'),
+        os.path.join(here, 'plfunctions.py')
+    ]
+    tables = CITY_SOURCES[city] + ['planet_osm_line' if osm else 'roads']
+    return input_fingerprint(db, files, tables, memo)
+
+
+def run(cities=CITIES, osm=False, debug=False, jobs=1, resume=False, force=False,
+        profile=None, explain=False, aggregate_loop=False, slow_query=None):
+    """
+    Run the entire pipeline
+
+    :param jobs: maximum number of stages running at the same time,
+        each one on its own connection
+    :param resume: skip the stages completed by a previous run
+        if the tables they read did not change since
+    :param force: process cities even if their inputs did not change
+        since they were last processed
+    :param profile: path (without extension) of the JSON and HTML
+        profiling reports to write at the end of the run
+    :param explain: when profiling, get the buffer usage of data modifying
+        statements with ``EXPLAIN (ANALYZE, BUFFERS)``
+    :param aggregate_loop: aggregate like slots with the former row by row loop
+    :param slow_query: when profiling, duration in seconds over which
+        a query is logged as slow
+    """
+    profiler = None
+    if profile:
+        profiler = QueryProfiler(SQL_MODULES, explain=explain, cities=cities, slow=slow_query)
+    # one connection for this function and one for each stage or index being built
+    pool = get_pool(connect_string(CONFIG), maxconn=jobs + 1)
+    try:
+        db = connect(profiler)
+        if profiler:
+            stat_statements = profiler.snapshot(db)
+
+        Logger.debug("Loading extensions and custom functions")
+        db.query("create extension if not exists fuzzystrmatch")
+        db.query("create extension if not exists intarray")
+        db.query(plfunctions.st_isleft_func)
+        db.query(plfunctions.array_sort)
+        db.query(plfunctions.get_max_range)
+
+        # create common tables
+        db.query(common.create_slots)
+
+        state = RunState()
+        state.setup(db)
+        if not resume:
+            state.reset(db)
+
+        # cities whose inputs are byte-identical to their last successful run
+        # keep their slots partition
+        fingerprints = InputFingerprints()
+        fingerprints.setup(db)
+        memo = {}
+        skipped = [
+            x for x in cities
+            if not force and table_exists(db, x + '_slots')
+            and fingerprints.unchanged(db, x, city_fingerprint(db, x, osm, memo))
+        ]
+        for x in skipped:
+            Logger.info("Skipping {}: inputs did not change since last run".format(x))
+        processed = [x for x in cities if x not in skipped]
+
+        # stages are declared in the order they would run one after the other,
+        # a stage waits for the previous ones using the tables it reads or writes.
+        # every stage creates the tables it writes, so that it can be skipped
+        # when resuming a run
+        scheduler = Scheduler(lambda: connect(profiler), jobs=jobs, state=state, profiler=profiler,
+            release=release)
+        if osm:
+            scheduler.add('osm', process_osm,
+                reads=['planet_osm_line'],
+                writes=['osm_ways', 'way_intersection', 'bad_intersection', 'roads'])
+
+        scheduler.add('parking_lots', process_parking_lots,
+            writes=['parking_lots', 'parking_lots_raw', 'parking_lots_streetview'] + [
+                '{}_parking_lots'.format(x) for x, _ in LOTS_FILES])
+
+        # rules are read from the translation files, the translation tables
+        # are only loaded for the debug slots
+        translations = ['{}_rules_translation'.format(x) for x in cities] if debug else []
+        scheduler.add('rules', load_rules,
+            ['seattle_parklines'] if 'seattle' in cities else [],
+            ['rules'] + (['seattle_sign_codes'] if 'seattle' in cities else []) + translations,
+            cities, debug)
+
+        for x in processed:
+            scheduler.add(x, process_city,
+                ['rules', 'roads'] + (
+                    [x + '_rules_translation'] if debug else []) + CITY_SOURCES[x],
+                CITY_TABLES[x],
+                x, debug)
+
+        for x in processed:
+            scheduler.add('shorten_' + x, shorten_slots,
+                ['roads'], [x + '_slots_temp', x + '_slots_crossings'], x)
+
+        for x in processed:
+            scheduler.add('aggregate_' + x, aggregate_slots,
+                [x + '_slots_temp'], [x + '_slots', x + '_slots_clusters'],
+                x, aggregate_loop)
+
+        scheduler.add('permits', create_permits,
+            ['{}_slots'.format(x) for x in cities], ['permits'], cities)
+
+        scheduler.add('availability', build_availability,
+            ['{}_slots'.format(x) for x in cities] + ['slot_rules'],
+            ['rule_availability', 'slot_availability'])
+
+        scheduler.run()
+
+        # partitions of all cities are indexed at the same time,
+        # existing indexes of skipped cities are left untouched
+        indexes = IndexManager(lambda: connect(profiler), jobs=jobs, release=release)
+        for x in cities:
+            for column, index_type in SLOTS_INDEXES:
+                indexes.declare(x + '_slots', column, index_type)
+        indexes.build()
+
+        # fingerprints are taken once processed, as some sources are modified in place
+        memo = {}
+        for x in processed:
+            fingerprints.save(db, x, city_fingerprint(db, x, osm, memo))
+
+        if not debug:
+            cleanup_table(db)
+
+        if profiler:
+            profiler.diff_snapshots(stat_statements, profiler.snapshot(db))
+            profiler.report(profile)
+        release(db)
+    finally:
+        pool.closeall()
+
+
+def read_rules(filename):
+    """
+    Stream the rules of a translation file (``data/rules_*.csv``)
+
+    Columns are taken by position, like the ``COPY`` of the ``*_load_rules.sql``
+    scripts: a missing trailing ``permit_no`` or an empty value is NULL.
+    """
+    columns = common.rules_translation_columns
+    index = {name: pos for pos, name in enumerate(columns)}
+    casts = [float if x in ('time_max_parking', 'time_start', 'time_end', 'time_duration', 'daily')
+             else int if x in ('lun', 'mar', 'mer', 'jeu', 'ven', 'sam', 'dim')
+             else None for x in columns]
+    with open(filename, 'rb') as infile:
+        reader = csv.reader(infile)
+        next(reader)
+        for line in reader:
+            values = []
+            for pos, cast in enumerate(casts):
+                value = line[pos].decode('utf-8') if pos < len(line) else ''
+                if value == '':
+                    value = None
+                elif cast:
+                    value = cast(value)
+                values.append(value)
+            yield Row(tuple(values), index)
+
+
+def rules_checksum(filename):
+    """
+    Returns the checksum the rules compiled from a translation file are cached under,
+    made of the checksums of the file and of the code compiling the rules
+    """
+    here = os.path.dirname(__file__)
+    return ":".join(file_fingerprint(x) for x in [
+        filename, os.path.join(here, 'filters.py'), os.path.join(here, 'agenda.py')])
 
 
-def insert_rules(from_table):
+def cache_rules(db, city, checksum, rules):
     """
-    Get rules from specific location (montreal, quebec),
-    group them, make a simpler model and load them into database
+    Group rules (rows of a translation file), make a simpler model
+    and store them in the rules cache, replacing the former rules of ``city``
     """
-    Logger.debug("Get rules from {} and simplify them".format(from_table))
-    rules = db.query(
-        common.get_rules_from_source.format(source=from_table),
-        namedtuple=True
-    )
+    Logger.debug("Simplify rules")
     rules_grouped = group_rules(rules)
 
-    Logger.debug("Load rules into rules table")
+    Logger.debug("Load rules into rules cache")
 
-    db.copy_from('public', 'rules', common.rules_columns, [
-        [
-            json.dumps(val).replace('\\', '\\\\') if isinstance(val, dict) else val
-            for val in rule._asdict().values()]
+    # empty values are loaded as NULL
+    db.copy_from('public', 'rules_cache', ('city', 'checksum') + common.rules_columns, (
+        [city, checksum] + [val or None for val in rule._asdict().values()]
         for rule in rules_grouped
-    ])
+    ))
+    db.query(common.clear_rules_cache.format(city=city, checksum=checksum))
 
 
-def insert_raw_lots(city, filename):
+def insert_raw_lots(db, city, filename):
     db.query("""
         COPY {}_parking_lots (name, operator, address, description, lun_normal, mar_normal, mer_normal,
             jeu_normal, ven_normal, sam_normal, dim_normal, hourly_normal, daily_normal, max_normal,
@@ -688,95 +1028,136 @@ def insert_raw_lots(city, filename):
     """.format(city, os.path.join(os.path.dirname(__file__), 'data', filename)))
 
 
-def insert_lots_streetview(filename):
+def insert_lots_streetview(db, filename):
     with open(os.path.join(os.path.dirname(__file__), 'data', 'load_lots_streetview.sql'), 'rb') as infile:
         db.query(infile.read().format(os.path.join(os.path.dirname(__file__), 'data', filename)))
         db.vacuum_analyze("public", "parking_lots_streetview")
 
 
-def insert_parking_lots(city):
-    columns = ["city", "name", "operator", "address", "description", "agenda", "capacity", "attrs",
-        "geom", "active", "street_view", "partner_name", "partner_id", "geojson"]
-    days = ["lun", "mar", "mer", "jeu", "ven", "sam", "dim"]
-    lots, queries = [], []
-
-    for row in db.query("""
+def insert_parking_lots(db, city):
+    """
+    Stream the lots of a city into the ``parking_lots_raw`` staging table
+    """
+    columns = ["city", "name", "operator", "address", "description", "agenda", "capacity",
+        "attrs", "geom", "active", "street_view_head", "street_view_id", "partner_name",
+        "partner_id"]
+    types = ["varchar"] * 5 + ["jsonb", "int4", "jsonb", "geometry", "bool", "float8"] + ["varchar"] * 3
+
+    # lots are read before being copied on the same connection, as it cannot run
+    # a query during a COPY (there are at most a few hundred lots per city)
+    lots = db.query("""
         SELECT *, ST_Transform(ST_SetSRID(ST_MakePoint(long, lat), 4326), 3857) AS geom
         FROM {}_parking_lots
-    """.format(city), namedtuple=True):
-        lot = [(x.decode('utf-8').replace("'", "''") if x else '') for x in [row.name, row.operator, row.address, row.description]]
-
-        # Create pricing rules per time period the lot is open
-        agenda = {str(y): [] for y in range(1,8)}
-        for x in range(1,8):
-            if getattr(row, days[x - 1] + "_normal"):
-                y = getattr(row, days[x - 1] + "_normal")
-                hours = [float(z) for z in y.split(",")]
-                if hours != [0.0, 24.0] and hours[0] > hours[1]:
-                    nextday = str(x+1) if (x < 7) else "1"
-                    agenda[nextday].append({"hours": [0.0, hours[1]], "max": row.max_normal or None,
-                        "hourly": row.hourly_normal or None, "daily": row.daily_normal or None})
-                    hours = [hours[0], 24.0]
-                agenda[str(x)].append({"hours": hours, "hourly": row.hourly_normal or None,
-                    "max": row.max_normal or None, "daily": row.daily_normal or None})
-            if getattr(row, days[x - 1] + "_special"):
-                y = getattr(row, days[x - 1] + "_special")
-                hours = [float(z) for z in y.split(",")]
-                if hours != [0.0, 24.0] and hours[0] > hours[1]:
-                    nextday = str(x+1) if (x < 7) else "1"
-                    agenda[nextday].append({"hours": [0.0, hours[1]], "max": row.max_special or None,
-                        "hourly": row.hourly_special or None, "daily": row.daily_special or None})
-                    hours = [hours[0], 24.0]
-                agenda[str(x)].append({"hours": hours, "hourly": row.hourly_special or None,
-                    "max": row.max_special or None, "daily": row.daily_special or None})
-            if getattr(row, days[x - 1] + "_free"):
-                y = getattr(row, days[x - 1] + "_free")
-                hours = [float(z) for z in y.split(",")]
-                if hours != [0.0, 24.0] and hours[0] > hours[1]:
-                    nextday = str(x+1) if (x < 7) else "1"
-                    agenda[nextday].append({"hours": [0.0, hours[1]], "max": None,
-                        "hourly": 0, "daily": row.daily_free or None})
-                    hours = [hours[0], 24.0]
-                agenda[str(x)].append({"hours": hours, "hourly": 0, "max": None,
-                    "daily": row.daily_free or None})
-
-        # Create "closed" rules for periods not covered by an open rule
-        for x in agenda:
-            hours = sorted([y["hours"] for y in agenda[x]], key=lambda z: z[0])
-            for i, y in enumerate(hours):
-                starts = [z[0] for z in hours]
-                if y[0] == 0.0:
-                    continue
-                last_end = hours[i-1][1] if not i == 0 else 0.0
-                next_start = hours[i+1][0] if not i == (len(hours) - 1) else 24.0
-                if not last_end in starts:
-                    agenda[x].append({"hours": [last_end, y[0]], "hourly": None, "max": None,
-                        "daily": None})
-                if not next_start in starts and y[1] != 24.0:
-                    agenda[x].append({"hours": [y[1], next_start], "hourly": None, "max": None,
-                        "daily": None})
-            if agenda[x] == []:
-                agenda[x].append({"hours": [0.0,24.0], "hourly": None, "max": None, "daily": None})
-
-        lot += [json.dumps(agenda), row.capacity or 0, json.dumps({"indoor": row.indoor,
-            "handicap": row.handicap, "card": row.card, "valet": row.valet}), row.geom, row.active,
-            row.street_view_head, row.street_view_id,
-            "'{}'".format(row.partner_name) if row.partner_name else "NULL",
-            "'{}'".format(row.partner_id) if row.partner_id else "NULL"]
-        lots.append(lot)
-
-    for x in lots:
-        queries.append("""
-            INSERT INTO parking_lots ({}) VALUES ('{city}', '{}', '{}', '{}', '{}', '{}'::jsonb, {},
-                '{}'::jsonb, '{}'::geometry, '{}', json_build_object('head', {}, 'id', '{}')::jsonb,
-                {}, {}, ST_AsGeoJSON(ST_Transform('{geom}'::geometry, 4326))::jsonb)
-        """.format(",".join(columns), *[y for y in x], city=city, geom=x[-6]))
-    db.queries(queries)
-
-
-def insert_dynamic_rules_seattle():
-    # load dynamic paid parking rules for Seattle
-    paid_rules = []
+    """.format(city), namedtuple=True)
+    # geometries are read as hex EWKB, and sent as EWKB
+    db.copy_from('public', 'parking_lots_raw', columns, (
+        [city] + [(x.decode('utf-8') if x else '')
+                  for x in [row.name, row.operator, row.address, row.description]] +
+        [_lot_agenda(row), row.capacity or 0, {"indoor": row.indoor,
+            "handicap": row.handicap, "card": row.card, "valet": row.valet},
+         binascii.unhexlify(row.geom), row.active, row.street_view_head, row.street_view_id,
+         row.partner_name or None, row.partner_id or None]
+        for row in lots
+    ), types=types)
+
+
+def _lot_agenda(row):
+    """
+    Returns the pricing agenda of a parking lot
+    """
+    days = ["lun", "mar", "mer", "jeu", "ven", "sam", "dim"]
+    # Create pricing rules per time period the lot is open
+    agenda = {str(y): [] for y in range(1,8)}
+    for x in range(1,8):
+        if getattr(row, days[x - 1] + "_normal"):
+            y = getattr(row, days[x - 1] + "_normal")
+            hours = [float(z) for z in y.split(",")]
+            if hours != [0.0, 24.0] and hours[0] > hours[1]:
+                nextday = str(x+1) if (x < 7) else "1"
+                agenda[nextday].append({"hours": [0.0, hours[1]], "max": row.max_normal or None,
+                    "hourly": row.hourly_normal or None, "daily": row.daily_normal or None})
+                hours = [hours[0], 24.0]
+            agenda[str(x)].append({"hours": hours, "hourly": row.hourly_normal or None,
+                "max": row.max_normal or None, "daily": row.daily_normal or None})
+        if getattr(row, days[x - 1] + "_special"):
+            y = getattr(row, days[x - 1] + "_special")
+            hours = [float(z) for z in y.split(",")]
+            if hours != [0.0, 24.0] and hours[0] > hours[1]:
+                nextday = str(x+1) if (x < 7) else "1"
+                agenda[nextday].append({"hours": [0.0, hours[1]], "max": row.max_special or None,
+                    "hourly": row.hourly_special or None, "daily": row.daily_special or None})
+                hours = [hours[0], 24.0]
+            agenda[str(x)].append({"hours": hours, "hourly": row.hourly_special or None,
+                "max": row.max_special or None, "daily": row.daily_special or None})
+        if getattr(row, days[x - 1] + "_free"):
+            y = getattr(row, days[x - 1] + "_free")
+            hours = [float(z) for z in y.split(",")]
+            if hours != [0.0, 24.0] and hours[0] > hours[1]:
+                nextday = str(x+1) if (x < 7) else "1"
+                agenda[nextday].append({"hours": [0.0, hours[1]], "max": None,
+                    "hourly": 0, "daily": row.daily_free or None})
+                hours = [hours[0], 24.0]
+            agenda[str(x)].append({"hours": hours, "hourly": 0, "max": None,
+                "daily": row.daily_free or None})
+
+    # Create "closed" rules for periods not covered by an open rule
+    for x in agenda:
+        hours = sorted([y["hours"] for y in agenda[x]], key=lambda z: z[0])
+        for i, y in enumerate(hours):
+            starts = [z[0] for z in hours]
+            if y[0] == 0.0:
+                continue
+            last_end = hours[i-1][1] if not i == 0 else 0.0
+            next_start = hours[i+1][0] if not i == (len(hours) - 1) else 24.0
+            if not last_end in starts:
+                agenda[x].append({"hours": [last_end, y[0]], "hourly": None, "max": None,
+                    "daily": None})
+            if not next_start in starts and y[1] != 24.0:
+                agenda[x].append({"hours": [y[1], next_start], "hourly": None, "max": None,
+                    "daily": None})
+        if agenda[x] == []:
+            agenda[x].append({"hours": [0.0,24.0], "hourly": None, "max": None, "daily": None})
+
+    return agenda
+
+
+def insert_dynamic_rules_seattle(db):
+    """
+    Register the dynamic paid parking rules of Seattle along with their signs
+    """
+    # rules are generated before being copied on the same connection,
+    # as it cannot run a query during a COPY
+    rules = list(dynamic_rules_seattle(db))
+    register_rules(db, rules, signs_table='seattle_sign_codes')
+
+
+def register_rules(db, rules, signs_table=None):
+    """
+    Load rules generated programmatically with one COPY per table, in a single transaction
+
+    :param rules: iterable of dicts with the ``common.generated_rules_columns`` keys
+        and, if ``signs_table`` is given, the list of ``signs`` the rule applies to
+    :param signs_table: table receiving the code and signs of each rule
+    """
+    signs = []
+
+    def records():
+        for rule in rules:
+            if signs_table:
+                signs.append([rule['code'], array_literal(rule['signs'])])
+            yield [rule[x] for x in common.generated_rules_columns]
+
+    with db.transaction():
+        db.copy_from('public', 'rules', common.generated_rules_columns, records(),
+                     types=common.generated_rules_types, commit=False)
+        if signs_table:
+            db.copy_from('public', signs_table, ['code', 'signs'], signs, commit=False)
+
+
+def dynamic_rules_seattle(db):
+    """
+    Generate the dynamic paid parking rules of Seattle from its parking lines
+    """
     data = db.query("""
         SELECT ROW_NUMBER() OVER (ORDER BY wkd_start1), array_agg(elmntkey), wkd_start1,
             wkd_end1, wkd_start2, wkd_end2, wkd_start3, wkd_end3, sat_start1, sat_end1,
@@ -803,17 +1184,17 @@ def insert_dynamic_rules_seattle():
                 if x[6] and x[7] and x[6] == (end + 1) and x[21] == x[22]:
                     end = x[7]
                     wkd3 = True
-            paid_rules.append(_dynrule(x, "MON-FRI", start, end, 1))
+            yield _dynrule(x, "MON-FRI", start, end, 1)
         if x[4] and x[5] and not wkd2:
             # weekday start/end times no2
             start, end = x[4], x[5]
             if x[6] and x[7] and x[6] == (end + 1) and x[21] == x[22]:
                 end = x[7]
                 wkd3 = True
-            paid_rules.append(_dynrule(x, "MON-FRI", start, end, 2))
+            yield _dynrule(x, "MON-FRI", start, end, 2)
         if x[6] and x[7] and not wkd3:
             # weekday start/end times no3
-            paid_rules.append(_dynrule(x, "MON-FRI", x[6], x[7], 3))
+            yield _dynrule(x, "MON-FRI", x[6], x[7], 3)
         if x[8] and x[9]:
             # saturday start/end times no1
             start, end = x[8], x[9]
@@ -823,17 +1204,17 @@ def insert_dynamic_rules_seattle():
                 if x[12] and x[13] and x[12] == (end + 1) and x[24] == x[25]:
                     end = x[13]
                     sat3 = True
-            paid_rules.append(_dynrule(x, "SAT", start, end, 4))
+            yield _dynrule(x, "SAT", start, end, 4)
         if x[10] and x[11] and not sat2:
             # saturday start/end times no2
             start, end = x[10], x[11]
             if x[12] and x[13] and x[12] == (end + 1) and x[24] == x[25]:
                 end = x[13]
                 sat3 = True
-            paid_rules.append(_dynrule(x, "SAT", start, end, 5))
+            yield _dynrule(x, "SAT", start, end, 5)
         if x[12] and x[13] and not sat3:
             # saturday start/end times no3
-            paid_rules.append(_dynrule(x, "SAT", start, end, 6))
+            yield _dynrule(x, "SAT", start, end, 6)
         if x[14] and x[15]:
             # sunday start/end times no1
             start, end = x[14], x[15]
@@ -843,44 +1224,31 @@ def insert_dynamic_rules_seattle():
                 if x[18] and x[19] and x[18] == (end + 1) and x[27] == x[28]:
                     end = x[19]
                     sun3 = True
-            paid_rules.append(_dynrule(x, "SUN", start, end, 7))
+            yield _dynrule(x, "SUN", start, end, 7)
         if x[16] and x[17] and not sun2:
             # sunday start/end times no2
             start, end = x[16], x[17]
             if x[18] and x[19] and x[18] == (end + 1) and x[27] == x[28]:
                 end = x[19]
                 sun3 = True
-            paid_rules.append(_dynrule(x, "SUN", start, end, 8))
+            yield _dynrule(x, "SUN", start, end, 8)
         if x[18] and x[19] and not sun3:
             # sunday start/end times no3
-            paid_rules.append(_dynrule(x, "SUN", start, end, 9))
+            yield _dynrule(x, "SUN", start, end, 9)
         if x[32]:
             # peak hour restriction
-            insert_qry = "('{}', '{}', '{}'::jsonb, {}, ARRAY[{}]::varchar[], '{}', ARRAY{}::varchar[])"
             code, agenda = "SEA-PAID-{}-10".format(x[0]), {str(y): [] for y in range(1,8)}
             for z in x[32].split(" "):
                 for y in range(1,6):
                     agenda[str(y)].append([tstr_to_float(z.split("-")[0] + z[-2:]),
                         tstr_to_float(z.split("-")[1])])
             desc = "PEAK HOUR NO PARKING WEEKDAYS {}".format(x[32])
-            paid_rules.append(insert_qry.format(code, desc, json.dumps(agenda), "NULL",
-                "'peak_hour'", "", x[1]))
-
-    db.query("""
-        INSERT INTO rules (code, description, agenda, time_max_parking, restrict_types, permit_no)
-        SELECT code, description, agenda, time_max_parking, restrict_types, permit_no
-        FROM (VALUES {}) AS d(code, description, agenda, time_max_parking, restrict_types, permit_no, ids)
-    """.format(",".join([x for x in paid_rules])))
-    db.query("""
-        INSERT INTO seattle_sign_codes (code, signs)
-        SELECT code, ids
-        FROM (VALUES {}) AS d(code, description, agenda, time_max_parking, restrict_types,
-            permit_no, ids)
-    """.format(",".join([x for x in paid_rules])))
+            yield {"code": code, "description": desc, "agenda": agenda,
+                "time_max_parking": None, "restrict_types": ["peak_hour"], "permit_no": "",
+                "signs": x[1]}
 
 
 def _dynrule(x, per, start, end, count):
-    insert_qry = "('{}', '{}', '{}'::jsonb, {}, ARRAY[{}]::varchar[], '{}', ARRAY{}::varchar[])"
     code, agenda = "SEA-PAID-{}-{}".format(x[0], count), {str(y): [] for y in range(1,8)}
     if per == "MON-FRI":
         for y in range(1,6):
@@ -889,5 +1257,7 @@ def _dynrule(x, per, start, end, count):
         agenda["6" if per == "SAT" else "7"].append([float(start) / 60.0, round(float(end) / 60.0)])
     desc = "PAID PARKING {}-{} {} ${}/hr".format(pretty_time(start), pretty_time(end), per,
         "{0:.2f}".format(float(x[19 + count])))
-    return insert_qry.format(code, desc, json.dumps(agenda), int(x[29]) if x[29] else "NULL",
-        "'paid'" + (",'permit'" if x[30] else ""), x[31] if x[31] else "", x[1])
+    return {"code": code, "description": desc, "agenda": agenda,
+        "time_max_parking": int(x[29]) if x[29] else None,
+        "restrict_types": ["paid"] + (["permit"] if x[30] else []),
+        "permit_no": x[31] if x[31] else "", "signs": x[1]}
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Plan regression checks: the statements of every pipeline SQL constant are explained
+against a small fixture database, and their plan shapes compared with a stored baseline.
+"""
+from __future__ import unicode_literals
+
+import io
+import json
+import re
+import string
+
+from .logger import Logger
+from .profiling import sql_constants
+
+
+# statements EXPLAIN accepts
+PLANNABLE = re.compile(
+    r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|'
+    r'CREATE\s+(TEMP\w*\s+)?TABLE\s+(IF\s+NOT\s+EXISTS\s+)?[\w."]+\s+AS)\b', re.I)
+
+# tables considered large enough to make a sequential scan suspicious
+get_large_tables = """
+SELECT relname FROM pg_class
+WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND reltuples >= {rows}
+"""
+
+
+class PlanFormatter(string.Formatter):
+    """
+    Formats SQL constants, replacing the fields missing from the parameters by 0
+    """
+    def get_value(self, key, args, kwargs):
+        return kwargs.get(key, 0) if isinstance(key, basestring) else 0
+
+
+def split_statements(sql):
+    """
+    Split ``sql`` on the semicolons ending its statements
+    (ignoring those in quotes or dollar-quoted bodies)
+    """
+    res, start, idx, quote = [], 0, 0, None
+    while idx < len(sql):
+        if quote:
+            if sql.startswith(quote, idx):
+                idx += len(quote)
+                quote = None
+                continue
+        elif sql[idx] == "'":
+            quote = "'"
+        elif sql[idx] == '$':
+            match = re.match(r'\$\w*\$', sql[idx:])
+            if match:
+                quote = match.group(0)
+                idx += len(quote)
+                continue
+        elif sql[idx] == ';':
+            res.append(sql[start:idx])
+            start = idx + 1
+        idx += 1
+    res.append(sql[start:])
+    return [x.strip() for x in res if x.strip()]
+
+
+def plan_shape(plan):
+    """
+    Reduce a plan node (``EXPLAIN (FORMAT JSON)`` output) to its shape:
+    node types, relations, indexes and join types
+    """
+    shape = {'node': plan['Node Type']}
+    for key, name in [('Relation Name', 'relation'), ('Index Name', 'index'),
+                      ('Join Type', 'join')]:
+        if key in plan:
+            shape[name] = plan[key]
+    children = [plan_shape(x) for x in plan.get('Plans', [])]
+    if children:
+        shape['children'] = children
+    return shape
+
+
+def scans(shape):
+    """
+    Returns the (node type, relation, index) of every scan of a plan shape
+    """
+    res = []
+    if 'relation' in shape or 'index' in shape:
+        res.append((shape['node'], shape.get('relation'), shape.get('index')))
+    for child in shape.get('children', []):
+        res.extend(scans(child))
+    return res
+
+
+def statements(modules, params):
+    """
+    Returns the formatted SQL of each constant, by name.
+    Constants depending on the city are formatted for each city.
+
+    :param modules: dict of module alias to (module, cities)
+    :param params: dict of the values of the fields used in the constants,
+        ``city`` being added for each city
+    """
+    res, seen = {}, set()
+    formatter = PlanFormatter()
+    for alias, (module, cities) in sorted(modules.items()):
+        for name, value in sql_constants({alias: module}):
+            for city in cities:
+                try:
+                    sql = formatter.vformat(value, (), dict(params, city=city))
+                except (ValueError, IndexError, KeyError):
+                    # not a format string
+                    sql = value
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                res[name if '{city}' not in value else '{}[{}]'.format(name, city)] = sql
+    return res
+
+
+def explain(db, sql):
+    """
+    Returns the plan of each statement of ``sql``, running them in a transaction
+    rolled back once done so that later statements see the tables created before
+    """
+    cur = db.db.cursor()
+    plans = []
+    try:
+        for stmt in split_statements(sql):
+            if PLANNABLE.match(stmt):
+                cur.execute("EXPLAIN (FORMAT JSON) " + stmt)
+                plan = cur.fetchone()[0][0]['Plan']
+                plans.append({'shape': plan_shape(plan), 'cost': plan['Total Cost']})
+            cur.execute(stmt)
+    finally:
+        db.db.rollback()
+    return plans
+
+
+def collect_plans(db, sqls):
+    """
+    Explain every statement of ``sqls`` (dict of name to SQL),
+    returns a dict of name to ``{'plans': [...]}`` or ``{'error': message}``
+    """
+    res = {}
+    for name, sql in sorted(sqls.items()):
+        try:
+            plans = explain(db, sql)
+        except Exception as err:
+            res[name] = {'error': '{}'.format(err).strip()}
+            continue
+        if plans:
+            res[name] = {'plans': plans}
+    return res
+
+
+def compare_plans(baseline, current, large_tables=(), cost_ratio=2.0):
+    """
+    Returns the regressions of the ``current`` plans compared to the ``baseline``:
+    new sequential scans on large tables, indexes no longer used,
+    estimated cost increased by more than ``cost_ratio``, statements failing
+    and statements without a plan in either of them
+    """
+    issues = []
+    for name in sorted(set(current) - set(baseline)):
+        issues.append("{}: no baseline plan".format(name))
+    for name, before in sorted(baseline.items()):
+        after = current.get(name)
+        if after is None:
+            issues.append("{}: no longer explained".format(name))
+            continue
+        if 'error' in after:
+            issues.append("{}: fails ({})".format(name, after['error']))
+            continue
+        if 'error' in before:
+            issues.append("{}: no baseline plan ({})".format(name, before['error']))
+            continue
+        if len(before['plans']) != len(after['plans']):
+            issues.append("{}: {} statements explained instead of {}".format(
+                name, len(after['plans']), len(before['plans'])))
+        for idx, (old, new) in enumerate(zip(before['plans'], after['plans'])):
+            label = name if len(before['plans']) == 1 else '{}#{}'.format(name, idx + 1)
+            old_scans, new_scans = scans(old['shape']), scans(new['shape'])
+            seq = set(x[1] for x in new_scans if x[0] == 'Seq Scan' and x[1] in large_tables)
+            seq -= set(x[1] for x in old_scans if x[0] == 'Seq Scan')
+            for table in sorted(seq):
+                issues.append("{}: new sequential scan on {}".format(label, table))
+            lost = set(x[2] for x in old_scans if x[2]) - set(x[2] for x in new_scans if x[2])
+            for index in sorted(lost):
+                issues.append("{}: index {} no longer used".format(label, index))
+            if old['cost'] and new['cost'] > old['cost'] * cost_ratio:
+                issues.append("{}: estimated cost went from {:.0f} to {:.0f}".format(
+                    label, old['cost'], new['cost']))
+    return issues
+
+
+def check_plans(db, modules, params, path, update=False, large_rows=1000, cost_ratio=2.0):
+    """
+    Explain the pipeline statements and compare them to the baseline stored in ``path``
+
+    :param update: store the current plans as the new baseline instead,
+        unless some statements cannot be explained
+    :param large_rows: number of rows from which a table is considered large
+    :returns: the list of regressions found
+    """
+    current = collect_plans(db, statements(modules, params))
+
+    if update:
+        # a baseline is only useful if every statement has a plan to compare with
+        issues = ["{}: fails ({})".format(name, entry['error'])
+                  for name, entry in sorted(current.items()) if 'error' in entry]
+        if issues:
+            for issue in issues:
+                Logger.warning(issue)
+            Logger.error("Baseline not stored: {} statements cannot be explained, "
+                         "are the fixtures loaded?".format(len(issues)))
+            return issues
+        with io.open(path, 'w', encoding='utf-8') as outfile:
+            outfile.write(unicode(json.dumps(current, indent=2, sort_keys=True)))
+        Logger.info("Plans of {} statements stored in {}".format(len(current), path))
+        return []
+
+    with io.open(path, encoding='utf-8') as infile:
+        baseline = json.load(infile)
+    large_tables = [x[0] for x in db.query(get_large_tables.format(rows=large_rows))]
+    issues = compare_plans(baseline, current, large_tables, cost_ratio)
+    for issue in issues:
+        Logger.warning(issue)
+    Logger.info("{} plans checked, {} regressions".format(len(current), len(issues)))
+    return issues
@@ -77,3 +77,54 @@ BEGIN
 END
 $$ LANGUAGE plpgsql;
 """
+
+# index of the quarter hour of the week of a timestamp in the availability bitmaps
+# (see ``availability.bucket``)
+availability_bucket = """
+CREATE OR REPLACE FUNCTION availability_bucket(ts timestamp)
+RETURNS integer LANGUAGE SQL IMMUTABLE
+AS $$
+SELECT (extract(isodow FROM ts)::integer - 1) * 96
+    + extract(hour FROM ts)::integer * 4
+    + extract(minute FROM ts)::integer / 15;
+$$
+"""
+
+# index of the day of a date in the masks of the days of the year of the rules
+# (see ``agenda.day_of_year``), days being those of a leap year
+day_of_year_bit = """
+CREATE OR REPLACE FUNCTION day_of_year_bit(d date)
+RETURNS integer LANGUAGE SQL IMMUTABLE
+AS $$
+SELECT make_date(2000, extract(month FROM d)::integer, extract(day FROM d)::integer)
+    - date '2000-01-01';
+$$
+"""
+
+# rules applying on a date, testing a single bit of each rule whatever its number of periods
+rules_on = """
+CREATE OR REPLACE FUNCTION rules_on(d date)
+RETURNS TABLE (id integer, code varchar) LANGUAGE SQL STABLE
+AS $$
+SELECT id, code FROM rules WHERE get_bit(days, day_of_year_bit(d)) = 1;
+$$
+"""
+
+# slots in a bbox (EPSG:3857) where parking is allowed at a given time, read from the
+# availability index: no restriction applies at that time except time limits and the
+# accepted restriction types (e.g. paid), time_max_parking being the lowest limit applying
+available_slots = """
+CREATE OR REPLACE FUNCTION available_slots(ts timestamp, bbox geometry,
+    accepted varchar[] DEFAULT ARRAY['paid']::varchar[])
+RETURNS TABLE (id integer, time_max_parking float) LANGUAGE SQL STABLE
+AS $$
+SELECT s.id, min(a.time_max_parking)
+FROM slots s
+LEFT JOIN slot_availability a ON a.slot_id = s.id
+    AND get_bit(a.buckets, availability_bucket(ts)) = 1
+    AND get_bit(a.days, day_of_year_bit(ts::date)) = 1
+WHERE s.geom && bbox
+GROUP BY s.id
+HAVING bool_and(a.kind IS NULL OR a.kind = 'time_max' OR a.kind = ANY(accepted));
+$$
+"""
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cgi
+import io
+import json
+import re
+import string
+import threading
+import time
+from contextlib import contextmanager
+
+from . import common
+from .logger import Logger
+
+
+# size of the blocks counted by EXPLAIN and pg_stat_statements
+BLOCK_SIZE = 8192
+
+# statements that can be run through EXPLAIN ANALYZE without losing their result
+EXPLAINABLE = re.compile(r'^\s*(INSERT|UPDATE|DELETE|CREATE\s+TABLE\s+\w+\s+AS)\b', re.I)
+
+
+def template_pattern(template):
+    """
+    Returns a regex matching the strings obtained by formatting ``template``
+    and the length of its literal text
+    """
+    parts, size = [], 0
+    for literal, field, _, _ in string.Formatter().parse(template):
+        parts.append(re.escape(literal))
+        size += len(literal)
+        if field is not None:
+            parts.append('.*?')
+    return re.compile(''.join(parts) + '$', re.S), size
+
+
+def sql_constants(modules):
+    """
+    Yields the name (``alias.constant``) and value of the string constants
+    of ``modules``, a dict of module alias to module
+    """
+    for alias, module in sorted((modules or {}).items()):
+        for name, value in sorted(vars(module).items()):
+            if isinstance(value, basestring) and not name.startswith('_'):
+                yield '{}.{}'.format(alias, name), value
+
+
+class StatementRegistry(object):
+    """
+    Names statements after the SQL constant they were formatted from
+    (e.g. ``common.aggregate_like_slots``), looked up in ``modules``
+    """
+    def __init__(self, modules=None):
+        """
+        :param modules: dict of module alias to module holding SQL constants
+        """
+        self.names = {}
+        self.templates = []
+        for name, value in sql_constants(modules):
+            try:
+                pattern, size = template_pattern(value)
+            except ValueError:
+                # not a format string
+                continue
+            self.templates.append((size, name, pattern))
+
+    def name(self, stmt):
+        """
+        Returns the name of the SQL constant ``stmt`` was made from,
+        the most specific one if several match
+        """
+        if stmt not in self.names:
+            matches = [(size, name) for size, name, pattern in self.templates
+                       if pattern.match(stmt)]
+            self.names[stmt] = max(matches)[1] if matches else ' '.join(stmt.split())[:60]
+        return self.names[stmt]
+
+
+def statement_rows(plan):
+    """
+    Returns the number of rows a statement explained with ``plan`` (its top node) processed:
+    data modifying statements return none themselves, they count those they are fed with
+    """
+    if plan.get('Node Type') == 'ModifyTable':
+        return sum(x.get('Actual Rows', 0) * x.get('Actual Loops', 1) for x in plan.get('Plans', []))
+    return plan.get('Actual Rows')
+
+
+class QueryProfiler(object):
+    """
+    Records an event with the wall time, rows and buffer usage of each query,
+    named with a ``StatementRegistry`` and attributed to the running stage.
+
+    Queries are recorded by ``PostgresWrapper.query``, ``queries`` and ``copy_from``.
+    Those of ``iter_query`` are not: the rows are fetched while the caller processes them,
+    so the time of the query cannot be told apart from the caller's.
+
+    Buffer usage and temporary files (``temp_bytes``) are only known for the statements
+    run through EXPLAIN ANALYZE (``explain``), they are None otherwise; the
+    ``pg_stat_statements`` diff has temporary files for all statements.
+
+    Queries slower than ``slow`` seconds are logged as they complete.
+    """
+    def __init__(self, modules=None, explain=False, cities=(), slow=None):
+        """
+        :param modules: dict of module alias to module holding SQL constants
+        :param explain: run data modifying statements through
+            ``EXPLAIN (ANALYZE, BUFFERS)`` to get their buffer usage
+        :param cities: names of the cities, the city of an event is the one
+            its stage is named after (e.g. ``shorten_montreal``)
+        :param slow: duration in seconds over which a query is logged as slow
+        """
+        self.explain = explain
+        self.cities = list(cities)
+        self.slow = slow
+        self.queries = []
+        self.stages = []
+        self.stat_statements = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.registry = StatementRegistry(modules)
+
+    def name(self, stmt):
+        """
+        Returns the name of the SQL constant ``stmt`` was made from
+        """
+        return self.registry.name(stmt)
+
+    def explainable(self, stmt):
+        """
+        Returns True if ``stmt`` is a single statement that can be explained
+        """
+        return (self.explain and EXPLAINABLE.match(stmt) is not None
+                and ';' not in stmt.strip().rstrip(';')
+                and 'RETURNING' not in stmt.upper())
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Attribute the queries of the current thread to stage ``name``
+        and record its duration
+        """
+        self.local.stage = name
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages.append({'stage': name, 'time': time.time() - start})
+            self.local.stage = None
+
+    def city(self, stage):
+        """
+        Returns the city ``stage`` is working on, if any
+        """
+        for city in self.cities:
+            if stage == city or stage.endswith('_' + city):
+                return city
+
+    def record(self, stmt, duration, rows, plan=None):
+        """
+        Record an executed statement
+
+        :param rows: row count of the cursor, ignored when ``plan`` is given since the
+            cursor then counts the rows of the EXPLAIN output
+        :param plan: output of ``EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`` if any, the rows
+            returned by its top node are stored in ``plan_rows``
+        """
+        stage = getattr(self.local, 'stage', None) or 'setup'
+        entry = {
+            'stage': stage,
+            'city': self.city(stage),
+            'statement': self.name(stmt),
+            'time': duration,
+            'rows': rows,
+            'temp_bytes': None,
+        }
+        if plan:
+            top = plan[0]['Plan']
+            entry['rows'] = statement_rows(top)
+            entry['plan_rows'] = top.get('Actual Rows')
+            entry['shared_hit'] = top.get('Shared Hit Blocks', 0)
+            entry['shared_read'] = top.get('Shared Read Blocks', 0)
+            entry['temp_read'] = top.get('Temp Read Blocks', 0)
+            entry['temp_written'] = top.get('Temp Written Blocks', 0)
+            entry['temp_bytes'] = entry['temp_written'] * BLOCK_SIZE
+        if self.slow is not None and duration >= self.slow:
+            Logger.warning("Slow query: {} ({}) took {:.1f}s".format(
+                entry['statement'], stage, duration))
+        with self.lock:
+            self.queries.append(entry)
+
+    def slow_queries(self):
+        """
+        Returns the events of the queries slower than the threshold, slowest first
+        """
+        if self.slow is None:
+            return []
+        return sorted([x for x in self.queries if x['time'] >= self.slow],
+                      key=lambda x: x['time'], reverse=True)
+
+    def snapshot(self, db):
+        """
+        Returns the ``pg_stat_statements`` counters of the current database,
+        None if the extension is not installed
+        """
+        if not db.query(common.has_stat_statements):
+            return None
+        res = {}
+        for row in db.query(common.get_stat_statements, namedtuple=True):
+            row = row._asdict()
+            res[(row['userid'], row['queryid'])] = {
+                'query': row['query'],
+                'calls': row['calls'],
+                # renamed in PostgreSQL 13
+                'time': row.get('total_exec_time', row.get('total_time')),
+                'rows': row['rows'],
+                'temp_bytes': row['temp_blks_written'] * BLOCK_SIZE,
+            }
+        return res
+
+    def diff_snapshots(self, before, after):
+        """
+        Store the ``pg_stat_statements`` counters accumulated between two snapshots,
+        per statement ranked by total time (times in seconds)
+        """
+        if before is None or after is None:
+            Logger.warning("pg_stat_statements is not installed, statistics are not diffed")
+            return
+        stats = []
+        for key, stat in after.items():
+            prev = before.get(key, {'calls': 0, 'time': 0.0, 'rows': 0, 'temp_bytes': 0})
+            if stat['calls'] <= prev['calls']:
+                continue
+            stats.append({
+                'statement': self.name(stat['query']),
+                'calls': stat['calls'] - prev['calls'],
+                'time': (stat['time'] - prev['time']) / 1000.0,
+                'rows': stat['rows'] - prev['rows'],
+                'temp_bytes': stat['temp_bytes'] - prev['temp_bytes'],
+            })
+        self.stat_statements = sorted(stats, key=lambda x: x['time'], reverse=True)
+
+    def summary(self):
+        """
+        Returns the statements ranked by total time, along with the stage timings
+        """
+        stats = {}
+        for query in self.queries:
+            stat = stats.setdefault(query['statement'], {
+                'statement': query['statement'], 'stages': set(), 'calls': 0,
+                'time': 0.0, 'max_time': 0.0, 'rows': 0,
+                'shared_hit': 0, 'shared_read': 0, 'temp_read': 0, 'temp_written': 0
+            })
+            stat['stages'].add(query['stage'])
+            stat['calls'] += 1
+            stat['time'] += query['time']
+            stat['max_time'] = max(stat['max_time'], query['time'])
+            stat['rows'] += max(query['rows'] or 0, 0)
+            for key in ('shared_hit', 'shared_read', 'temp_read', 'temp_written'):
+                stat[key] += query.get(key, 0)
+        for stat in stats.values():
+            stat['stages'] = sorted(stat['stages'])
+        return {
+            'stages': sorted(self.stages, key=lambda x: x['time'], reverse=True),
+            'statements': sorted(stats.values(), key=lambda x: x['time'], reverse=True),
+            'slow': self.slow_queries(),
+            'stat_statements': self.stat_statements,
+        }
+
+    def report(self, path):
+        """
+        Write the summary to ``path``.json and ``path``.html,
+        and the events of every query to ``path``.events.json (one per line)
+        """
+        summary = self.summary()
+        with io.open(path + '.json', 'w', encoding='utf-8') as outfile:
+            outfile.write(unicode(json.dumps(summary, indent=2)))
+        with io.open(path + '.events.json', 'w', encoding='utf-8') as outfile:
+            for event in self.queries:
+                outfile.write(unicode(json.dumps(event)) + '\n')
+
+        def table(rows, columns):
+            lines = ['<tr>{}</tr>'.format(''.join('<th>{}</th>'.format(x) for x in columns))]
+            for row in rows:
+                lines.append('<tr>{}</tr>'.format(''.join(
+                    '<td>{}</td>'.format(cgi.escape(
+                        '{:.3f}'.format(row[x]) if isinstance(row[x], float) else
+                        ', '.join(row[x]) if isinstance(row[x], list) else
+                        '{}'.format(row[x])))
+                    for x in columns)))
+            return '<table>\n{}\n</table>'.format('\n'.join(lines))
+
+        with io.open(path + '.html', 'w', encoding='utf-8') as outfile:
+            outfile.write(
+                '<html><head><meta charset="utf-8"><title>prkng pipeline profile</title>'
+                '<style>td, th {{padding: 2px 8px; text-align: left}}</style></head><body>\n'
+                '<h2>Stages</h2>\n{}\n<h2>Statements</h2>\n{}\n'
+                '<h2>Slow queries</h2>\n{}\n<h2>pg_stat_statements</h2>\n{}\n'
+                '</body></html>\n'.format(
+                    table(summary['stages'], ['stage', 'time']),
+                    table(summary['statements'], [
+                        'statement', 'stages', 'calls', 'time', 'max_time', 'rows',
+                        'shared_hit', 'shared_read', 'temp_read', 'temp_written']),
+                    table(summary['slow'], ['statement', 'stage', 'city', 'time', 'rows']),
+                    table(summary['stat_statements'], [
+                        'statement', 'calls', 'time', 'rows', 'temp_bytes'])))
+        Logger.info("Profiling report written to {}.json and {}.html".format(path, path))
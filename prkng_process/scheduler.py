@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import Queue
+import threading
+import time
+
+from . import common
+from .logger import Logger
+
+
+class Stage(object):
+    """
+    A unit of work of the pipeline along with the tables it reads and writes
+    """
+    def __init__(self, name, func, reads=(), writes=(), args=(), kwargs=None):
+        """
+        :param name: unique name of the stage
+        :param func: callable receiving a database connection as first argument
+        :param reads: names of the tables read by the stage
+        :param writes: names of the tables created or modified by the stage
+        """
+        self.name = name
+        self.func = func
+        self.reads = frozenset(reads)
+        self.writes = frozenset(writes)
+        self.args = args
+        self.kwargs = kwargs or {}
+
+    def conflicts_with(self, other):
+        """
+        Returns True if the stage cannot run at the same time as ``other``
+        (one of them writes a table that the other one reads or writes)
+        """
+        return bool(
+            self.writes & (other.reads | other.writes) or
+            other.writes & self.reads
+        )
+
+    def __call__(self, db):
+        return self.func(db, *self.args, **self.kwargs)
+
+    def __repr__(self):
+        return "<Stage {}>".format(self.name)
+
+
+class RunState(object):
+    """
+    Records in the database the stages completed by a pipeline run.
+
+    Each table written by a stage gets its version bumped when the stage
+    completes, and the stage stores the oid and version of every table it read.
+    A completed stage can then be skipped as long as these are unchanged
+    (a table reloaded by ``update`` is recreated, hence gets a new oid)
+    and the tables it writes still exist.
+    """
+    def setup(self, db):
+        db.query(common.create_pipeline_state)
+
+    def reset(self, db):
+        """
+        Forget completed stages, so that the next run starts from scratch
+        """
+        db.query("DELETE FROM pipeline_state")
+
+    def table_state(self, db, tables):
+        """
+        Returns a dict with ``[oid, version]`` for each table,
+        oid is None if the table does not exist
+        """
+        if not tables:
+            return {}
+        res = db.query(common.get_table_state.format(
+            tables=",".join("'{}'".format(x) for x in sorted(tables))))
+        return {name: [oid, version] for name, oid, version in res}
+
+    def is_done(self, db, stage):
+        """
+        Returns True if ``stage`` completed and its tables did not change since
+        """
+        res = db.query("SELECT inputs FROM pipeline_state WHERE stage = '{}'".format(stage.name))
+        if not res:
+            return False
+        current = self.table_state(db, stage.reads | stage.writes)
+        if any(current[x][0] is None for x in stage.writes):
+            return False
+        return res[0][0] == {x: current[x] for x in stage.reads}
+
+    def mark_done(self, db, stage):
+        """
+        Record the completion of ``stage``
+        """
+        if stage.writes:
+            db.query(common.bump_table_versions.format(
+                tables=",".join("'{}'".format(x) for x in sorted(stage.writes))))
+        inputs = self.table_state(db, stage.reads)
+        db.query(common.save_stage_state.format(stage=stage.name, inputs=json.dumps(inputs)))
+
+
+class Scheduler(object):
+    """
+    Runs stages in the order they were added, executing independent stages
+    at the same time on separate connections.
+
+    A stage depends on every previously added stage it conflicts with,
+    so that running with several jobs gives the same result as running
+    them one after the other.
+
+    When given a ``RunState``, completed stages are recorded and stages that
+    already completed are skipped, unless one of their dependencies had to run.
+    """
+    def __init__(self, connect, jobs=1, state=None, profiler=None, release=None):
+        """
+        :param connect: callable returning a ``PostgresWrapper``
+        :param jobs: maximum number of stages running at the same time
+        :param state: optional ``RunState`` used to skip completed stages
+        :param profiler: optional ``QueryProfiler`` timing each stage
+        :param release: optional callable receiving the connections
+            once no more stages run on them
+        """
+        self.connect = connect
+        self.release = release
+        self.jobs = max(1, int(jobs))
+        self.state = state
+        self.profiler = profiler
+        self.stages = []
+
+    def add(self, name, func, reads=(), writes=(), *args, **kwargs):
+        """
+        Declare a new stage. Extra arguments are passed to ``func``
+        after the database connection.
+        """
+        if name in [x.name for x in self.stages]:
+            raise ValueError("Stage '{}' is already declared".format(name))
+        stage = Stage(name, func, reads, writes, args, kwargs)
+        self.stages.append(stage)
+        return stage
+
+    def dependencies(self):
+        """
+        Returns a dict with the names of the stages each stage must wait for
+        """
+        deps = {}
+        for idx, stage in enumerate(self.stages):
+            deps[stage.name] = set(
+                x.name for x in self.stages[:idx] if stage.conflicts_with(x))
+        return deps
+
+    def run(self):
+        """
+        Execute all stages, returns the list of stage names in completion order
+        """
+        if self.jobs == 1 or len(self.stages) < 2:
+            return self._run_serial()
+        return self._run_parallel()
+
+    def _execute(self, db, stage, force=True):
+        """
+        Run ``stage``, returns False if it was skipped
+        """
+        if self.state and not force and self.state.is_done(db, stage):
+            Logger.info("Scheduler: skipping stage '{}' (already completed)".format(stage.name))
+            return False
+        Logger.debug("Scheduler: starting stage '{}'".format(stage.name))
+        start = time.time()
+        if self.profiler:
+            with self.profiler.stage(stage.name):
+                stage(db)
+        else:
+            stage(db)
+        if self.state:
+            self.state.mark_done(db, stage)
+        Logger.debug("Scheduler: stage '{}' done in {:.1f}s"
+                     .format(stage.name, time.time() - start))
+        return True
+
+    def _release(self, db):
+        if db is not None and self.release:
+            self.release(db)
+
+    def _run_serial(self):
+        deps = self.dependencies()
+        db = self.connect()
+        done, executed = [], set()
+        try:
+            for stage in self.stages:
+                if self._execute(db, stage, force=bool(deps[stage.name] & executed)):
+                    executed.add(stage.name)
+                done.append(stage.name)
+        finally:
+            self._release(db)
+        return done
+
+    def _run_parallel(self):
+        deps = self.dependencies()
+        pending = list(self.stages)
+        running, done, executed = set(), [], set()
+        tasks, results = Queue.Queue(), Queue.Queue()
+        failure = None
+
+        def worker():
+            db = None
+            while True:
+                task = tasks.get()
+                if task is None:
+                    self._release(db)
+                    return
+                stage, force = task
+                try:
+                    if db is None:
+                        db = self.connect()
+                    results.put((stage, self._execute(db, stage, force), None))
+                except Exception as err:
+                    results.put((stage, True, err))
+
+        workers = [threading.Thread(target=worker) for _ in range(min(self.jobs, len(pending)))]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while pending or running:
+                if failure is None:
+                    for stage in [x for x in pending if not deps[x.name] - set(done)]:
+                        if len(running) >= len(workers):
+                            break
+                        pending.remove(stage)
+                        running.add(stage.name)
+                        tasks.put((stage, bool(deps[stage.name] & executed)))
+                elif not running:
+                    break
+
+                stage, ran, err = results.get()
+                running.discard(stage.name)
+                if err is not None:
+                    Logger.error("Scheduler: stage '{}' failed: {}".format(stage.name, err))
+                    failure = failure or err
+                else:
+                    done.append(stage.name)
+                    if ran:
+                        executed.add(stage.name)
+        finally:
+            for _ in workers:
+                tasks.put(None)
+
+        # workers give back their connection once stopped
+        for thread in workers:
+            thread.join()
+
+        if failure is not None:
+            raise failure
+        return done
@@ -0,0 +1,766 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic grid city, loaded in the source tables of Montréal
+so that it goes through the Montréal processing stages, and in the sources
+of the other cities and of OSM for the plans baseline (see ``load_fixture``).
+
+Meant for benchmarks on a throwaway database: it replaces the sources it is loaded in.
+"""
+from __future__ import unicode_literals
+
+import csv
+import math
+import os
+import random
+import re
+
+from . import common, plfunctions
+from .copyio import array_literal
+from .fingerprint import InputFingerprints
+from .logger import Logger
+from .scheduler import RunState
+
+
+# number of signposts of the city the plans baseline is made on (see ``load_fixture``)
+FIXTURE_SIGNPOSTS = 2000
+
+# origin of the grid (EPSG:3857)
+ORIGIN = (-8180000.0, 5700000.0)
+
+create_roads = """
+DROP TABLE IF EXISTS roads;
+CREATE TABLE roads(
+    id serial
+    , osm_id bigint
+    , name varchar
+    , geom geometry(linestring, 3857)
+)
+"""
+
+create_sources = """
+DROP TABLE IF EXISTS montreal_geobase;
+CREATE TABLE montreal_geobase (
+    gid serial PRIMARY KEY
+    , id_trc integer
+    , nom_voie varchar
+    , geom geometry(linestring, 3857)
+);
+
+DROP TABLE IF EXISTS montreal_geobase_double;
+CREATE TABLE montreal_geobase_double (
+    gid serial PRIMARY KEY
+    , id_trc integer
+    , cote_rue_i integer
+    , geom geometry(linestring, 3857)
+);
+
+DROP TABLE IF EXISTS montreal_poteaux;
+CREATE TABLE montreal_poteaux (
+    poteau_id_pot integer PRIMARY KEY
+    , description_rep varchar
+    , trc_id integer
+    , geom geometry(point, 3857)
+);
+
+DROP TABLE IF EXISTS montreal_descr_panneau;
+CREATE TABLE montreal_descr_panneau (
+    panneau_id_pan integer
+    , poteau_id_pot integer
+    , position_pop integer
+    , fleche_pan integer
+    , code_rpa varchar
+    , description_rpa varchar
+);
+
+DROP TABLE IF EXISTS montreal_data_verdun;
+CREATE TABLE montreal_data_verdun (
+    id serial
+    , id_trc varchar
+    , id_trc_pair varchar
+    , id_trc_impair varchar
+    , rule_pair_1 varchar
+    , rule_pair_2 varchar
+    , rule_impair_1 varchar
+    , rule_impair_2 varchar
+);
+
+DROP TABLE IF EXISTS montreal_bornes;
+CREATE TABLE montreal_bornes (
+    gid serial
+    , geobase_id integer
+    , rate float
+    , rules varchar
+    , geom geometry(point, 3857)
+);
+
+CREATE TABLE IF NOT EXISTS permit_zones (
+    id serial
+    , number varchar
+    , geom geometry(multipolygon, 3857)
+)
+"""
+
+# OSM lines, as loaded by osm2pgsql, the roads being rebuilt from them
+create_osm_lines = """
+DROP TABLE IF EXISTS planet_osm_line;
+CREATE TABLE planet_osm_line (
+    osm_id bigint
+    , name varchar
+    , highway varchar
+    , railway varchar
+    , waterway varchar
+    , boundary varchar
+    , leisure varchar
+    , landuse varchar
+    , tunnel varchar
+    , service varchar
+    , power varchar
+    , way geometry(linestring, 3857)
+)
+"""
+
+# sources of the other cities, with the columns their processing reads
+create_city_sources = {
+    'quebec': """
+DROP TABLE IF EXISTS quebec_panneau;
+CREATE TABLE quebec_panneau (
+    gid serial PRIMARY KEY
+    , id numeric
+    , type_code varchar
+    , type_desc varchar
+    , nom_topog varchar
+    , lect_met varchar
+    , id_voie_pu numeric
+    , cote_rue varchar
+    , geom geometry(point, 3857)
+);
+
+DROP TABLE IF EXISTS quebec_bornes;
+CREATE TABLE quebec_bornes (
+    gid serial PRIMARY KEY
+    , id numeric
+    , no_borne varchar
+    , nom_topog varchar
+    , geom geometry(point, 3857)
+)
+""",
+    'newyork': """
+DROP TABLE IF EXISTS newyork_signs_raw;
+CREATE TABLE newyork_signs_raw (
+    gid serial PRIMARY KEY
+    , objectid numeric
+    , sg_key_bor varchar
+    , sg_order_n varchar
+    , sg_seqno_n numeric
+    , sg_mutcd_c varchar
+    , sg_arrow_d varchar
+    , sr_dist numeric
+    , x numeric
+    , y numeric
+    , geom geometry(point, 3857)
+);
+
+DROP TABLE IF EXISTS newyork_geobase;
+CREATE TABLE newyork_geobase (
+    gid serial PRIMARY KEY
+    , physicalid numeric
+    , boroughcod varchar
+    , b5_sc varchar
+    , b7_sc varchar
+    , geom geometry(multilinestring, 3857)
+);
+
+DROP TABLE IF EXISTS newyork_snd;
+CREATE TABLE newyork_snd (
+    id serial PRIMARY KEY
+    , boro smallint
+    , stname_lab varchar
+    , b5sc integer
+    , b7sc integer
+);
+
+DROP TABLE IF EXISTS newyork_roads_locations;
+CREATE TABLE newyork_roads_locations (
+    id serial PRIMARY KEY
+    , boro varchar
+    , order_no varchar
+    , main_st varchar
+    , from_st varchar
+    , to_st varchar
+    , sos varchar
+);
+
+DROP TABLE IF EXISTS metered_rate_zones;
+CREATE TABLE metered_rate_zones (
+    gid serial PRIMARY KEY
+    , city varchar
+    , hourly_rat float
+    , geom geometry(multipolygon, 3857)
+)
+""",
+    'seattle': """
+DROP TABLE IF EXISTS seattle_geobase;
+CREATE TABLE seattle_geobase (
+    gid serial PRIMARY KEY
+    , compkey integer
+    , ord_stname varchar
+    , geom geometry(linestring, 3857)
+);
+
+DROP TABLE IF EXISTS seattle_parklines;
+CREATE TABLE seattle_parklines (
+    ogc_fid serial PRIMARY KEY
+    , elmntkey integer
+    , segkey integer
+    , side varchar
+    , parking_category varchar
+    , wkd_start1 integer, wkd_end1 integer, wkd_start2 integer
+    , wkd_end2 integer, wkd_start3 integer, wkd_end3 integer
+    , sat_start1 integer, sat_end1 integer, sat_start2 integer
+    , sat_end2 integer, sat_start3 integer, sat_end3 integer
+    , sun_start1 integer, sun_end1 integer, sun_start2 integer
+    , sun_end2 integer, sun_start3 integer, sun_end3 integer
+    , wkd_rate1 float, wkd_rate2 float, wkd_rate3 float
+    , sat_rate1 float, sat_rate2 float, sat_rate3 float
+    , sun_rate1 float, sun_rate2 float, sun_rate3 float
+    , parking_time_limit integer
+    , rpz_spaces integer
+    , rpz_zone varchar
+    , peak_hour varchar
+    , geom geometry(multilinestring, 3857)
+);
+
+DROP TABLE IF EXISTS seattle_curblines;
+CREATE TABLE seattle_curblines (
+    ogc_fid serial PRIMARY KEY
+    , objectid integer
+    , side varchar
+    , spacetype varchar
+    , current_status varchar
+    , geom geometry(multilinestring, 3857)
+);
+
+DROP TABLE IF EXISTS seattle_signs_raw;
+CREATE TABLE seattle_signs_raw (
+    ogc_fid serial PRIMARY KEY
+    , unitid varchar
+    , segkey integer
+    , category varchar
+    , signtype varchar
+    , customtext varchar
+    , fieldnotes varchar
+    , distance float
+    , geom geometry(point, 3857)
+);
+
+DROP TABLE IF EXISTS seattle_sign_codes;
+CREATE TABLE seattle_sign_codes (
+    code varchar
+    , signs varchar[]
+)
+""",
+    'boston': """
+DROP TABLE IF EXISTS boston_geobase;
+CREATE TABLE boston_geobase (
+    ogc_fid serial PRIMARY KEY
+    , roadsegmen integer
+    , streetlist integer
+    , streetname varchar
+    , streetna_1 varchar
+    , facilityty integer
+    , geom geometry(multilinestring, 3857)
+);
+
+DROP TABLE IF EXISTS boston_metro_geobase;
+CREATE TABLE boston_metro_geobase (
+    gid serial PRIMARY KEY
+    , roadsegmen integer
+    , streetname varchar
+    , mgis_town varchar
+    , geom geometry(multilinestring, 3857)
+);
+
+DROP TABLE IF EXISTS meters_boston;
+CREATE TABLE meters_boston (
+    gid serial PRIMARY KEY
+    , city varchar
+    , roadsegmen integer
+    , geom geometry(point, 3857)
+);
+
+DROP TABLE IF EXISTS boston_address;
+CREATE TABLE boston_address (
+    ogc_fid serial PRIMARY KEY
+    , street_number_sort varchar
+    , street_body varchar
+    , street_full_suffix varchar
+    , geom geometry(point, 3857)
+);
+
+DROP TABLE IF EXISTS cambridge_address;
+CREATE TABLE cambridge_address (
+    ogc_fid serial PRIMARY KEY
+    , stnm varchar
+    , stname varchar
+    , geom geometry(point, 3857)
+);
+
+DROP TABLE IF EXISTS cambridge_sweep_zones;
+CREATE TABLE cambridge_sweep_zones (
+    ogc_fid serial PRIMARY KEY
+    , district varchar
+    , type varchar
+    , geom geometry(multipolygon, 3857)
+);
+
+DROP TABLE IF EXISTS boston_sweep_sched;
+CREATE TABLE boston_sweep_sched (
+    id integer
+    , street varchar
+    , from_st varchar
+    , to_st varchar
+    , side varchar
+)
+"""
+}
+
+# restrictions of the Seattle block faces: (parking category, curb space type,
+# sign category, sign type), the paid ones having no sign
+SEATTLE_CATEGORIES = [
+    ('Paid Parking', 'PS', None, None),
+    ('Time Limited Parking', 'TL', 'PTIML', 'PT'),
+    ('Restricted Parking Zone', 'RPZ', 'PRZ', 'PR'),
+    ('No Parking Allowed', 'NP', 'PNP', 'PN'),
+    ('Unrestricted Parking', 'UNR', None, None),
+]
+
+
+def rule_codes(filename, montreal=True):
+    """
+    Returns the (code, description) of the rules of a ``data/rules_*.csv`` file
+    kept by the sign selection of the Montréal processing, or only without
+    the panonceaux if ``montreal`` is False
+    """
+    with open(filename, 'rb') as infile:
+        rows = [(x['code'].decode('utf-8'), x['description'].decode('utf-8'))
+                for x in csv.DictReader(infile)]
+    return sorted(set(
+        (code, desc) for code, desc in rows
+        if 'panonceau' not in desc.lower() and (not montreal or (
+            not re.match(r'^R[BCGHK]', code) and code != 'RD-TT' and '(flexible)' not in desc))
+    ))
+
+
+class SyntheticCity(object):
+    """
+    Square grid of streets split in blocks at each intersection, with a geobase
+    matching the roads and signposts on both sides of each block
+    """
+    def __init__(self, signposts, rules, block=100.0, spacing=30.0, seed=0):
+        """
+        :param signposts: approximate number of signposts
+        :param rules: list of (code, description) the signs are drawn from
+        :param block: length of a block in meters
+        :param spacing: mean distance between two signposts of a block side
+        :param seed: seed of the random generator, for reproducible cities
+        """
+        self.rules = rules
+        self.block = block
+        self.spacing = spacing
+        self.seed = seed
+        per_block = 2.0 * block / spacing
+        blocks = int(math.ceil(signposts / per_block))
+        # a grid of n x n intersections has 2n(n-1) blocks
+        self.size = int(math.ceil((1 + math.sqrt(1 + 2 * blocks)) / 2))
+
+    def blocks(self):
+        """
+        Yields the (id, street name, start, end) of each block
+        """
+        idx = 0
+        for street in range(self.size):
+            for pos in range(self.size - 1):
+                idx += 1
+                x0, y0 = ORIGIN[0] + pos * self.block, ORIGIN[1] + street * self.block
+                yield idx, 'Rue {}'.format(street + 1), (x0, y0), (x0 + self.block, y0)
+                idx += 1
+                x0, y0 = ORIGIN[0] + street * self.block, ORIGIN[1] + pos * self.block
+                yield idx, 'Avenue {}'.format(street + 1), (x0, y0), (x0, y0 + self.block)
+
+    @staticmethod
+    def line(start, end, shift=0.0, multi=False):
+        line = '({} {}, {} {})'.format(
+            start[0] + shift, start[1] + shift, end[0] + shift, end[1] + shift)
+        return 'SRID=3857;MULTILINESTRING({})'.format(line) if multi else 'SRID=3857;LINESTRING' + line
+
+    @staticmethod
+    def ewkt(point):
+        return 'SRID=3857;POINT({} {})'.format(*point)
+
+    def point(self, start, end, dist, side, offset=8.0):
+        """
+        Returns the point ``dist`` meters along a block, ``offset`` meters away
+        on its left (``side`` 1) or on its right (``side`` -1)
+        """
+        dx, dy = ((end[0] - start[0]) / self.block, (end[1] - start[1]) / self.block)
+        return (start[0] + dx * dist - dy * side * offset,
+                start[1] + dy * dist + dx * side * offset)
+
+    def side_line(self, start, end, side, margin=5.0):
+        """
+        Returns the curb along a side of a block, ``margin`` meters away from the intersections
+        """
+        first = self.point(start, end, margin, side)
+        last = self.point(start, end, self.block - margin, side)
+        return 'SRID=3857;MULTILINESTRING(({} {}, {} {}))'.format(
+            first[0], first[1], last[0], last[1])
+
+    @staticmethod
+    def cardinal(start, end, side):
+        """
+        Returns the cardinal point of a side of a block (streets go east, avenues go north)
+        """
+        if start[1] == end[1]:
+            return 'N' if side == 1 else 'S'
+        return 'W' if side == 1 else 'E'
+
+    def area(self, margin=50.0):
+        """
+        Returns a multipolygon covering the whole city
+        """
+        x0, y0 = ORIGIN[0] - margin, ORIGIN[1] - margin
+        x1 = ORIGIN[0] + (self.size - 1) * self.block + margin
+        y1 = ORIGIN[1] + (self.size - 1) * self.block + margin
+        return 'SRID=3857;MULTIPOLYGON((({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1})))'.format(
+            x0, y0, x1, y1)
+
+    def osm_lines(self):
+        """
+        Yields the OSM ways of the city, one per street or avenue crossing the whole grid
+        """
+        length = (self.size - 1) * self.block
+        for street in range(self.size):
+            y0 = ORIGIN[1] + street * self.block
+            yield [2 * street + 1, 'Rue {}'.format(street + 1), 'residential',
+                   self.line((ORIGIN[0], y0), (ORIGIN[0] + length, y0))]
+            x0 = ORIGIN[0] + street * self.block
+            yield [2 * street + 2, 'Avenue {}'.format(street + 1), 'residential',
+                   self.line((x0, ORIGIN[1]), (x0, ORIGIN[1] + length))]
+
+    def roads(self):
+        for idx, name, start, end in self.blocks():
+            yield [idx, name, self.line(start, end)]
+
+    def geobase(self):
+        # the geobase is slightly off the roads, like real data
+        for idx, name, start, end in self.blocks():
+            yield [1000000 + idx, name, self.line(start, end, shift=0.5)]
+
+    def _spots(self, rand):
+        """
+        Yields the (block id, street name, start, end, side, distance) of each signpost
+        along the sides of the blocks
+        """
+        for idx, name, start, end in self.blocks():
+            for side in (1, -1):
+                dist = self.spacing * rand.uniform(0.5, 1.0)
+                while dist < self.block - 5:
+                    yield idx, name, start, end, side, dist
+                    dist += self.spacing * rand.uniform(0.7, 1.3)
+
+    def _posts(self):
+        """
+        Yields each signpost along the sides of the blocks along with its signs
+        """
+        rand = random.Random(self.seed)
+        post_id = sign_id = 0
+        for idx, _, start, end, side, dist in self._spots(rand):
+            post_id += 1
+            signs = []
+            for position in range(rand.choice([1, 1, 2])):
+                sign_id += 1
+                code, desc = rand.choice(self.rules)
+                signs.append([sign_id, post_id, position + 1,
+                              rand.choice([0, 2, 3]), code, desc])
+            yield [post_id, 'Réel', 1000000 + idx,
+                   self.ewkt(self.point(start, end, dist, side))], signs
+
+    def _city_posts(self, rules):
+        """
+        Yields the signposts of another city, at the same places as the Montréal ones:
+        (block id, street name, start, end, side, distance, [(code, description), ...])
+        """
+        rand = random.Random(self.seed)
+        for idx, name, start, end, side, dist in self._spots(rand):
+            yield idx, name, start, end, side, dist, [
+                rand.choice(rules) for _ in range(rand.choice([1, 1, 2]))]
+
+    def signposts(self):
+        for post, _ in self._posts():
+            yield post
+
+    def signs(self):
+        # same seed, same signposts: signs are generated again rather than kept in memory
+        for _, signs in self._posts():
+            for sign in signs:
+                yield sign
+
+    def load(self, db):
+        """
+        Replace the roads and Montréal sources with the synthetic city,
+        returns the number of signposts
+        """
+        db.query(create_roads)
+        db.query(create_sources)
+        db.copy_from('public', 'roads', ['osm_id', 'name', 'geom'], self.roads())
+        db.copy_from('public', 'montreal_geobase', ['id_trc', 'nom_voie', 'geom'],
+                     self.geobase())
+
+        db.copy_from('public', 'montreal_poteaux',
+                     ['poteau_id_pot', 'description_rep', 'trc_id', 'geom'], self.signposts())
+        db.copy_from('public', 'montreal_descr_panneau',
+                     ['panneau_id_pan', 'poteau_id_pot', 'position_pop', 'fleche_pan',
+                      'code_rpa', 'description_rpa'], self.signs())
+
+        db.create_index('roads', 'geom', index_type='gist')
+        db.create_index('montreal_geobase', 'geom', index_type='gist')
+        db.create_index('montreal_poteaux', 'trc_id')
+        db.create_index('montreal_descr_panneau', 'poteau_id_pot')
+        for table in ['roads', 'montreal_geobase', 'montreal_poteaux', 'montreal_descr_panneau']:
+            db.vacuum_analyze('public', table)
+
+        total = db.query("SELECT count(*) FROM montreal_poteaux")[0][0]
+        Logger.info("Synthetic city: {} blocks, {} signposts".format(
+            2 * self.size * (self.size - 1), total))
+        return total
+
+    def quebec_sources(self, rules):
+        """
+        Signs of Québec, and parking meters every 6 meters along one block out of five
+        """
+        signs, meters = [], []
+        for post_id, (idx, name, start, end, side, dist, codes) in enumerate(
+                self._city_posts(rules), start=1):
+            for code, desc in codes:
+                signs.append([len(signs) + 1, code, desc, name, str(post_id), idx,
+                              'G' if side == 1 else 'D',
+                              self.ewkt(self.point(start, end, dist, side))])
+        for idx, name, start, end in self.blocks():
+            dist = 10.0
+            while not idx % 5 and dist < self.block - 10:
+                meters.append([len(meters) + 1, str(10000 + len(meters)), name,
+                               self.ewkt(self.point(start, end, dist, -1))])
+                dist += 6.0
+        return [
+            ('quebec_panneau', ['id', 'type_code', 'type_desc', 'nom_topog', 'lect_met',
+                                'id_voie_pu', 'cote_rue', 'geom'], signs),
+            ('quebec_bornes', ['id', 'no_borne', 'nom_topog', 'geom'], meters),
+        ]
+
+    def newyork_sources(self, rules):
+        """
+        Signs of New York, all in Manhattan, each side of a block being a sign order
+        """
+        codes = {name: 10000 + pos
+                 for pos, name in enumerate(sorted(set(x[1] for x in self.blocks())), start=1)}
+        geobase = [[idx, '1', str(codes[name]), str(codes[name] * 100 + 1),
+                    self.line(start, end, shift=0.5, multi=True)]
+                   for idx, name, start, end in self.blocks()]
+        snd = [[1, name, code, code * 100 + 1] for name, code in sorted(codes.items())]
+        locations = [['M', '{}{}'.format(idx, self.cardinal(start, end, side)), name, '', '',
+                      self.cardinal(start, end, side)]
+                     for idx, name, start, end in self.blocks() for side in (1, -1)]
+        signs = []
+        for idx, name, start, end, side, dist, rules in self._city_posts(rules):
+            point = self.point(start, end, dist, side)
+            for position, (code, _) in enumerate(rules, start=1):
+                signs.append([len(signs) + 1, 'M', '{}{}'.format(idx, self.cardinal(start, end, side)),
+                              position, code, [None, 'N', 'S', 'E', 'W'][len(signs) % 5],
+                              int(round(dist)), point[0], point[1], self.ewkt(point)])
+        return [
+            ('newyork_geobase', ['physicalid', 'boroughcod', 'b5_sc', 'b7_sc', 'geom'], geobase),
+            ('newyork_snd', ['boro', 'stname_lab', 'b5sc', 'b7sc'], snd),
+            ('newyork_roads_locations', ['boro', 'order_no', 'main_st', 'from_st', 'to_st', 'sos'],
+                locations),
+            ('newyork_signs_raw', ['objectid', 'sg_key_bor', 'sg_order_n', 'sg_seqno_n',
+                                   'sg_mutcd_c', 'sg_arrow_d', 'sr_dist', 'x', 'y', 'geom'], signs),
+            ('metered_rate_zones', ['city', 'hourly_rat', 'geom'], [['newyork', 3.5, self.area()]]),
+        ]
+
+    def seattle_sources(self, rules):
+        """
+        Block faces of Seattle with a restriction each (see ``SEATTLE_CATEGORIES``),
+        curb lines along the blocks of even id and signs matching their block face
+        """
+        rand = random.Random(self.seed)
+        geobase, parklines, curblines, faces = [], [], [], {}
+        for idx, name, start, end in self.blocks():
+            geobase.append([idx, name.upper(), self.line(start, end, shift=0.5)])
+            for side in (1, -1):
+                category, spacetype, _, _ = faces[idx, side] = rand.choice(SEATTLE_CATEGORIES)
+                paid = [rand.choice([420, 480, 540]), 1080, rand.choice([1.0, 2.5]),
+                        rand.choice([None, 480]), 1080, 1.0, rand.choice([None, 120, 240])]
+                if category != 'Paid Parking':
+                    paid = [None] * len(paid)
+                elif paid[3] is None:
+                    paid[4] = paid[5] = None
+                cardinal = self.cardinal(start, end, side)
+                parklines.append([len(parklines) + 1, idx, cardinal, category] + paid +
+                                 [0, None, None, self.side_line(start, end, side)])
+                if not idx % 2:
+                    curblines.append([len(curblines) + 1, cardinal, spacetype, 'INSVC',
+                                      self.side_line(start, end, side, margin=10.0)])
+        signs, codes = [], {}
+        for idx, _, start, end, side, dist, rules in self._city_posts(rules):
+            _, _, category, signtype = faces[idx, side]
+            if category is None:
+                continue
+            unitid = 'SGN{}'.format(len(signs) + 1)
+            arrow = ['', ' [L ARROW]', ' [R ARROW]'][len(signs) % 3] if category == 'PNP' else ''
+            signs.append([unitid, idx, category, signtype, rules[0][1] + arrow, '',
+                          round(dist), self.ewkt(self.point(start, end, dist, side))])
+            codes.setdefault(rules[0][0], []).append(unitid)
+        return [
+            ('seattle_geobase', ['compkey', 'ord_stname', 'geom'], geobase),
+            ('seattle_parklines', ['elmntkey', 'segkey', 'side', 'parking_category',
+                                   'wkd_start1', 'wkd_end1', 'wkd_rate1', 'sat_start1', 'sat_end1',
+                                   'sat_rate1', 'parking_time_limit', 'rpz_spaces', 'rpz_zone',
+                                   'peak_hour', 'geom'], parklines),
+            ('seattle_curblines', ['objectid', 'side', 'spacetype', 'current_status', 'geom'],
+                curblines),
+            ('seattle_signs_raw', ['unitid', 'segkey', 'category', 'signtype', 'customtext',
+                                   'fieldnotes', 'distance', 'geom'], signs),
+            ('seattle_sign_codes', ['code', 'signs'],
+                [[code, array_literal(ids)] for code, ids in sorted(codes.items())]),
+        ]
+
+    def boston_sources(self, rules):
+        """
+        Roads of Boston swept block by block between two avenues, with an address
+        on each side of the blocks and a parking meter on one block out of four.
+        The last street is in Cambridge, swept as a whole.
+        """
+        sweeps = sorted(int(code.split('-')[-1]) for code, _ in rules
+                        if re.match(r'^BOS-SSWP-\d+$', code))
+        cambridge = 'Rue {}'.format(self.size)
+        geobase, metro, meters, addresses, cambridge_addresses, schedule = [], [], [], [], [], []
+        streets = {}
+        for idx, name, start, end in self.blocks():
+            numbers = [(1, 2 * idx), (-1, 2 * idx + 1)]
+            if name == cambridge:
+                metro.append([2000000 + idx, name.upper(), 'CAMBRIDGE',
+                              self.line(start, end, multi=True)])
+                cambridge_addresses.extend(
+                    [str(number), name, self.ewkt(self.point(start, end, self.block / 2, side))]
+                    for side, number in numbers)
+                continue
+            streets.setdefault(name, len(streets) + 1)
+            geobase.append([idx, streets[name], name.upper(), None, 1,
+                            self.line(start, end, multi=True)])
+            body, suffix = name.upper().split(' ')
+            addresses.extend(
+                [str(number), body, suffix, self.ewkt(self.point(start, end, self.block / 2, side))]
+                for side, number in numbers)
+            if not idx % 4:
+                meters.append(['boston', idx, self.ewkt(self.point(start, end, self.block / 3, 1))])
+            if name.startswith('Rue') and sweeps:
+                # streets go east: the block starting at avenue n ends at avenue n + 1
+                avenue = int(round((start[0] - ORIGIN[0]) / self.block)) + 1
+                sweep = sweeps.pop(0)
+                schedule.append([sweep, name.upper(), 'AVENUE {}'.format(avenue),
+                                 'AVENUE {}'.format(avenue + 1), [None, 'Even', 'Odd'][sweep % 3]])
+        return [
+            ('boston_geobase', ['roadsegmen', 'streetlist', 'streetname', 'streetna_1',
+                                'facilityty', 'geom'], geobase),
+            ('boston_metro_geobase', ['roadsegmen', 'streetname', 'mgis_town', 'geom'], metro),
+            ('meters_boston', ['city', 'roadsegmen', 'geom'], meters),
+            ('boston_address', ['street_number_sort', 'street_body', 'street_full_suffix', 'geom'],
+                addresses),
+            ('cambridge_address', ['stnm', 'stname', 'geom'], cambridge_addresses),
+            ('cambridge_sweep_zones', ['district', 'type', 'geom'],
+                [['A1', 'RD-PAVED', self.area()]]),
+            ('boston_sweep_sched', ['id', 'street', 'from_st', 'to_st', 'side'], schedule),
+        ]
+
+    def load_sources(self, db, city):
+        """
+        Replace the sources of another city than Montréal with the synthetic city,
+        its signs being drawn from the rules of the city
+        """
+        db.query(create_city_sources[city])
+        for table, columns, rows in getattr(self, city + '_sources')(city_rules(city)):
+            db.copy_from('public', table, columns, rows)
+            if 'geom' in columns:
+                db.create_index(table, 'geom', index_type='gist')
+            db.vacuum_analyze('public', table)
+
+    def load_osm(self, db):
+        """
+        Replace the OSM lines with the streets of the synthetic city
+        """
+        db.query(create_osm_lines)
+        db.copy_from('public', 'planet_osm_line', ['osm_id', 'name', 'highway', 'way'],
+                     self.osm_lines())
+        db.create_index('planet_osm_line', 'way', index_type='gist')
+        db.vacuum_analyze('public', 'planet_osm_line')
+
+
+def montreal_rules():
+    """
+    Returns the (code, description) of the Montréal rules the synthetic signs are drawn from
+    """
+    return rule_codes(os.path.join(os.path.dirname(__file__), 'data', 'rules_montreal.csv'))
+
+
+def city_rules(city):
+    """
+    Returns the (code, description) of the rules of ``city`` the synthetic signs are drawn from
+    """
+    if city == 'montreal':
+        return montreal_rules()
+    return rule_codes(os.path.join(os.path.dirname(__file__), 'data', 'rules_{}.csv'.format(city)),
+                      montreal=False)
+
+
+def setup(db):
+    """
+    Create the extensions, functions and common tables used by the slot stages
+    """
+    db.query("create extension if not exists fuzzystrmatch")
+    db.query("create extension if not exists intarray")
+    db.query(plfunctions.st_isleft_func)
+    db.query(plfunctions.array_sort)
+    db.query(plfunctions.get_max_range)
+    db.query(common.create_slots)
+
+
+def load_fixture(db, signposts=FIXTURE_SIGNPOSTS, seed=0):
+    """
+    Load the synthetic city the plans baseline is made on in the sources of every city
+    and run all the stages of the pipeline over it, so that the tables read by
+    the statements of every module exist and are filled.
+    """
+    from . import pipeline
+
+    city = SyntheticCity(signposts, montreal_rules(), seed=seed)
+    city.load(db)
+    city.load_osm(db)
+    for x in pipeline.CITIES:
+        if x != 'montreal':
+            city.load_sources(db, x)
+
+    setup(db)
+    # tables of the statements run by the pipeline itself
+    db.query("create extension if not exists pg_stat_statements")
+    RunState().setup(db)
+    InputFingerprints().setup(db)
+
+    pipeline.process_osm(db)
+    pipeline.process_parking_lots(db)
+    pipeline.load_rules(db, pipeline.CITIES, debug=True)
+    for x in pipeline.CITIES:
+        pipeline.process_city(db, x, debug=True)
+        pipeline.shorten_slots(db, x)
+        pipeline.aggregate_slots(db, x)
+    pipeline.create_permits(db, pipeline.CITIES)
+    pipeline.build_availability(db)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import datetime
+import glob
+import json
+import os
+
+import pytest
+
+from ..agenda import QUARTERS, Agenda, DayMask, day_of_year
+from ..availability import rule_agenda
+from ..filters import group_rules
+from ..pipeline import read_rules
+
+
+def test_json_round_trip():
+    agenda = {1: [[12, 24], [0, 8]], 2: [[0, 24]], 3: [], 4: [[8.25, 9.5]], 5: [], 6: [], 7: []}
+    res = Agenda.from_json(agenda)
+    assert res.to_json() == {1: [[0.0, 8.0], [12.0, 24.0]], 2: [[0.0, 24.0]], 3: [],
+                             4: [[8.25, 9.5]], 5: [], 6: [], 7: []}
+    assert Agenda.from_json(res.to_json()) == res
+    # as stored in the rules table
+    assert Agenda.from_json(json.loads(json.dumps(agenda))) == res
+    assert res.hours() == 20 + 24 + 1.25
+
+
+def test_merge_and_wrap():
+    res = Agenda.from_json({1: [[8, 10], [9, 12], [12, 13]], 8: [[0, 2]]})
+    assert res.periods(1) == [[0.0, 2.0], [8.0, 13.0]]
+
+
+def test_operations():
+    weekdays = Agenda.from_periods((day, 8, 18) for day in range(1, 6))
+    mornings = Agenda.from_periods((day, 7, 9) for day in range(1, 8))
+    assert (weekdays & mornings).periods(1) == [[8.0, 9.0]]
+    assert (weekdays & mornings).periods(6) == []
+    assert (weekdays | mornings).periods(1) == [[7.0, 18.0]]
+    assert (weekdays - mornings).periods(2) == [[9.0, 18.0]]
+    assert (~weekdays).periods(3) == [[0.0, 8.0], [18.0, 24.0]]
+    assert (~weekdays).periods(7) == [[0.0, 24.0]]
+    assert weekdays.overlaps(mornings)
+    assert not weekdays.overlaps(weekdays - mornings & mornings)
+    assert weekdays.covers(weekdays & mornings)
+    assert not weekdays.covers(mornings)
+    assert Agenda.union_all([weekdays, mornings]) == weekdays | mornings
+    assert not Agenda()
+    assert len(set([weekdays, Agenda(weekdays.bits), mornings])) == 2
+
+
+def test_invalid_hours():
+    with pytest.raises(ValueError):
+        Agenda.from_json({1: [[8.1, 9]]})
+    with pytest.raises(ValueError):
+        Agenda.from_json({1: [[9, 8]]})
+    with pytest.raises(ValueError):
+        Agenda.from_json({1: [[0, 25]]})
+
+
+def test_bitstring():
+    agenda = Agenda.from_json({1: [[0, 0.25]], 7: [[23.75, 24]]})
+    value = agenda.bitstring()
+    assert len(value) == 672
+    assert value == '1' + '0' * 670 + '1'
+    assert Agenda.from_bitstring(value) == agenda
+    assert Agenda.from_bitstring(Agenda().bitstring()) == Agenda()
+
+
+def test_day_mask():
+    assert day_of_year(1, 1) == 0
+    assert day_of_year(2, 29) == 59
+    assert day_of_year(12, 31) == 365
+
+    summer = DayMask.from_periods([['05-01', '11-01']])
+    assert summer.applies(datetime.date(2015, 5, 1))
+    assert summer.applies(datetime.date(2016, 11, 1))
+    assert not summer.applies(datetime.date(2016, 11, 2))
+    assert not summer.applies(datetime.date(2016, 4, 30))
+    assert bin(summer.bits).count('1') == 185
+
+    # over the new year, and as written in the rules files
+    winter = DayMask.from_string('12-01,03-15;5-15,5-16')
+    assert winter.applies(datetime.date(2015, 12, 31))
+    assert winter.applies(datetime.date(2016, 1, 1))
+    assert winter.applies(datetime.date(2016, 5, 16))
+    assert not winter.applies(datetime.date(2016, 3, 16))
+
+    assert DayMask.from_string('') == DayMask.from_periods([[]]) == DayMask()
+    assert DayMask().applies(datetime.date(2016, 2, 29))
+    assert DayMask.from_bitstring(winter.bitstring()) == winter
+    assert winter.bitstring()[day_of_year(12, 1)] == '1'
+
+
+def covered(agenda):
+    """
+    Returns the (day, quarter) covered by a JSON agenda, one quarter hour at a time
+    """
+    res = set()
+    for day, hours in agenda.items():
+        # day 8 is the next Monday
+        day = (int(day) - 1) % 7 + 1
+        for start, end in hours:
+            for quarter in range(QUARTERS):
+                hour = quarter / 4.0
+                if start <= hour < end:
+                    res.add((day, quarter))
+                elif end < start and hour >= start:
+                    res.add((day, quarter))
+                elif end < start and hour < end:
+                    res.add((day % 7 + 1, quarter))
+    return res
+
+
+def test_rules_agendas():
+    # the JSON of the rules is not kept as is, but the quarter hours it covers are
+    files = [x for x in glob.glob(os.path.join(os.path.dirname(__file__), '..', 'data', 'rules_*.csv'))
+             if not x.endswith('_glue.csv')]
+    assert len(files) == 5
+    for filename in files:
+        for rule in group_rules(read_rules(filename)):
+            agenda = rule_agenda(rule.agenda)
+            assert Agenda.from_json(agenda.to_json()) == agenda
+            assert covered(agenda.to_json()) == covered(rule.agenda), rule.code
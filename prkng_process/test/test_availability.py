@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from ..agenda import Agenda, DayMask
+from ..availability import bucket, compile_rule, rule_agenda, rule_kinds
+
+
+def test_rule_kinds():
+    assert rule_kinds({'restrict_types': ['permit', 'paid']}) == ['paid', 'permit']
+    assert rule_kinds({'restrict_types': [], 'time_max_parking': 60.0}) == ['time_max']
+    assert rule_kinds({'restrict_types': None, 'time_max_parking': 0.0}) == ['forbidden']
+
+
+def test_rule_agenda():
+    # overnight periods continue on the next day, Sunday night on Monday
+    res = rule_agenda({'1': [[22, 6]], '7': [[23, 1]]})
+    assert res.periods(1) == [[0.0, 1.0], [22.0, 24.0]]
+    assert res.periods(2) == [[0.0, 6.0]]
+    assert res.periods(7) == [[23.0, 24.0]]
+    # rounded outwards to quarter hours
+    assert rule_agenda({'3': [[8.1, 9.9]]}).periods(3) == [[8.0, 10.0]]
+
+
+def test_compile_rule():
+    rule = {
+        'code': 'PX-1',
+        'agenda': {'1': [[8.0, 9.0]], '2': [], '3': [], '4': [], '5': [], '6': [], '7': []},
+        'periods': [['12-01', '03-15']],
+        'time_max_parking': 120.0,
+        'restrict_types': ['paid'],
+    }
+    (row,) = compile_rule(7, rule)
+    assert row[:3] == [7, 'paid', 120.0]
+    assert DayMask.from_bitstring(row[3]) == DayMask.from_periods([['12-01', '03-15']])
+    assert Agenda.from_bitstring(row[4]) == Agenda.from_periods([(1, 8, 9)])
+
+    # monday 8:45, the last quarter hour of the rule, then 9:00
+    assert row[4][bucket(datetime.datetime(2016, 1, 4, 8, 45))] == '1'
+    assert row[4][bucket(datetime.datetime(2016, 1, 4, 9, 0))] == '0'
+
+    assert compile_rule(8, dict(rule, agenda={'1': []})) == []
+    # rules without periods apply all year
+    assert compile_rule(9, dict(rule, periods=[]))[0][3] == '1' * 366
+
+
+def test_bucket():
+    assert bucket(datetime.datetime(2016, 1, 4, 0, 0)) == 0
+    assert bucket(datetime.datetime(2016, 1, 5, 0, 14)) == 96
+    assert bucket(datetime.datetime(2016, 1, 10, 23, 59)) == 671
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from ..benchmark import scaling
+
+
+def test_scaling():
+    results = [
+        {'signposts': 10000, 'stages': {'process': 10.0, 'aggregate': 4.0}},
+        {'signposts': 1000, 'stages': {'process': 1.0, 'aggregate': 0.04}},
+        {'signposts': 100000, 'stages': {'process': 100.0}},
+    ]
+    res = scaling(results, 'stages')
+    assert res['process']['times'] == [1.0, 10.0, 100.0]
+    assert res['process']['exponents'] == [pytest.approx(1.0), pytest.approx(1.0)]
+    assert not res['process']['superlinear']
+    assert res['aggregate']['times'] == [0.04, 4.0, None]
+    assert res['aggregate']['exponents'] == [pytest.approx(2.0), None]
+    assert res['aggregate']['superlinear']
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from ..clustering import chain_like_slots, cluster_meters, line_distance
+
+
+def test_chain_like_slots():
+    slots = [
+        # pieces going along the road
+        (1, 1, 0.1, 0, 0, 10, 0),
+        (2, 1, 0.2, 10, 0, 20, 0),
+        (3, 1, 0.3, 20, 0, 30, 0),
+        # pieces going against the road (other side)
+        (4, 1, 0.1, 10, 12, 0, 12),
+        (5, 1, 0.2, 20, 12, 10, 12),
+        # alone
+        (6, 1, 0.5, 50, 0, 60, 0),
+    ]
+    res = chain_like_slots(slots, [(1, 2), (2, 3), (4, 5)], 0.1)
+    assert sorted(res) == [
+        (1, 1, 1, 1), (2, 1, 2, 2), (3, 1, 3, 3),
+        (4, 4, 2, 1), (5, 4, 1, 2),
+        (6, 6, 1, 1)
+    ]
+
+
+def test_chain_like_slots_as_loop():
+    """
+    Expected clusters are those of the former aggregate_like_slots loop
+    on the same slots (taken by rid then position)
+    """
+    slots = [
+        # second road, taken after the first one
+        (10, 2, 0.1, 200, 0, 210, 0),
+        # 11 is prepended to the line of 12, its signposts come second
+        (11, 1, 0.3, 0, 20, 10, 20),
+        (12, 1, 0.2, 10, 20, 20, 20),
+        # 15 is adjacent to 13 and 14, it only joins 13 and 14 stays apart
+        (13, 1, 0.1, 100, 0, 110, 0),
+        (14, 1, 0.2, 120, 0, 130, 0),
+        (15, 1, 0.3, 110, 0, 120, 0),
+        # next to 10 on the second road
+        (16, 2, 0.2, 210, 0, 220, 0),
+    ]
+    pairs = [(11, 12), (13, 15), (14, 15), (10, 16)]
+    res = chain_like_slots(slots, pairs, 0.1)
+    assert sorted(res) == [
+        (10, 10, 1, 1), (11, 12, 1, 2), (12, 12, 2, 1),
+        (13, 13, 1, 1), (14, 14, 1, 1), (15, 13, 2, 2),
+        (16, 10, 2, 2),
+    ]
+
+    # signposts in merge order, geometry in line order
+    cluster = sorted((x for x in res if x[1] == 12), key=lambda x: x[3])
+    assert [x[0] for x in cluster] == [12, 11]
+    assert [x[0] for x in sorted(cluster, key=lambda x: x[2])] == [11, 12]
+
+
+def test_line_distance():
+    assert line_distance((3, 4), [(0, 0)]) == 5
+    assert line_distance((5, 3), [(0, 0), (10, 0), (10, 10)]) == 3
+    assert line_distance((12, 5), [(0, 0), (10, 0), (10, 10)]) == 2
+
+
+def test_cluster_meters_as_loop():
+    """
+    Expected clusters are those of the former aggregate_paid_signposts loop
+    on the same meters (taken by road then position), measuring the distance
+    of each meter to the line of the clusters, not to the previous meter
+    """
+    meters = [
+        (1, 1, 1, 0.1, 0, 0),
+        (2, 1, 1, 0.2, 9, 0),
+        # 10.3 m from the previous meter, 9 m from the line of the cluster
+        (3, 1, 1, 0.3, 4, 9),
+        # 18 m from the cluster
+        (4, 1, 1, 0.4, 27, 0),
+        # 9 m from both clusters, joins the first one
+        (5, 1, 1, 0.5, 18, 0),
+        # other side of the road, or another road
+        (6, 1, -1, 0.15, 5, -8),
+        (7, 2, 1, 0.1, 6, -1),
+        # taken by position
+        (8, 1, 1, 0.7, 48, 0),
+        (9, 1, 1, 0.6, 40, 0),
+    ]
+    res = cluster_meters(meters, 10)
+    assert sorted(res) == [
+        (1, 1, 1), (2, 1, 2), (3, 1, 3),
+        (4, 4, 1),
+        (5, 1, 4),
+        (6, 6, 1),
+        (7, 7, 1),
+        (8, 9, 2), (9, 9, 1),
+    ]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import struct
+
+from ..copyio import (BINARY_HEADER, BINARY_TRAILER, BinaryCopyReader, TextCopyReader,
+                      array_literal)
+
+
+def test_text_escaping():
+    reader = TextCopyReader([
+        [1, None, u'caf\xe9\tbar', 'a\\b\nc', {'1': [[8, 9.5]]}, True, 0.5],
+    ])
+    assert reader.read() == (
+        '1\t\\N\tcaf\xc3\xa9\\tbar\ta\\\\b\\nc\t{"1": [[8, 9.5]]}\tt\t0.5\n')
+
+
+def test_streaming():
+    consumed = []
+
+    def rows():
+        for x in range(1000):
+            consumed.append(x)
+            yield [x, 'row']
+
+    reader = TextCopyReader(rows())
+    first = reader.read(16)
+    assert first == '0\trow\n1\trow\n2\tro'
+    assert len(consumed) < 10
+
+    rest = ''
+    while True:
+        chunk = reader.read(8192)
+        if not chunk:
+            break
+        assert len(chunk) <= 8192
+        rest += chunk
+    assert len(consumed) == 1000
+    assert (first + rest).count('\n') == 1000
+
+
+def test_binary_row():
+    wkb = '\x01\x01\x00\x00\x00' + struct.pack('<dd', 1.0, 2.0)
+    reader = BinaryCopyReader(
+        [[7, u'\xe9', None, {'a': 1}, wkb, [[1, 2], [3, None]]]],
+        ['int4', 'varchar', 'float8', 'jsonb', 'geometry', 'int4[]'])
+    data = reader.read()
+
+    array = (struct.pack('>iii', 2, 1, 23) + struct.pack('>iiii', 2, 1, 2, 1) +
+             struct.pack('>i', 4) + struct.pack('>i', 1) +
+             struct.pack('>i', 4) + struct.pack('>i', 2) +
+             struct.pack('>i', 4) + struct.pack('>i', 3) +
+             struct.pack('>i', -1))
+    assert data == (
+        BINARY_HEADER +
+        struct.pack('>h', 6) +
+        struct.pack('>ii', 4, 7) +
+        struct.pack('>i', 2) + '\xc3\xa9' +
+        struct.pack('>i', -1) +
+        struct.pack('>i', 9) + '\x01{"a": 1}' +
+        struct.pack('>i', len(wkb)) + wkb +
+        struct.pack('>i', len(array)) + array +
+        BINARY_TRAILER)
+
+
+def test_binary_numbers():
+    data = BinaryCopyReader([[2.0, 3]], ['int4', 'float8']).read()
+    assert data[len(BINARY_HEADER) + 2:-2] == struct.pack('>iii', 4, 2, 8) + struct.pack('>d', 3.0)
+
+
+def test_binary_empty_array():
+    data = BinaryCopyReader([[[]]], ['text[]']).read()
+    assert data[len(BINARY_HEADER) + 2:-2] == struct.pack('>i', 12) + struct.pack('>iii', 0, 0, 25)
+
+
+def test_array_literal():
+    assert array_literal([]) == '{}'
+    assert array_literal(['paid', None, 12]) == '{"paid",NULL,"12"}'
+    assert array_literal(['a"b\\c']) == '{"a\\"b\\\\c"}'
+    reader = TextCopyReader([[array_literal(['a\\b'])]])
+    assert reader.read() == '{"a\\\\\\\\b"}\n'
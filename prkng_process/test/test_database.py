@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from ..database import ConnectionPool, PostgresWrapper, Row, get_pool
+from ..filters import group_rules
+from ..profiling import QueryProfiler
+
+
+def test_row():
+    index = {'code': 0, 'periods': 1}
+    row = Row(('A', None), index)
+    assert row.code == 'A'
+    assert row[0] == 'A'
+    assert row.periods is None
+    assert list(row) == ['A', None]
+    assert len(row) == 2
+    assert row == ('A', None)
+    assert list(row._asdict().items()) == [('code', 'A'), ('periods', None)]
+    with pytest.raises(AttributeError):
+        row.missing
+    code, periods = row
+    assert code == 'A'
+
+
+def test_rows_with_group_rules():
+    columns = ['code', 'description', 'periods', 'time_max_parking', 'time_start', 'time_end',
+               'time_duration', 'lun', 'mar', 'mer', 'jeu', 'ven', 'sam', 'dim', 'daily',
+               'special_days', 'restrict_types', 'permit_no']
+    index = {name: pos for pos, name in enumerate(columns)}
+    rows = (Row(x, index) for x in [
+        ('A', 'desc', None, None, 8, 10, None, 1, 0, 0, 0, 0, 0, 0, None, None, None, None),
+        ('A', 'desc', None, None, 12, 14, None, 1, 0, 0, 0, 0, 0, 0, None, None, None, None),
+    ])
+    res = group_rules(rows)
+    assert len(res) == 1
+    assert res[0].agenda[1] == [[8, 10], [12, 14]]
+
+
+def test_pool_is_lazy_and_reuses_connections():
+    pool = ConnectionPool("dbname=none")
+    first = pool.get()
+    assert first._connection is None
+    pool.put(first)
+    assert pool.get() is first
+    assert pool.get() is not first
+
+    assert pool.thread_connection() is pool.thread_connection()
+    assert get_pool("dbname=none") is get_pool("dbname=none")
+
+
+def test_pool_is_capped():
+    pool = ConnectionPool("dbname=none", maxconn=2)
+    first, second = pool.get(), pool.get()
+    taken = []
+    waiting = threading.Thread(target=lambda: taken.append(pool.get()))
+    waiting.start()
+    waiting.join(0.1)
+    assert not taken
+    pool.put(second)
+    waiting.join(1)
+    assert taken == [second]
+    assert len(pool.opened) == 2
+
+    first._connection = FakeConnection()
+    pool.closeall()
+    assert first._connection is None
+
+
+class FakeConnection(object):
+    closed = False
+    rowcount = -1
+
+    def __init__(self):
+        self.copied, self.commits, self.rollbacks = [], 0, 0
+
+    def cursor(self):
+        return self
+
+    def copy_expert(self, stmt, reader):
+        self.copied.append((stmt, reader.read()))
+        self.rowcount = self.copied[-1][1].count('\n')
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_copies_in_one_transaction():
+    db = PostgresWrapper("dbname=none")
+    db._connection = FakeConnection()
+    with db.transaction():
+        db.copy_from('public', 'rules', ['code'], [['A']], commit=False)
+        db.copy_from('public', 'signs', ['code'], [['A']], commit=False)
+    assert len(db._connection.copied) == 2
+    assert db._connection.commits == 1
+
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.copy_from('public', 'rules', ['code'], [['B']], commit=False)
+            raise ValueError
+    assert db._connection.commits == 1
+    assert db._connection.rollbacks == 1
+
+
+def test_copies_are_profiled():
+    db = PostgresWrapper("dbname=none")
+    db._connection = FakeConnection()
+    db.profiler = QueryProfiler()
+    db.copy_from('public', 'rules', ['code'], [['A'], ['B']])
+    assert [(x['statement'], x['rows']) for x in db.profiler.queries] == [
+        ('COPY public.rules (code) FROM STDIN', 2)]
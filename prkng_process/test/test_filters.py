@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import os
 from collections import namedtuple
 
 import pytest
@@ -175,3 +176,84 @@ def test_grouping_rules_alltime(rules):
                     3: [[0, 24]], 4: [[0, 24]],
                     5: [[0, 24]], 6: [[0, 24]],
                     7: [[0, 24]]}
+
+
+def test_grouping_rules_unsorted():
+    rule = namedtuple('rule', (
+        'code', 'description', 'periods', 'time_max_parking',
+        'time_start', 'time_end', 'time_duration',
+        'lun', 'mar', 'mer', 'jeu', 'ven', 'sam', 'dim', 'daily',
+        'special_days', 'restrict_types', 'permit_no'
+    ))
+    rules = [
+        rule('A', 'a', None, None, 8.0, 12.0, 4.0, 1, None, None, None, None, None, None, None,
+             None, None, None),
+        rule('B', 'b', '03-01,11-30', None, None, None, None, None, None, None, None, None, None,
+             None, 1.0, None, 'permit', 'A3-3'),
+        rule('A', 'a', None, None, 13.0, 17.0, 4.0, None, 1, None, None, None, None, None, None,
+             None, None, None),
+    ]
+    res = group_rules(rules)
+
+    assert [x.code for x in res] == ['A', 'B']
+    assert res[0].agenda == {1: [[8.0, 12.0]], 2: [[13.0, 17.0]],
+                             3: [], 4: [], 5: [], 6: [], 7: []}
+    assert res[1].periods == '{{03-01,11-30}}'
+    assert res[1].days == '0' * 60 + '1' * 275 + '0' * 31
+    assert res[0].days == '1' * 366
+    assert res[1].restrict_types == '{permit}'
+    assert group_rules(reversed(rules))[0].agenda == res[0].agenda
+
+
+def test_read_rules_files():
+    from ..pipeline import read_rules
+
+    here = os.path.join(os.path.dirname(__file__), '..', 'data')
+    for city in ('montreal', 'quebec', 'newyork', 'seattle', 'boston'):
+        rows = list(read_rules(os.path.join(here, 'rules_{}.csv'.format(city))))
+        keys = set((x.code, x.periods, x.time_max_parking) for x in rows)
+
+        assert len(group_rules(rows)) == len(keys)
+        assert all(x.lun in (None, 1) for x in rows)
+        assert all(x.time_start is None or isinstance(x.time_start, float) for x in rows)
+
+
+class FakeDB(object):
+    def __init__(self, cached):
+        self.cached = cached
+        self.queries, self.copies = [], []
+
+    def query(self, stmt):
+        self.queries.append(stmt)
+        return [(self.cached,)] if 'EXISTS' in stmt else []
+
+    def copy_from(self, schema, table, columns, values, commit=True):
+        self.copies.append((table, list(values)))
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def vacuum_analyze(self, *args):
+        pass
+
+
+def test_load_rules_cache():
+    from ..pipeline import load_rules
+
+    db = FakeDB(cached=False)
+    load_rules(db, ['quebec'])
+    (table, rows), = db.copies
+    assert table == 'rules_cache'
+    assert len(set(x[2] for x in rows)) > 100
+    assert len(set((x[0], x[1]) for x in rows)) == 1
+    assert any('DELETE FROM rules_cache' in x for x in db.queries)
+    assert any('INSERT INTO rules' in x for x in db.queries)
+
+    db = FakeDB(cached=True)
+    load_rules(db, ['quebec'])
+    assert db.copies == []
+    assert any('INSERT INTO rules' in x for x in db.queries)
+
+    db = FakeDB(cached=True)
+    load_rules(db, ['quebec'], debug=True)
+    assert [x[0] for x in db.copies] == ['quebec_rules_translation']
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from ..fingerprint import InputFingerprints, file_fingerprint, input_fingerprint
+
+
+class FakeDB(object):
+    def __init__(self, stored):
+        self.stored = stored
+
+    def query(self, stmt):
+        return [(self.stored,)] if self.stored is not None else []
+
+
+def test_file_fingerprint(tmpdir):
+    path = tmpdir.join('rules.csv')
+    path.write('code;description\n')
+    first = file_fingerprint(str(path))
+    assert first == file_fingerprint(str(path))
+
+    path.write('code;description\nA;B\n')
+    assert file_fingerprint(str(path)) != first
+    assert file_fingerprint(str(tmpdir.join('missing.csv'))) is None
+
+
+def test_unchanged():
+    value = {'files': {'rules.csv': 'abc'}, 'tables': {'signs': '10:def'}}
+    assert InputFingerprints().unchanged(FakeDB(value), 'city', value)
+    assert not InputFingerprints().unchanged(FakeDB(None), 'city', value)
+
+    changed = {'files': {'rules.csv': 'abc'}, 'tables': {'signs': '11:fed'}}
+    assert not InputFingerprints().unchanged(FakeDB(value), 'city', changed)
+
+    missing = {'files': {'rules.csv': 'abc'}, 'tables': {'signs': None}}
+    assert not InputFingerprints().unchanged(FakeDB(missing), 'city', missing)
+
+
+class CountingDB(object):
+    def __init__(self):
+        self.reads = []
+
+    def query(self, stmt):
+        if 'to_regclass' in stmt:
+            return [(True,)]
+        self.reads.append(stmt)
+        return [(10, 'abc')]
+
+
+def test_input_fingerprint_memo():
+    db, memo = CountingDB(), {}
+    first = input_fingerprint(db, tables=['roads', 'signs_a'], memo=memo)
+    second = input_fingerprint(db, tables=['roads', 'signs_b'], memo=memo)
+    assert len(db.reads) == 3
+    assert first['tables']['roads'] == second['tables']['roads'] == '10:abc'
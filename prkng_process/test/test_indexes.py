@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from ..indexes import IndexManager
+
+
+class FakeDB(object):
+    created = []
+    lock = threading.Lock()
+
+    def create_index(self, table, column, index_type='btree'):
+        if table == 'broken':
+            raise RuntimeError("boom")
+        with self.lock:
+            self.created.append((table, column, index_type))
+
+
+def test_build_once():
+    FakeDB.created = []
+    indexes = IndexManager(FakeDB)
+    indexes.declare('slots', 'id')
+    indexes.declare('slots', 'geom', 'gist')
+    indexes.declare('slots', 'id')
+    indexes.build()
+    indexes.build()
+    assert FakeDB.created == [('slots', 'id', 'btree'), ('slots', 'geom', 'gist')]
+
+
+def test_build_tables_in_parallel():
+    FakeDB.created = []
+    connections = []
+
+    def connect():
+        connections.append(FakeDB())
+        return connections[-1]
+
+    indexes = IndexManager(connect, jobs=3)
+    for x in ['a', 'b', 'c', 'd']:
+        indexes.declare(x, 'id')
+        indexes.declare(x, 'geom', 'gist')
+    indexes.build(['a', 'b', 'c'])
+    assert sorted(FakeDB.created) == sorted(
+        [(x, 'id', 'btree') for x in 'abc'] + [(x, 'geom', 'gist') for x in 'abc'])
+    assert 1 <= len(connections) <= 3
+    assert list(indexes.pending) == ['d']
+
+
+def test_build_failure():
+    indexes = IndexManager(FakeDB, jobs=2)
+    indexes.declare('a', 'id')
+    indexes.declare('broken', 'id')
+    with pytest.raises(RuntimeError):
+        indexes.build()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import threading
+from contextlib import contextmanager
+
+from .. import pipeline
+from ..bench import inputs
+from ..copyio import BinaryCopyReader
+from ..database import ConnectionPool, Row
+
+
+class StageDB(object):
+    """
+    Connection of a stage, answering the lots and the Seattle parking lines queries
+    """
+    def __init__(self):
+        self.copied = []
+
+    def query(self, stmt, namedtuple=None):
+        if 'seattle_parklines' in stmt:
+            return [x[0] for x in inputs.dynamic_rules(3)]
+        # as returned by psycopg2: byte strings, plus the geometry
+        res = []
+        for row in inputs.lots(3):
+            index = dict(row._index, geom=len(row._index))
+            res.append(Row(tuple(x.encode('utf-8') if isinstance(x, unicode) else x
+                                 for x in row._values) + ('0101',), index))
+        return res
+
+    def copy_from(self, schema, table, columns, values, types=None, commit=True):
+        values = list(values)
+        if types:
+            # as sent by copy_from
+            BinaryCopyReader(values, types).read()
+        self.copied.append((table, values, types))
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+
+def test_stages_take_no_nested_connection(monkeypatch):
+    pool = ConnectionPool("dbname=none", maxconn=2)
+    monkeypatch.setattr(pipeline, 'get_pool', lambda *args, **kwargs: pool)
+    # the run and its only worker hold every connection of the pool
+    held = [pipeline.connect(), pipeline.connect()]
+    db, done = StageDB(), []
+
+    def stages():
+        pipeline.insert_parking_lots(db, 'montreal')
+        pipeline.insert_dynamic_rules_seattle(db)
+        done.append(True)
+
+    thread = threading.Thread(target=stages)
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    assert done
+    assert len(pool.opened) == len(held)
+    assert [x[0] for x in db.copied] == ['parking_lots_raw', 'rules', 'seattle_sign_codes']
+    assert len(db.copied[0][1]) == 3
+    assert db.copied[1][1]
+    # lots and rules in binary format, the Seattle signs table is not created by the pipeline
+    assert [bool(x[2]) for x in db.copied] == [True, True, False]
+    assert db.copied[0][1][0][8] == '\x01\x01'
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from .. import common
+from ..plans import check_plans, compare_plans, plan_shape, split_statements, statements
+
+
+def test_split_statements():
+    sql = """
+        DROP TABLE IF EXISTS foo;
+        CREATE TABLE foo AS SELECT ';' AS a;
+        CREATE FUNCTION f() RETURNS int AS $body$ BEGIN RETURN 1; END $body$ LANGUAGE plpgsql;
+    """
+    res = split_statements(sql)
+    assert len(res) == 3
+    assert res[1] == "CREATE TABLE foo AS SELECT ';' AS a"
+    assert res[2].endswith("LANGUAGE plpgsql")
+
+
+def test_statements_per_city():
+    res = statements({'common': (common, ['montreal', 'quebec'])}, {'offset': 6})
+    assert res['common.create_slots_temp[quebec]'] == common.create_slots_temp.format(city='quebec')
+    assert 'common.create_slots' in res
+    assert 'common.create_slots[quebec]' not in res
+
+
+def plan(node, cost, **kwargs):
+    res = {'Node Type': node, 'Total Cost': cost}
+    res.update(kwargs)
+    return res
+
+
+def test_compare_plans():
+    before = plan('Nested Loop', 100.0, **{'Join Type': 'Inner', 'Plans': [
+        plan('Seq Scan', 10.0, **{'Relation Name': 'slots'}),
+        plan('Bitmap Index Scan', 5.0, **{'Index Name': 'signs_signposts_gin_idx'}),
+    ]})
+    after = plan('Nested Loop', 900.0, **{'Join Type': 'Inner', 'Plans': [
+        plan('Seq Scan', 10.0, **{'Relation Name': 'slots'}),
+        plan('Seq Scan', 500.0, **{'Relation Name': 'signs'}),
+    ]})
+    baseline = {
+        'mrl.insert_slots_temp': {'plans': [{'shape': plan_shape(before), 'cost': 100.0}]},
+        'mrl.create_slots_likely': {'plans': [{'shape': plan_shape(before), 'cost': 100.0}]},
+    }
+    current = {
+        'mrl.insert_slots_temp': {'plans': [{'shape': plan_shape(after), 'cost': 900.0}]},
+        'mrl.create_slots_likely': {'error': 'relation "montreal_signs" does not exist'},
+    }
+    assert compare_plans(baseline, current, large_tables=['signs', 'slots']) == [
+        'mrl.create_slots_likely: fails (relation "montreal_signs" does not exist)',
+        'mrl.insert_slots_temp: new sequential scan on signs',
+        'mrl.insert_slots_temp: index signs_signposts_gin_idx no longer used',
+        'mrl.insert_slots_temp: estimated cost went from 100 to 900',
+    ]
+    assert compare_plans(baseline, baseline) == []
+
+
+def test_compare_missing_plans():
+    shape = plan_shape(plan('Seq Scan', 10.0, **{'Relation Name': 'slots'}))
+    baseline = {
+        'qbc.create_sign': {'error': 'relation "quebec_panneau" does not exist'},
+        'qbc.insert_sign': {'plans': [{'shape': shape, 'cost': 10.0}]},
+        'nyc.insert_sign': {'plans': [{'shape': shape, 'cost': 10.0}]},
+    }
+    current = {
+        'qbc.create_sign': {'plans': [{'shape': shape, 'cost': 10.0}]},
+        'qbc.insert_sign': {'plans': [{'shape': shape, 'cost': 10.0}] * 2},
+        'sea.insert_sign': {'plans': [{'shape': shape, 'cost': 10.0}]},
+    }
+    assert compare_plans(baseline, current) == [
+        'sea.insert_sign: no baseline plan',
+        'nyc.insert_sign: no longer explained',
+        'qbc.create_sign: no baseline plan (relation "quebec_panneau" does not exist)',
+        'qbc.insert_sign: 2 statements explained instead of 1',
+    ]
+
+
+def test_check_plans_without_baseline(tmpdir):
+    from click.testing import CliRunner
+    from ..commands import check_plans
+
+    res = CliRunner().invoke(check_plans, ['--baseline', str(tmpdir.join('plans.json'))])
+    assert res.exit_code != 0
+    assert 'No baseline plans' in res.output
+    assert '--update True' in res.output
+
+
+class NoFixtureDB(object):
+    """
+    Connection to a database where none of the tables exist
+    """
+    @property
+    def db(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    def execute(self, stmt):
+        raise Exception('relation "slots" does not exist')
+
+    def rollback(self):
+        pass
+
+
+def test_check_plans_update_without_fixtures(tmpdir):
+    path = tmpdir.join('plans.json')
+    issues = check_plans(NoFixtureDB(), {'common': (common, ['montreal'])}, {}, str(path), update=True)
+    assert issues
+    assert all('does not exist' in x for x in issues)
+    assert not path.check()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import json
+
+from .. import common
+from ..profiling import QueryProfiler, statement_rows
+
+
+def test_statement_names():
+    profiler = QueryProfiler({'common': common})
+    assert profiler.name(common.create_slots_temp.format(city='quebec')) == 'common.create_slots_temp'
+    assert profiler.name(common.create_slots) == 'common.create_slots'
+    assert profiler.name("SELECT  count(*)\n FROM rules") == 'SELECT count(*) FROM rules'
+
+
+def test_explainable():
+    profiler = QueryProfiler(explain=True)
+    assert profiler.explainable("UPDATE slots SET rules = '[]'")
+    assert profiler.explainable("CREATE TABLE foo AS SELECT 1;")
+    assert not profiler.explainable("SELECT 1")
+    assert not profiler.explainable("INSERT INTO foo VALUES (1) RETURNING id")
+    assert not profiler.explainable("DROP TABLE IF EXISTS foo; CREATE TABLE foo AS SELECT 1")
+    assert not QueryProfiler().explainable("UPDATE slots SET rules = '[]'")
+
+
+def test_report(tmpdir):
+    profiler = QueryProfiler({'common': common})
+    with profiler.stage('montreal'):
+        profiler.record(common.create_slots, 0.5, -1)
+        profiler.record(common.create_slots, 1.5, -1)
+    profiler.record("UPDATE rules SET code = 'A'", 3.0, 10, [{'Plan': {
+        'Actual Rows': 12, 'Shared Hit Blocks': 4, 'Temp Written Blocks': 2}}])
+
+    summary = profiler.summary()
+    assert [x['statement'] for x in summary['statements']] == [
+        "UPDATE rules SET code = 'A'", 'common.create_slots']
+    assert summary['statements'][0]['rows'] == 12
+    assert summary['statements'][0]['temp_written'] == 2
+    assert summary['statements'][0]['stages'] == ['setup']
+    assert summary['statements'][1]['calls'] == 2
+    assert summary['statements'][1]['max_time'] == 1.5
+    assert summary['stages'][0]['stage'] == 'montreal'
+
+    path = str(tmpdir.join('profile'))
+    profiler.report(path)
+    with open(path + '.json') as infile:
+        assert json.load(infile)['statements'][1]['statement'] == 'common.create_slots'
+    with open(path + '.html') as infile:
+        assert 'common.create_slots' in infile.read()
+
+
+def test_events_and_slow_queries():
+    profiler = QueryProfiler({'common': common}, cities=['montreal', 'newyork'], slow=1.0)
+    with profiler.stage('shorten_montreal'):
+        profiler.record(common.create_slots, 0.5, -1)
+        profiler.record("UPDATE slots SET rules = '[]'", 2.0, 3, [{'Plan': {
+            'Actual Rows': 3, 'Temp Written Blocks': 2}}])
+    profiler.record(common.create_slots, 1.5, -1)
+
+    assert [x['city'] for x in profiler.queries] == ['montreal', 'montreal', None]
+    assert profiler.queries[0]['temp_bytes'] is None
+    assert profiler.queries[1]['temp_bytes'] == 2 * 8192
+    assert [(x['statement'], x['stage']) for x in profiler.slow_queries()] == [
+        ("UPDATE slots SET rules = '[]'", 'shorten_montreal'),
+        ('common.create_slots', 'setup')]
+
+
+def test_stat_statements_diff():
+    profiler = QueryProfiler({'common': common})
+    before = {
+        (10, 1): {'query': common.create_slots, 'calls': 1, 'time': 1000.0, 'rows': 0,
+                  'temp_bytes': 0},
+        (10, 2): {'query': 'SELECT 1', 'calls': 5, 'time': 10.0, 'rows': 5, 'temp_bytes': 0},
+    }
+    after = {
+        (10, 1): {'query': common.create_slots, 'calls': 3, 'time': 4000.0, 'rows': 0,
+                  'temp_bytes': 8192},
+        (10, 2): {'query': 'SELECT 1', 'calls': 5, 'time': 10.0, 'rows': 5, 'temp_bytes': 0},
+        (10, 3): {'query': 'SELECT $1', 'calls': 2, 'time': 500.0, 'rows': 2, 'temp_bytes': 0},
+    }
+    profiler.diff_snapshots(before, after)
+    assert profiler.stat_statements == [
+        {'statement': 'common.create_slots', 'calls': 2, 'time': 3.0, 'rows': 0,
+         'temp_bytes': 8192},
+        {'statement': 'SELECT $1', 'calls': 2, 'time': 0.5, 'rows': 2, 'temp_bytes': 0},
+    ]
+    assert profiler.summary()['stat_statements'] == profiler.stat_statements
+
+
+def test_explained_rows():
+    # a data modifying statement returns no rows, it counts those it is fed with
+    update = {'Node Type': 'ModifyTable', 'Actual Rows': 0, 'Temp Written Blocks': 1, 'Plans': [
+        {'Node Type': 'Seq Scan', 'Actual Rows': 6, 'Actual Loops': 2}]}
+    assert statement_rows(update) == 12
+    assert statement_rows({'Node Type': 'Seq Scan', 'Actual Rows': 4}) == 4
+
+    profiler = QueryProfiler(explain=True)
+    # the cursor counted the single row of the EXPLAIN output
+    profiler.record("UPDATE slots SET rules = '[]'", 1.0, 1, [{'Plan': update}])
+    profiler.record("COPY public.rules (code) FROM STDIN", 1.0, 7)
+    assert [(x['rows'], x.get('plan_rows')) for x in profiler.queries] == [(12, 0), (7, None)]
+    assert [x['temp_bytes'] for x in profiler.queries] == [8192, None]
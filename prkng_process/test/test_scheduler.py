@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from ..scheduler import Scheduler
+
+
+class FakeDB(object):
+    pass
+
+
+def record(db, log, name, delay=0):
+    time.sleep(delay)
+    log.append(name)
+
+
+def test_dependencies():
+    sched = Scheduler(FakeDB)
+    sched.add('osm', record, ['planet_osm_line'], ['roads'])
+    sched.add('rules_a', record, ['a_rules_translation'], ['rules'])
+    sched.add('rules_b', record, ['b_rules_translation'], ['rules'])
+    sched.add('a', record, ['rules', 'roads'], ['a_slots_temp'])
+    sched.add('b', record, ['rules', 'roads'], ['b_slots_temp'])
+    sched.add('aggregate_a', record, ['a_slots_temp'], ['slots', 'a_slots'])
+
+    deps = sched.dependencies()
+    assert deps['osm'] == set()
+    assert deps['rules_a'] == set()
+    assert deps['rules_b'] == set(['rules_a'])
+    assert deps['a'] == set(['osm', 'rules_a', 'rules_b'])
+    assert deps['b'] == set(['osm', 'rules_a', 'rules_b'])
+    assert deps['aggregate_a'] == set(['a'])
+
+
+def test_duplicate_stage():
+    sched = Scheduler(FakeDB)
+    sched.add('a', record)
+    with pytest.raises(ValueError):
+        sched.add('a', record)
+
+
+def test_run_parallel_respects_dependencies():
+    log = []
+    sched = Scheduler(FakeDB, jobs=4)
+    sched.add('roads', record, [], ['roads'], log, 'roads', 0.05)
+    sched.add('a', record, ['roads'], ['a'], log, 'a', 0.05)
+    sched.add('b', record, ['roads'], ['b'], log, 'b', 0.05)
+    sched.add('c', record, ['a', 'b'], ['c'], log, 'c')
+
+    done = sched.run()
+    assert sorted(done) == ['a', 'b', 'c', 'roads']
+    assert log[0] == 'roads'
+    assert log[-1] == 'c'
+
+
+def test_run_parallel_uses_one_connection_per_worker():
+    connections = []
+    lock = threading.Lock()
+
+    def connect():
+        with lock:
+            connections.append(FakeDB())
+        return connections[-1]
+
+    sched = Scheduler(connect, jobs=2)
+    for x in range(4):
+        sched.add(str(x), record, [], [str(x)], [], str(x), 0.02)
+    sched.run()
+    assert 1 <= len(connections) <= 2
+
+
+def test_run_parallel_failure():
+    log = []
+
+    def fail(db):
+        raise RuntimeError("boom")
+
+    sched = Scheduler(FakeDB, jobs=2)
+    sched.add('a', fail, [], ['a'])
+    sched.add('b', record, ['a'], ['b'], log, 'b')
+    with pytest.raises(RuntimeError):
+        sched.run()
+    assert log == []
+
+
+class FakeState(object):
+    def __init__(self, completed):
+        self.completed = set(completed)
+        self.marked = []
+
+    def is_done(self, db, stage):
+        return stage.name in self.completed
+
+    def mark_done(self, db, stage):
+        self.marked.append(stage.name)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_run_resume_skips_completed_stages(jobs):
+    log = []
+    state = FakeState(['roads', 'a', 'c'])
+    sched = Scheduler(FakeDB, jobs=jobs, state=state)
+    sched.add('roads', record, [], ['roads'], log, 'roads')
+    sched.add('a', record, ['roads'], ['a'], log, 'a')
+    sched.add('b', record, ['roads'], ['b'], log, 'b')
+    sched.add('c', record, ['b'], ['c'], log, 'c')
+
+    done = sched.run()
+    assert sorted(done) == ['a', 'b', 'c', 'roads']
+    # 'c' depends on 'b' which had to run again
+    assert log == ['b', 'c']
+    assert sorted(state.marked) == ['b', 'c']
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_run_releases_connections(jobs):
+    released = []
+    sched = Scheduler(FakeDB, jobs=jobs, release=released.append)
+    for x in range(3):
+        sched.add(str(x), record, [], [str(x)], [], str(x), 0.01)
+    sched.run()
+    assert 1 <= len(released) <= jobs
+    assert all(isinstance(x, FakeDB) for x in released)
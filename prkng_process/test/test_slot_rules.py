@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from .. import common
+
+
+AGENDA = {'1': [[8.0, 18.0]], '2': [], '3': [], '4': [], '5': [], '6': [], '7': []}
+PAID = {'code': 'PX-10', 'description': 'P 10h-18h', 'agenda': AGENDA, 'periods': [],
+        'restrict_types': ['paid'], 'time_max_parking': 120, 'special_days': None}
+PERMIT = {'code': 'RPZ-A', 'description': 'Permit only', 'agenda': AGENDA, 'periods': [],
+          'restrict_types': ['permit'], 'time_max_parking': None, 'special_days': None}
+
+# rules of each slot as embedded before normalisation, the same rules
+# with other slot specific attributes (or none of them) in several slots
+SLOTS = [
+    [dict(PAID, paid_hourly_rate=2.5, address='12 Rue 1'),
+     dict(PERMIT, permit_no='A', address=None)],
+    [dict(PAID, paid_hourly_rate=3.0, address='14 Rue 1'), PERMIT],
+    [],
+]
+
+
+@pytest.fixture(scope="module")
+def cur():
+    from ..commands import test_database
+    try:
+        db = test_database()
+        cur = db.db.cursor()
+        cur.execute("create extension if not exists postgis")
+    except Exception as err:
+        pytest.skip("no test database: {}".format(err))
+    # everything is rolled back once done
+    yield cur
+    db.db.rollback()
+    db.close()
+
+
+def load(cur, slots, start=0):
+    for rid, rules in enumerate(slots, start=start):
+        cur.execute("INSERT INTO testcity_slots (city, rid, rules) VALUES ('testcity', %s, %s::jsonb)",
+                    (rid, json.dumps(rules)))
+    cur.execute(common.normalise_slot_rules.format(city='testcity'))
+
+
+def test_round_trip(cur):
+    cur.execute(common.create_slots)
+    cur.execute(common.create_slots_partition.format(city='testcity'))
+    cur.execute("SELECT count(*) FROM slot_rules")
+    before = cur.fetchone()[0]
+    load(cur, SLOTS)
+
+    # each rule is interned once, without the attributes specific to the slots
+    cur.execute("SELECT rule FROM slot_rules ORDER BY id OFFSET %s", (before,))
+    assert sorted([x[0] for x in cur.fetchall()]) == [PAID, PERMIT]
+    cur.execute("SELECT rules, rule_ids, rule_extras FROM testcity_slots ORDER BY rid")
+    slots = cur.fetchall()
+    assert all(x[0] is None for x in slots)
+    assert slots[0][1] == slots[1][1]
+    assert slots[2][1:] == ([], [])
+    assert slots[0][2] == [{'paid_hourly_rate': 2.5, 'address': '12 Rue 1'},
+                           {'permit_no': 'A', 'address': None}]
+    assert slots[1][2] == [{'paid_hourly_rate': 3.0, 'address': '14 Rue 1'}, {}]
+
+    # slots of a later run reuse the ids of the rules already interned
+    load(cur, SLOTS[:1], start=len(SLOTS))
+    cur.execute("SELECT count(*) FROM slot_rules")
+    assert cur.fetchone()[0] == before + 2
+    cur.execute("SELECT rule_ids FROM testcity_slots ORDER BY rid")
+    ids = [x[0] for x in cur.fetchall()]
+    assert ids[-1] == ids[0]
+
+    # the view gives back the rules as they were embedded
+    cur.execute("SELECT rules FROM slots_rules WHERE city = 'testcity' ORDER BY rid")
+    assert [x[0] for x in cur.fetchall()] == SLOTS + SLOTS[:1]
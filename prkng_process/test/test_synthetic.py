@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+
+from ..synthetic import SyntheticCity, city_rules, create_city_sources, create_osm_lines, rule_codes
+
+
+RULES = [(u'PV-JF', u'P 60 min 08h-18h LUN. AU VEN.'), (u'SV-AM', u'\\P 08h-10h')]
+
+
+def test_rule_codes():
+    codes = rule_codes(os.path.join(os.path.dirname(__file__), '..', 'data', 'rules_montreal.csv'))
+    assert codes
+    assert all(not code.startswith(('RB', 'RC', 'RG', 'RH', 'RK')) for code, _ in codes)
+    assert 'RD-TT' not in [code for code, _ in codes]
+
+
+def test_city():
+    city = SyntheticCity(1000, RULES, seed=3)
+    blocks = list(city.blocks())
+    assert len(blocks) == 2 * city.size * (city.size - 1)
+    assert len(set(x[0] for x in blocks)) == len(blocks)
+    assert [x[0] for x in city.roads()] == [x[0] for x in blocks]
+
+    posts = list(city.signposts())
+    assert 800 <= len(posts) <= 1500
+    assert len(set(x[0] for x in posts)) == len(posts)
+    assert set(x[2] for x in posts) <= set(1000000 + x[0] for x in blocks)
+
+    signs = list(city.signs())
+    assert set(x[1] for x in signs) == set(x[0] for x in posts)
+    assert set((x[4], x[5]) for x in signs) <= set(RULES)
+    assert set(x[3] for x in signs) <= set([0, 2, 3])
+
+    # reproducible
+    assert list(SyntheticCity(1000, RULES, seed=3).signposts()) == posts
+    assert list(SyntheticCity(1000, RULES, seed=4).signposts()) != posts
+
+
+def test_city_sources():
+    city = SyntheticCity(600, RULES, seed=3)
+    for name in ('quebec', 'newyork', 'seattle', 'boston'):
+        rules = city_rules(name)
+        assert rules
+        sources = getattr(city, name + '_sources')(rules)
+        for table, columns, rows in sources:
+            # every table and column loaded is created by the fixture
+            create = re.search(r'CREATE TABLE {} \((.*?)\)$'.format(table),
+                               create_city_sources[name], re.S | re.M).group(1)
+            for column in columns:
+                assert re.search(r'\b{} \w'.format(column), create), (table, column)
+            assert rows, table
+            assert all(len(row) == len(columns) for row in rows), table
+        sources = {table: (columns, rows) for table, columns, rows in sources}
+
+        if name == 'newyork':
+            orders = set(x[1] for x in sources['newyork_roads_locations'][1])
+            assert set(x[2] for x in sources['newyork_signs_raw'][1]) <= orders
+        elif name == 'seattle':
+            units = set(x[0] for x in sources['seattle_signs_raw'][1])
+            codes = sources['seattle_sign_codes'][1]
+            assert set(code for code, _ in codes) <= set(code for code, _ in rules)
+            assert set(re.findall(r'SGN\d+', ''.join(x[1] for x in codes))) == units
+        elif name == 'boston':
+            names = set(x[2] for x in sources['boston_geobase'][1])
+            for _, street, from_st, to_st, _ in sources['boston_sweep_sched'][1]:
+                assert set([street, from_st, to_st]) <= names
+            assert set(x[2] for x in sources['boston_metro_geobase'][1]) == set(['CAMBRIDGE'])
+
+    lines = list(city.osm_lines())
+    assert len(lines) == 2 * city.size
+    assert all(len(x) == 4 for x in lines)
+    assert 'way geometry' in create_osm_lines